@@ -0,0 +1,129 @@
+from flask import current_app, request, send_from_directory
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+# фото товаров уже называются по хэшу содержимого (или uuid) и не меняются
+IMMUTABLE_PREFIXES = (DIST_DIR + '/', 'img/products/')
+SKIP_PREFIXES = (DIST_DIR + '/', 'img/products/')
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.ico', '.map'}
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+MAX_AGE = 365 * 24 * 3600
+
+
+def fingerprint(path, data):
+    root, ext = os.path.splitext(path)
+    return f'{root}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+
+
+def build_assets(static_folder, clean=False):
+    # Копирует статику в static/dist под именами с хэшем содержимого, рядом
+    # кладёт .br/.gz версии текстовых файлов и пишет manifest.json
+    # {исходный путь: {'path': путь с хэшем, 'encodings': [...]}}
+    dist = os.path.join(static_folder, DIST_DIR)
+    if clean:
+        shutil.rmtree(dist, ignore_errors=True)
+    manifest = {}
+    for root, dirs, files in os.walk(static_folder):
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            path = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            if path.startswith(SKIP_PREFIXES) or name.startswith('.'):
+                continue
+            with open(source, 'rb') as f:
+                data = f.read()
+            hashed = fingerprint(path, data)
+            target = os.path.join(dist, hashed)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if not os.path.exists(target):
+                with open(target, 'wb') as f:
+                    f.write(data)
+            encodings = []
+            if os.path.splitext(name)[1].lower() in COMPRESSIBLE:
+                compressed = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+                if brotli is not None:
+                    compressed['br'] = brotli.compress(data, quality=11)
+                for encoding, ext in ENCODINGS:
+                    if encoding in compressed and len(compressed[encoding]) < len(data):
+                        with open(target + ext, 'wb') as f:
+                            f.write(compressed[encoding])
+                        encodings.append(encoding)
+            manifest[path] = {'path': hashed, 'encodings': encodings}
+    with open(os.path.join(dist, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+class AssetManifest:
+    # Манифест статики одного приложения (app.extensions['assets'])
+
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self.files = {}
+        self.encodings = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(os.path.join(self.static_folder, DIST_DIR, MANIFEST)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        self.files = {path: DIST_DIR + '/' + entry['path'] for path, entry in manifest.items()}
+        self.encodings = {DIST_DIR + '/' + entry['path']: entry['encodings'] for entry in manifest.values()}
+
+
+class Assets:
+    # url_for('static', filename=...) отдаёт путь из манифеста, а обработчик
+    # статики выбирает сжатую версию по Accept-Encoding и ставит
+    # Cache-Control: immutable для файлов, имена которых не переиспользуются
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['assets'] = AssetManifest(app.static_folder)
+        app.url_defaults(self.static_url_defaults)
+        app.view_functions['static'] = self.send_static_file
+
+    def load(self):
+        # перечитать манифест текущего приложения после flask assets-build
+        current_app.extensions['assets'].load()
+
+    def static_url_defaults(self, endpoint, values):
+        files = current_app.extensions['assets'].files
+        if endpoint == 'static' and values.get('filename') in files:
+            values['filename'] = files[values['filename']]
+
+    def send_static_file(self, filename):
+        manifest = current_app.extensions['assets']
+        folder = manifest.static_folder
+        mimetype = mimetypes.guess_type(filename)[0]
+        available = manifest.encodings.get(filename, ())
+        for encoding, ext in ENCODINGS:
+            if encoding in available and request.accept_encodings[encoding]:
+                response = send_from_directory(folder, filename + ext, mimetype=mimetype)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(folder, filename, mimetype=mimetype)
+        if available:
+            response.vary.add('Accept-Encoding')
+        if filename.startswith(IMMUTABLE_PREFIXES):
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = MAX_AGE
+            response.cache_control.immutable = True
+        return response
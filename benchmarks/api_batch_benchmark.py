@@ -0,0 +1,72 @@
+"""Пакетные эндпоинты товаров против поштучного API.
+
+    python benchmarks/api_batch_benchmark.py --items 10000
+
+Сравнивает чтение N товаров через GET /api/v1/product/<id> и одним
+GET /api/v1/products?ids=..., удаление через DELETE /api/v1/product/<id> и
+одним DELETE /api/v1/products:batch, а также создание и обновление N товаров
+одним POST /api/v1/products:batch (JSON и NDJSON).
+"""
+import argparse
+import json
+import shutil
+import time
+
+from common import ADMIN_EMAIL, ADMIN_PASSWORD, import_server, set_admin_password, temp_database
+
+
+def new_items(count, prefix):
+    return [{'name': f'{prefix} {i}', 'price': 100 + i % 900, 'description': f'<p>{prefix} {i}</p>',
+             'img_1': 'a.png', 'img_2': 'a.png', 'img_3': 'a.png'} for i in range(count)]
+
+
+def timed(label, count, fn):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    print(f'{label:<44}{elapsed:>9.2f} с{count / elapsed:>12.0f} товаров/с')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=10000)
+    args = parser.parse_args()
+
+    tmp, db_path, env = temp_database()
+    set_admin_password(db_path)
+    server = import_server(env)
+    app = server.create_app()
+    client = app.test_client()
+    token = client.post('/api/v1/jwt_login',
+                        headers={'email': ADMIN_EMAIL, 'password': ADMIN_PASSWORD}).json['access_token']
+    auth = {'Authorization': f'Bearer {token}'}
+    n = args.items
+
+    created = timed(f'POST :batch, создание {n} (JSON)', n, lambda: client.post(
+        '/api/v1/products:batch', headers=auth, json=new_items(n, 'json')).json['response'])
+    ids = [item['id'] for item in created]
+    ndjson = '\n'.join(json.dumps(item) for item in new_items(n, 'ndjson'))
+    more = timed(f'POST :batch, создание {n} (NDJSON)', n, lambda: client.post(
+        '/api/v1/products:batch', headers=auth, data=ndjson, content_type='application/x-ndjson').json['response'])
+    timed(f'POST :batch, обновление цены {n}', n, lambda: client.post(
+        '/api/v1/products:batch', headers=auth, json=[{'id': id, 'price': 1} for id in ids]))
+
+    timed(f'GET /product/<id> x {n}', n, lambda: [client.get(f'/api/v1/product/{id}', headers=auth) for id in ids])
+    batch = timed(f'GET /products?ids=... ({n} id)', n, lambda: client.get(
+        '/api/v1/products?ids=' + ','.join(map(str, ids)), headers=auth).json['response'])
+    assert all(item['status'] == 200 for item in batch)
+
+    half = n // 2
+    timed(f'DELETE /product/<id> x {half}', half,
+          lambda: [client.delete(f'/api/v1/product/{id}', headers=auth) for id in ids[:half]])
+    rest = ids[half:] + [item['id'] for item in more]
+    # не больше API_MAX_BATCH id за запрос
+    timed(f'DELETE :batch ({len(rest)} id)', len(rest), lambda: [client.delete(
+        '/api/v1/products:batch', headers=auth, json={'ids': rest[start:start + server.API_MAX_BATCH]})
+        for start in range(0, len(rest), server.API_MAX_BATCH)])
+    shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Выгрузка большого списка через API: страницы JSON против потока NDJSON.
+
+    python benchmarks/api_stream_benchmark.py --rows 1000000
+
+На копии instance/users.db создаёт --rows пользователей и выгружает их все
+через GET /api/v1/users: страницами по 1000 (?cursor=...) и одним запросом
+с Accept: application/x-ndjson, с провайдерами JSON json и orjson. Каждый
+вариант выполняется в отдельном процессе дважды: замер времени (общее, до
+первого байта, строк в секунду) и отдельно, под tracemalloc, пик памяти
+Python на выгрузку. RSS процесса не показателен: его растят кэш страниц и
+mmap SQLite (профиль tuned), одинаково во всех вариантах.
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from common import ADMIN_EMAIL, ADMIN_PASSWORD, ROOT, import_server, set_admin_password, temp_database
+
+PAGE = 1000
+MODES = [
+    ('pages', 'json'),
+    ('pages', 'orjson'),
+    ('ndjson', 'json'),
+    ('ndjson', 'orjson'),
+]
+
+
+def add_users(db_path, rows):
+    con = sqlite3.connect(db_path)
+    start = con.execute('SELECT max(id) FROM user').fetchone()[0] + 1
+    con.executemany('INSERT INTO user (id, name, email, password_hash) VALUES (?, ?, ?, ?)',
+                    ((i, f'Покупатель {i}', f'user{i}@example.com', 'x') for i in range(start, start + rows)))
+    con.commit()
+    con.close()
+
+
+def child(mode, provider, measure):
+    server = import_server()
+    app = server.create_app({'JSON_PROVIDER': provider, 'CLI_COMMANDS': False})
+    client = app.test_client()
+    token = client.post('/api/v1/jwt_login', headers={'email': ADMIN_EMAIL, 'password': ADMIN_PASSWORD}).json[
+        'access_token']
+    auth = {'Authorization': f'Bearer {token}'}
+    client.get('/api/v1/users?limit=10', headers=auth)
+    if measure == 'memory':
+        tracemalloc.start()
+
+    rows = size = 0
+    first_byte = None
+    start = time.perf_counter()
+    if mode == 'pages':
+        cursor = 0
+        while cursor is not None:
+            response = client.get(f'/api/v1/users?limit={PAGE}&cursor={cursor}', headers=auth)
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+            size += len(response.data)
+            page = response.json
+            rows += len(page['response'])
+            cursor = page['next_cursor']
+    else:
+        response = client.get('/api/v1/users', headers=dict(auth, Accept='application/x-ndjson'), buffered=False)
+        for chunk in response.response:
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+            size += len(chunk)
+            rows += chunk.count(b'\n')
+        response.close()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] if measure == 'memory' else None
+    print(json.dumps({'rows': rows, 'size': size, 'elapsed': elapsed, 'first_byte': first_byte, 'peak': peak}))
+
+
+def run_child(env, mode, provider, measure):
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', mode, provider, measure],
+                            cwd=ROOT, env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--child', nargs=3, metavar=('MODE', 'PROVIDER', 'MEASURE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child)
+        return
+
+    tmp, db_path, env = temp_database(PYTHONWARNINGS='ignore')
+    set_admin_password(db_path)
+    add_users(db_path, args.rows)
+    print(f'{"вариант":<18}{"строк":>10}{"МиБ":>8}{"время, с":>10}{"TTFB, мс":>10}{"строк/с":>10}'
+          f'{"пик Python, МиБ":>17}')
+    for mode, provider in MODES:
+        timing = run_child(env, mode, provider, 'time')
+        memory = run_child(env, mode, provider, 'memory')
+        print(f'{mode + " / " + provider:<18}{timing["rows"]:>10}{timing["size"] / 2 ** 20:>8.1f}'
+              f'{timing["elapsed"]:>10.2f}{timing["first_byte"] * 1000:>10.1f}'
+              f'{timing["rows"] / timing["elapsed"]:>10.0f}{memory["peak"] / 2 ** 20:>17.2f}')
+    shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
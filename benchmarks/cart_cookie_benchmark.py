@@ -0,0 +1,106 @@
+"""Размер cookie сессии и её цена на каждый запрос для корзин из 1, 10 и 50 товаров.
+
+    python benchmarks/cart_cookie_benchmark.py
+
+На копии instance/users.db (с добавленными товарами) наполняет корзину через
+/add-cart в хранилищах CART_STORE=sql и cookie и сравнивает их со старым
+форматом session['Shoppingcart'] (название, цена, фото и количество каждого
+товара). Для каждого варианта печатает размер cookie и время GET статического
+файла с ней - браузер присылает cookie с каждым запросом, и Flask каждый раз
+её проверяет и разбирает. В конце проверяет, что старая корзина переносится
+в новое хранилище.
+"""
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import import_server, temp_database  # noqa: E402
+
+SIZES = (1, 10, 50)
+ROUNDS = 2000
+STATIC = '/static/css/style.css'
+
+
+def add_products(db_path, count):
+    con = sqlite3.connect(db_path)
+    first = con.execute('SELECT max(id) FROM products').fetchone()[0] + 1
+    img = con.execute('SELECT img_1 FROM products LIMIT 1').fetchone()[0]
+    con.executemany(
+        'INSERT INTO products (id, name, price, description, img_1, img_2, img_3, stock, sold) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, 0, 0)',
+        [(i, f'Microsoft Office 2021 Professional Plus {i}', 2990 + i, 'ключ', img, img, img)
+         for i in range(first, first + count)])
+    con.executemany('INSERT INTO activation_keys (product_id, key) VALUES (?, ?)',
+                    [(i, f'CART-{i}-{k}') for i in range(first, first + count) for k in range(5)])
+    con.commit()
+    ids = [row[0] for row in con.execute('SELECT id FROM products WHERE stock > 0 ORDER BY id')]
+    con.close()
+    return ids
+
+
+def session_cookie(client):
+    return next((cookie.value for cookie in client.cookie_jar if cookie.name == 'session'), '')
+
+
+def request_ms(app, cookie):
+    # без cookie_jar: иначе тестовый клиент заменяет заголовок Cookie своими cookie
+    client = app.test_client(use_cookies=False)
+    headers = {'Cookie': f'session={cookie}'} if cookie else {}
+    samples = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        client.get(STATIC, headers=headers).close()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def legacy_cookie(app, server, ids):
+    # cookie, которую выставлял прежний add_cart()
+    with app.app_context():
+        products = server.Products.query.filter(server.Products.id.in_(ids)).all()
+    cart = {str(product.id): {'name': product.name, 'price': product.price, 'quantity': '1',
+                              'image': product.img_1} for product in products}
+    return app.session_interface.get_signing_serializer(app).dumps({'Shoppingcart': cart})
+
+
+def main():
+    tmp, db_path, env = temp_database()
+    ids = add_products(db_path, max(SIZES))
+    server = import_server(env)
+    apps = {store: server.create_app({'CART_STORE': store, 'CLI_COMMANDS': False, 'RATELIMIT_ENABLED': False})
+            for store in ('sql', 'cookie')}
+    # старую cookie разбирают как раньше, без переноса корзины на каждом запросе
+    legacy_app = server.create_app({'CLI_COMMANDS': False})
+    legacy_app.before_request_funcs[None].remove(server.migrate_legacy_cart)
+    print(f'{"корзина":<10}{"формат":<10}{"cookie, байт":>14}{"GET статики, мс":>18}')
+    print(f'{"-":<10}{"нет":<10}{0:>14}{request_ms(apps["sql"], ""):>18.3f}')
+    for size in SIZES:
+        cookies = {'старый': legacy_cookie(apps['sql'], server, ids[:size])}
+        for store, app in apps.items():
+            client = app.test_client()
+            for product_id in ids[:size]:
+                client.post('/add-cart', data={'product_id': product_id, 'quantity': 1},
+                            headers={'Referer': '/catalog'})
+            cookies[store] = session_cookie(client)
+        for name, cookie in cookies.items():
+            app = legacy_app if name == 'старый' else apps['sql']
+            print(f'{size:<10}{name:<10}{len(cookie):>14}{request_ms(app, cookie):>18.3f}')
+
+    # старая корзина переносится в хранилище при первом запросе
+    for store, app in apps.items():
+        client = app.test_client(use_cookies=False)
+        cookie = legacy_cookie(app, server, ids[:10])
+        response = client.get('/', headers={'Cookie': f'session={cookie}'})
+        cookie = response.headers['Set-Cookie'].split(';', 1)[0]
+        lines = client.get('/cart', headers={'Cookie': cookie}).get_data(as_text=True).count('/update-cart/')
+        print(f'перенос старой корзины в {store}: товаров {lines} из 10')
+        assert lines == 10
+    shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Параллельное оформление заказов против копии instance/users.db.
+
+Запускает несколько процессов, каждый из которых выполняет серию покупок
+одного товара через /add-cart и /pay, и проверяет, что ни один ключ
+активации не был выдан дважды.
+
+    python benchmarks/checkout_concurrency.py --workers 8 --orders 20
+"""
+import argparse
+import multiprocessing
+import shutil
+import sqlite3
+import time
+
+from common import database_env, import_server, temp_database
+
+
+def seed(db_path, product_id, total):
+    con = sqlite3.connect(db_path)
+    con.execute('DELETE FROM activation_keys WHERE product_id = ?', (product_id,))
+    con.executemany(
+        'INSERT INTO activation_keys (product_id, key) VALUES (?, ?)',
+        [(product_id, f'KEY-{product_id}-{i:08d}') for i in range(total)]
+    )
+    con.commit()
+    con.close()
+
+
+def worker(db_path, product_id, orders, quantity, queue):
+    server = import_server(database_env(db_path))
+    app = server.create_app({'WTF_CSRF_ENABLED': False})
+    issued = []
+    server.send_notification = lambda email, txt: issued.extend(
+        line.split(' ', 1)[0] for line in txt.split('\n') if line)
+    client = app.test_client()
+    headers = {'Referer': '/catalog'}
+    for _ in range(orders):
+        client.post('/add-cart', data={'product_id': product_id, 'quantity': quantity}, headers=headers)
+        client.post('/pay', data={'email': 'bench@example.com', 'card_number': 4242})
+    queue.put(issued)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--orders', type=int, default=20)
+    parser.add_argument('--quantity', type=int, default=2)
+    parser.add_argument('--product', type=int, default=2)
+    args = parser.parse_args()
+
+    tmp, db_path, _ = temp_database()
+    # ключей меньше, чем хотят купить все процессы, чтобы часть заказов упёрлась в нехватку
+    total = args.workers * args.orders * args.quantity * 3 // 4
+    seed(db_path, args.product, total)
+
+    queue = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=worker,
+                                     args=(db_path, args.product, args.orders, args.quantity, queue))
+             for _ in range(args.workers)]
+    start = time.perf_counter()
+    for p in procs:
+        p.start()
+    issued = [key for _ in procs for key in queue.get()]
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - start
+
+    con = sqlite3.connect(db_path)
+    left = con.execute('SELECT COUNT(*) FROM activation_keys WHERE product_id = ?',
+                       (args.product,)).fetchone()[0]
+    stock = con.execute('SELECT stock FROM products WHERE id = ?', (args.product,)).fetchone()[0]
+    con.close()
+    shutil.rmtree(tmp)
+
+    print(f'выдано ключей: {len(issued)}, уникальных: {len(set(issued))}, '
+          f'осталось: {left}, stock: {stock}, время: {elapsed:.2f}s')
+    assert len(issued) == len(set(issued)), 'ключ выдан дважды'
+    assert len(issued) + left == total, 'потеряны ключи'
+    assert stock == left, 'stock расходится с количеством ключей'
+
+
+if __name__ == '__main__':
+    main()
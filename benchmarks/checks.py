@@ -0,0 +1,45 @@
+"""Все регрессионные проверки одной командой.
+
+    python benchmarks/checks.py                      # все проверки
+    python benchmarks/checks.py query_budgets query_plans
+
+Каждая проверка запускается отдельным процессом (скрипты меняют окружение и
+импортируют server со своей копией базы) с параметрами по умолчанию. В конце
+печатается итог; код возврата 1, если хотя бы одна проверка упала.
+"""
+import os
+import subprocess
+import sys
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+CHECKS = (
+    'query_budgets',         # бюджеты SQL запросов и N+1 для всех маршрутов
+    'query_plans',           # планы запросов без полного сканирования таблиц
+    'conditional_get',       # ETag/Last-Modified и их смена при каждой записи
+    'checkout_concurrency',  # параллельные покупки не выдают ключ дважды
+    'error_responses',       # ошибки JWT в API и 500.html для страниц
+    'static_assets',         # сжатая статика с хэшем в имени и её заголовки
+)
+
+
+def main():
+    names = sys.argv[1:] or CHECKS
+    unknown = set(names) - set(CHECKS)
+    if unknown:
+        sys.exit(f'неизвестные проверки: {", ".join(sorted(unknown))}; есть: {", ".join(CHECKS)}')
+    results = []
+    for name in names:
+        print(f'== {name}', flush=True)
+        start = time.perf_counter()
+        code = subprocess.run([sys.executable, os.path.join(BENCHMARKS, name + '.py')]).returncode
+        results.append((name, code, time.perf_counter() - start))
+    print()
+    for name, code, elapsed in results:
+        print(f'{"ok  " if code == 0 else "FAIL"} {name:<22}{elapsed:7.1f} с')
+    if any(code for _, code, _ in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
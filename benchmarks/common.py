@@ -0,0 +1,77 @@
+"""Общая подготовка бенчмарков и проверок.
+
+Каждый скрипт работает на своей копии instance/users.db во временном
+каталоге, с применёнными миграциями:
+
+    tmp, db_path, env = temp_database()
+    set_admin_password(db_path)
+    server = import_server(env)
+    app = server.create_app({'WTF_CSRF_ENABLED': False, 'CLI_COMMANDS': False})
+    ...
+    shutil.rmtree(tmp)
+
+Скрипты, которые запускают приложение в дочерних процессах, передают им env.
+"""
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+from werkzeug.security import generate_password_hash
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ADMIN_ID = 1
+ADMIN_EMAIL = 'admin@gmail.com'
+# пароль админа известен только копиям базы - нужен для /login и /api/v1/jwt_login
+ADMIN_PASSWORD = 'benchmark'
+
+
+def database_env(db_path, **overrides):
+    # окружение приложения на копии базы; по умолчанию почта не рассылается
+    # фоновыми потоками (MAIL_WORKERS=0)
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + db_path, FLASK_APP='server', MAIL_WORKERS='0')
+    env.update(overrides)
+    return env
+
+
+def copy_database(db_path, env=None):
+    # копия instance/users.db с применёнными миграциями (flask db upgrade)
+    shutil.copy(os.path.join(ROOT, 'instance', 'users.db'), db_path)
+    subprocess.run([sys.executable, '-m', 'flask', 'db', 'upgrade'], cwd=ROOT, env=env or database_env(db_path),
+                   check=True, capture_output=True)
+
+
+def temp_database(**overrides):
+    # временный каталог с копией базы; возвращает (каталог, путь к базе, окружение)
+    tmp = tempfile.mkdtemp()
+    db_path = os.path.join(tmp, 'users.db')
+    env = database_env(db_path, **overrides)
+    copy_database(db_path, env)
+    return tmp, db_path, env
+
+
+def set_admin_password(db_path, password=ADMIN_PASSWORD):
+    con = sqlite3.connect(db_path)
+    con.execute('UPDATE user SET password_hash = ? WHERE id = ?', (generate_password_hash(password), ADMIN_ID))
+    con.commit()
+    con.close()
+
+
+def import_server(env=None):
+    # server читает DATABASE_URL и прочие настройки из окружения в create_app
+    if env is not None:
+        os.environ.update(env)
+    os.chdir(ROOT)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    import server
+    return server
+
+
+def copy_uploads(tmp, server):
+    # удаление товара стирает его фото, поэтому скрипты работают с копией папки загрузок
+    uploads = os.path.join(tmp, 'products')
+    shutil.copytree(os.path.join(ROOT, server.UPLOAD_FOLDER), uploads)
+    return uploads
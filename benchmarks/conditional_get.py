@@ -0,0 +1,159 @@
+"""Условные GET для страницы товара и GET /api/v1/product/<id>.
+
+    python benchmarks/conditional_get.py
+
+На копии instance/users.db проверяет, что повторный запрос с If-None-Match
+получает 304 без рендера шаблонов (считаются вызовы jinja_env.get_template),
+что страница товара, зависящая от пользователя и корзины, не отдаёт
+Last-Modified и не отвечает 304 по одному If-Modified-Since (API товара -
+отвечает), что каждый путь записи - редактирование в админке,
+импорт ключей, покупка, POST /api/v1/products:batch, фото - меняет ETag, а
+удалённый товар отдаёт 404. В конце сравнивает время ответа 200 и 304.
+"""
+import io
+import shutil
+import sys
+import time
+
+from common import ADMIN_EMAIL, ADMIN_PASSWORD, copy_uploads, import_server, set_admin_password, temp_database
+
+PRODUCT = 2
+ROUNDS = 300
+
+
+def main():
+    tmp, db_path, env = temp_database()
+    set_admin_password(db_path)
+    server = import_server(env)
+    app = server.create_app({'WTF_CSRF_ENABLED': False, 'UPLOAD_FOLDER': copy_uploads(tmp, server),
+                             'CLI_COMMANDS': False})
+    rendered = []
+    get_template = app.jinja_env.get_template
+
+    def counting_get_template(name, *args, **kwargs):
+        rendered.append(name)
+        return get_template(name, *args, **kwargs)
+
+    app.jinja_env.get_template = counting_get_template
+    client = app.test_client()
+    token = client.post('/api/v1/jwt_login', headers={'email': ADMIN_EMAIL, 'password': ADMIN_PASSWORD}).json[
+        'access_token']
+    auth = {'Authorization': f'Bearer {token}'}
+    failures = []
+
+    def check(condition, message):
+        print(f'{"ok  " if condition else "FAIL"} {message}')
+        if not condition:
+            failures.append(message)
+
+    def page(headers=None):
+        rendered.clear()
+        return client.get(f'/product/{PRODUCT}', headers=headers or {})
+
+    def api(headers=None):
+        return client.get(f'/api/v1/product/{PRODUCT}', headers=dict(auth, **(headers or {})))
+
+    def changes_etag(label, write):
+        before_page, before_api = page(), api()
+        write()
+        page()  # показать flash сообщение после записи
+        after_page = page({'If-None-Match': before_page.headers['ETag']})
+        after_api = api({'If-None-Match': before_api.headers['ETag']})
+        check(after_page.status_code == 200 and after_api.status_code == 200, f'{label}: ETag изменился')
+
+    first = page()
+    check(first.status_code == 200 and first.headers['ETag'].startswith('W/')
+          and 'Last-Modified' not in first.headers, 'страница товара: 200 со слабым ETag, без Last-Modified')
+    second = page({'If-None-Match': first.headers['ETag']})
+    check(second.status_code == 304 and not second.data and not rendered,
+          'страница товара: If-None-Match -> 304 без рендера шаблонов')
+
+    first = api()
+    check(first.status_code == 200 and 'Last-Modified' in first.headers, 'API товара: 200 с ETag и Last-Modified')
+    second = api({'If-None-Match': first.headers['ETag']})
+    check(second.status_code == 304 and not second.data, 'API товара: If-None-Match -> 304')
+    second = api({'If-Modified-Since': first.headers['Last-Modified']})
+    check(second.status_code == 304, 'API товара: If-Modified-Since -> 304')
+    # шапка меняется после входа, а товар - нет
+    client.post('/login', data={'email': ADMIN_EMAIL, 'password_hash': ADMIN_PASSWORD})
+    page()
+    check(page({'If-Modified-Since': first.headers['Last-Modified']}).status_code == 200,
+          'страница товара: If-Modified-Since без ETag -> 200')
+    client.get('/logout')
+    page()
+
+    # страница с flash сообщением рендерится и отдаётся без ETag
+    client.post('/login', data={'email': ADMIN_EMAIL, 'password_hash': ADMIN_PASSWORD})
+    check('ETag' not in page().headers, 'flash сообщение: без ETag')
+    etag = page().headers['ETag']
+    check(page({'If-None-Match': etag}).status_code == 304, 'после входа: 304 для нового ETag')
+    client.get('/logout')
+    page()
+    check(page({'If-None-Match': etag}).status_code == 200, 'после выхода шапка другая: 200')
+    client.post('/login', data={'email': ADMIN_EMAIL, 'password_hash': ADMIN_PASSWORD})
+    page()
+
+    def edit():
+        with app.app_context():
+            product = server.db.session.get(server.Products, PRODUCT)
+        client.post(f'/edit-product/{PRODUCT}', data={'name': product.name + '!', 'price': product.price,
+                                                       'description': product.description})
+
+    def import_keys():
+        with app.app_context():
+            server.import_activation_keys(PRODUCT, io.BytesIO(b'CONDITIONAL-GET-KEY-1\n'))
+            server.db.session.commit()
+
+    def buy():
+        client.post('/add-cart', data={'product_id': PRODUCT, 'quantity': 1}, headers={'Referer': '/catalog'})
+        client.post('/pay', data={'email': 'buyer@example.com', 'card_number': 4242})
+
+    def batch():
+        client.post('/api/v1/products:batch', json=[{'id': PRODUCT, 'price': 999}], headers=auth)
+
+    def photo():
+        with app.app_context():
+            product = server.db.session.get(server.Products, PRODUCT)
+            server.save_photo_variants(PRODUCT, 'img_1', product.img_1, {'hash': 'x', 'widths': {}})
+
+    changes_etag('редактирование', edit)
+    changes_etag('импорт ключей', import_keys)
+    changes_etag('покупка', buy)
+    changes_etag('POST /api/v1/products:batch', batch)
+    changes_etag('варианты фото', photo)
+
+    # неверное фото: правка отклоняется целиком, ключи из той же формы не импортируются
+    with app.app_context():
+        before = server.db.session.get(server.Products, PRODUCT)
+        before = (before.name, before.stock)
+    etag = page().headers['ETag']
+    client.post(f'/edit-product/{PRODUCT}', content_type='multipart/form-data',
+                data={'name': 'не сохранится', 'price': 1, 'description': '-',
+                      'keys': (io.BytesIO(b'CONDITIONAL-GET-KEY-2\n'), 'keys.txt'),
+                      'img_1': (io.BytesIO(b'not an image'), 'photo.png')})
+    with app.app_context():
+        after = server.db.session.get(server.Products, PRODUCT)
+        after = (after.name, after.stock)
+    page()  # flash с ошибкой
+    check(after == before and page({'If-None-Match': etag}).status_code == 304,
+          'неверное фото: товар и ключи не изменены')
+
+    client.post('/api/v1/products:batch', json=[{'id': PRODUCT, 'price': 1000}], headers=auth)
+    etag = page().headers['ETag']
+    client.delete('/api/v1/products:batch', json={'ids': [PRODUCT]}, headers=auth)
+    check(page({'If-None-Match': etag}).status_code == 404 and api().status_code == 404, 'удаление: 404')
+
+    etag = client.get('/product/3').headers['ETag']
+    for label, headers in (('200', {}), ('304', {'If-None-Match': etag})):
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            client.get('/product/3', headers=headers)
+        print(f'GET /product/3 {label}: {(time.perf_counter() - start) / ROUNDS * 1000:.2f} мс')
+
+    shutil.rmtree(tmp)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Ответы на ошибки API и HTML страниц.
+
+    python benchmarks/error_responses.py
+
+На копии instance/users.db проверяет, что ошибки JWT в ресурсах API
+(нет токена, испорченный токен, токен удалённого пользователя) дают 401/422,
+а не 500, что /api/v1/jwt_login для неизвестной почты отвечает 401, и что
+исключение в HTML странице по-прежнему рендерит 500.html и пишется в лог.
+"""
+import logging
+import shutil
+import sys
+
+from common import ADMIN_EMAIL, ADMIN_PASSWORD, import_server, set_admin_password, temp_database
+
+
+def main():
+    tmp, db_path, env = temp_database()
+    set_admin_password(db_path)
+    server = import_server(env)
+    app = server.create_app({'CLI_COMMANDS': False, 'RATELIMIT_ENABLED': False})
+
+    def fail():
+        raise RuntimeError('проверка 500.html')
+
+    app.add_url_rule('/error-responses-fail', 'error_responses_fail', fail)
+    logged = []
+    handler = logging.Handler()
+    handler.emit = logged.append
+    app.logger.addHandler(handler)
+    client = app.test_client()
+    with app.app_context():
+        orphan = server.create_access_token(identity=10 ** 9)
+    failures = []
+
+    def check(condition, message):
+        print(f'{"ok  " if condition else "FAIL"} {message}')
+        if not condition:
+            failures.append(message)
+
+    def product(headers):
+        return client.get('/api/v1/product/2', headers=headers)
+
+    response = client.post('/api/v1/jwt_login', headers={'email': ADMIN_EMAIL, 'password': ADMIN_PASSWORD})
+    check(response.status_code == 200 and 'access_token' in response.json, 'jwt_login: токен администратора')
+    token = response.json['access_token']
+    response = client.post('/api/v1/jwt_login', headers={'email': 'nobody@example.com', 'password': 'x'})
+    check(response.status_code == 401, f'jwt_login неизвестной почты: {response.status_code}')
+    check(product({'Authorization': f'Bearer {token}'}).status_code == 200, 'API с токеном: 200')
+    check(product({}).status_code == 401, 'API без токена: 401')
+    check(product({'Authorization': 'Bearer not.a.token'}).status_code == 422, 'API с испорченным токеном: 422')
+    check(product({'Authorization': f'Bearer {orphan}'}).status_code == 401, 'API с токеном удалённого: 401')
+
+    logged.clear()
+    response = client.get('/error-responses-fail')
+    check(response.status_code == 500 and 'text/html' in response.content_type, 'HTML страница: 500.html')
+    check(any(record.exc_info for record in logged), 'HTML страница: исключение в логе')
+
+    shutil.rmtree(tmp)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
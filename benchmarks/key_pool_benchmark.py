@@ -0,0 +1,140 @@
+"""Пул арендованных ключей (KEY_POOL_ENABLED) против выдачи из базы.
+
+    python benchmarks/key_pool_benchmark.py --buyers 8 --orders 50
+
+На копии instance/users.db --buyers процессов одновременно покупают один
+товар через /add-cart и /pay - сначала без пула, затем с пулом. Для каждого
+режима печатает заказов в секунду и проверяет, что ключи не выданы дважды,
+не потеряны и stock совпадает с остатком. Затем процесс с пулом арендует
+пачку ключей и падает, не сняв аренду: пока аренда не истекла, другим
+пулам эти ключи недоступны, а после KEY_POOL_LEASE секунд - снова доступны.
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from checkout_concurrency import seed  # noqa: E402
+from common import database_env, import_server, temp_database  # noqa: E402
+
+LEASE = 2
+
+
+def make_app(db_path, pool):
+    server = import_server(database_env(db_path))
+    app = server.create_app({'WTF_CSRF_ENABLED': False, 'CLI_COMMANDS': False, 'METRICS_SLOW_REQUEST': 60,
+                             'KEY_POOL_ENABLED': pool, 'KEY_POOL_LEASE': LEASE})
+    return server, app
+
+
+def buyer(db_path, product_id, orders, quantity, pool, start, queue):
+    server, app = make_app(db_path, pool)
+    issued = []
+    server.send_notification = lambda email, txt: issued.extend(
+        line.split(' ', 1)[0] for line in txt.split('\n') if line)
+    pooled = []
+    key_pool = app.extensions['key_pool']
+    claim = key_pool.claim
+
+    def counting_claim(*args):
+        keys = claim(*args)
+        pooled.extend(keys)
+        return keys
+
+    key_pool.claim = counting_claim
+    client = app.test_client()
+    headers = {'Referer': '/catalog'}
+    start.wait()
+    try:
+        for _ in range(orders):
+            client.post('/add-cart', data={'product_id': product_id, 'quantity': quantity}, headers=headers)
+            client.post('/pay', data={'email': 'bench@example.com', 'card_number': 4242})
+    finally:
+        # упавший покупатель не должен подвесить main(): недовыданные ключи покажет проверка
+        queue.put((issued, len(pooled)))
+
+
+def crash(db_path, product_id):
+    # арендовать пачку ключей и упасть, не снимая аренду
+    _, app = make_app(db_path, True)
+    key_pool = app.extensions['key_pool']
+    key_pool.take(product_id, 0)
+    while not key_pool.held():
+        time.sleep(0.01)
+    os._exit(1)
+
+
+def run(db_path, args, pool, total):
+    start = multiprocessing.Event()
+    queue = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=buyer, args=(db_path, args.product, args.orders, args.quantity,
+                                                         pool, start, queue))
+             for _ in range(args.buyers)]
+    for p in procs:
+        p.start()
+    # приложения созданы, отсчёт идёт с первого заказа
+    time.sleep(2)
+    began = time.perf_counter()
+    start.set()
+    results = [queue.get() for _ in procs]
+    elapsed = time.perf_counter() - began
+    for p in procs:
+        p.join()
+    issued = [key for keys, _ in results for key in keys]
+    pooled = sum(count for _, count in results)
+
+    con = sqlite3.connect(db_path)
+    left = con.execute('SELECT COUNT(*) FROM activation_keys WHERE product_id = ?', (args.product,)).fetchone()[0]
+    stock = con.execute('SELECT stock FROM products WHERE id = ?', (args.product,)).fetchone()[0]
+    con.close()
+    orders = len(issued) // args.quantity
+    print(f'{"пул" if pool else "без пула":<10}заказов: {orders}, {orders / elapsed:8.1f} заказов/с, '
+          f'ключей из пула: {pooled}, осталось: {left}, stock: {stock}')
+    assert len(issued) == len(set(issued)), 'ключ выдан дважды'
+    assert len(issued) + left == total, 'потеряны ключи'
+    assert stock == left, 'stock расходится с количеством ключей'
+    return issued
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--buyers', type=int, default=8)
+    parser.add_argument('--orders', type=int, default=50)
+    parser.add_argument('--quantity', type=int, default=1)
+    parser.add_argument('--product', type=int, default=2)
+    args = parser.parse_args()
+
+    tmp, db_path, _ = temp_database()
+    total = args.buyers * args.orders * args.quantity
+    for pool in (False, True):
+        seed(db_path, args.product, total)
+        run(db_path, args, pool, total)
+
+    seed(db_path, args.product, total)
+    p = multiprocessing.Process(target=crash, args=(db_path, args.product))
+    p.start()
+    p.join()
+    # дальше процессы не создаются, приложение можно поднять здесь
+    server, app = make_app(db_path, False)
+
+    def free():
+        with app.app_context():
+            keys = server.lease_activation_keys(args.product, total, 'bench', datetime.utcnow())
+            server.extend_key_leases([id for id, _ in keys], 'bench', None)
+        return len(keys)
+
+    before = free()
+    time.sleep(LEASE + 0.5)
+    after = free()
+    print(f'упавший процесс: свободных ключей {before} из {total}, после {LEASE} с аренды - {after}')
+    assert before < total and after == total, 'аренда упавшего процесса не вернулась'
+    shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+"""Нагрузочный тест магазина через настоящие маршруты приложения.
+
+    python benchmarks/loadtest --concurrency 8 --duration 20 --products 5000 --out baseline.json
+    python benchmarks/loadtest --concurrency 8 --duration 20 --products 5000 --compare baseline.json
+
+Тест поднимает копию instance/users.db нужного размера, локальный SMTP
+сервер вместо настоящего и гоняет смесь сценариев из scenarios.py в
+нескольких потоках. По каждому маршруту печатает p50/p95/p99, запросов в
+секунду и SQL запросов на запрос. С --compare завершается с кодом 1, если
+какой-то маршрут стал медленнее базового больше чем на --threshold или
+стал делать больше запросов к базе.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from dataset import prepare
+from common import ADMIN_EMAIL, ADMIN_PASSWORD, database_env, import_server
+from scenarios import SCENARIOS
+from smtp_sink import SMTPSink
+
+
+def percentile(samples, p):
+    # samples отсортированы; ближайший ранг
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))]
+
+
+class QueryCounter:
+    # SQL запросы считаются в потоке, который обрабатывает запрос, поэтому
+    # фоновые воркеры почты в счёт не попадают
+    def __init__(self, engines):
+        from sqlalchemy import event
+
+        self.local = threading.local()
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self.count)
+
+    def count(self, *args):
+        self.local.queries = getattr(self.local, 'queries', 0) + 1
+
+    def take(self):
+        queries, self.local.queries = getattr(self.local, 'queries', 0), 0
+        return queries
+
+
+class VirtualUser:
+    def __init__(self, app, counter, seed, product_ids, keyed_product_ids, token):
+        self.client = app.test_client()
+        self.counter = counter
+        self.rnd = random.Random(seed)
+        self.product_ids = product_ids
+        self.keyed_product_ids = keyed_product_ids
+        self.auth = {'Authorization': 'Bearer ' + token}
+        self.samples = {}
+
+    def request(self, route, method, path, **kwargs):
+        self.counter.take()
+        start = time.perf_counter()
+        try:
+            status = self.client.open(path, method=method, **kwargs).status_code
+        except Exception:
+            status = 599
+        elapsed = (time.perf_counter() - start) * 1000
+        stats = self.samples.setdefault(route, {'latency': [], 'queries': 0, 'errors': 0})
+        stats['latency'].append(elapsed)
+        stats['queries'] += self.counter.take()
+        if status >= 500:
+            stats['errors'] += 1
+
+
+def run(args, product_ids, keyed_product_ids):
+    server = import_server()
+    app = server.create_app({'WTF_CSRF_ENABLED': False})
+    with app.app_context():
+        engines = list(server.db.engines.values())
+    counter = QueryCounter(engines)
+    token = app.test_client().post(
+        '/api/v1/jwt_login', headers={'email': ADMIN_EMAIL, 'password': ADMIN_PASSWORD}).json['access_token']
+
+    names = [name for name in SCENARIOS if not args.routes or name in args.routes]
+    weights = [SCENARIOS[name][1] for name in names]
+    users = [VirtualUser(app, counter, seed, product_ids, keyed_product_ids, token)
+             for seed in range(args.concurrency)]
+
+    def loop(user, until):
+        while time.perf_counter() < until:
+            SCENARIOS[user.rnd.choices(names, weights)[0]][0](user)
+
+    def phase(duration):
+        until = time.perf_counter() + duration
+        threads = [threading.Thread(target=loop, args=(user, until)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    # прогрев: кэши страниц, пользователей и соединения пула
+    phase(args.warmup)
+    for user in users:
+        user.samples.clear()
+    start = time.perf_counter()
+    phase(args.duration)
+    elapsed = time.perf_counter() - start
+    # даём воркерам дослать письма, чтобы сверить их число с заказами
+    deadline = time.monotonic() + 30
+    with app.app_context():
+        while time.monotonic() < deadline and server.MailQueue.query.filter(
+                server.MailQueue.status.in_(['pending', 'sending'])).count():
+            time.sleep(0.2)
+
+    routes = {}
+    for user in users:
+        for route, stats in user.samples.items():
+            merged = routes.setdefault(route, {'latency': [], 'queries': 0, 'errors': 0})
+            merged['latency'].extend(stats['latency'])
+            merged['queries'] += stats['queries']
+            merged['errors'] += stats['errors']
+    result = {}
+    for route, stats in sorted(routes.items()):
+        latency = sorted(stats['latency'])
+        result[route] = {
+            'requests': len(latency),
+            'rps': round(len(latency) / elapsed, 2),
+            'p50': round(percentile(latency, 50), 3),
+            'p95': round(percentile(latency, 95), 3),
+            'p99': round(percentile(latency, 99), 3),
+            'queries': round(stats['queries'] / len(latency), 2),
+            'errors': stats['errors'],
+        }
+    return elapsed, result
+
+
+def compare(baseline, current, threshold, min_delta):
+    # Возвращает список регрессий: маршрут стал медленнее (p50 или p95) больше
+    # чем на threshold и хотя бы на min_delta мс, делает больше SQL запросов
+    # или начал отдавать ошибки
+    regressions = []
+    for route, base in baseline['routes'].items():
+        cur = current['routes'].get(route)
+        if cur is None:
+            continue
+        for metric in ('p50', 'p95'):
+            if cur[metric] > base[metric] * (1 + threshold) and cur[metric] - base[metric] > min_delta:
+                regressions.append(f'{route}: {metric} {base[metric]:.1f} -> {cur[metric]:.1f} мс')
+        if cur['queries'] > base['queries'] + 0.5:
+            regressions.append(f'{route}: SQL запросов {base["queries"]} -> {cur["queries"]}')
+        if cur['errors'] > base['errors']:
+            regressions.append(f'{route}: ошибок {base["errors"]} -> {cur["errors"]}')
+    return regressions
+
+
+def print_table(result, baseline=None):
+    print(f'{"маршрут":<24}{"запросов":>9}{"rps":>9}{"p50":>9}{"p95":>9}{"p99":>9}{"SQL":>7}{"ошибок":>8}')
+    for route, row in result['routes'].items():
+        line = (f'{route:<24}{row["requests"]:>9}{row["rps"]:>9.1f}{row["p50"]:>9.2f}'
+                f'{row["p95"]:>9.2f}{row["p99"]:>9.2f}{row["queries"]:>7.1f}{row["errors"]:>8}')
+        base = baseline and baseline['routes'].get(route)
+        if base:
+            line += f'   (p95 было {base["p95"]:.2f})'
+        print(line)
+    print(f'всего: {result["rps"]:.1f} запросов/с, писем принято SMTP: {result["mail_received"]}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--warmup', type=float, default=3)
+    parser.add_argument('--products', type=int, default=1000, help='сколько товаров добавить к базе')
+    parser.add_argument('--reviews', type=int, default=500)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--keyed-products', type=int, default=10, help='товаров с ключами для /pay')
+    parser.add_argument('--keys', type=int, default=5000, help='ключей на каждый такой товар')
+    parser.add_argument('--routes', nargs='*', choices=sorted(SCENARIOS), help='только эти сценарии')
+    parser.add_argument('--no-page-cache', action='store_true')
+    parser.add_argument('--out', help='записать результаты в JSON')
+    parser.add_argument('--compare', help='JSON с базовыми результатами')
+    parser.add_argument('--threshold', type=float, default=0.25, help='допустимое замедление, доля')
+    parser.add_argument('--min-delta', type=float, default=2.0, help='игнорировать замедление меньше, мс')
+    args = parser.parse_args()
+
+    sink = SMTPSink().start()
+    tmp = tempfile.mkdtemp()
+    db_path = os.path.join(tmp, 'users.db')
+    env = database_env(
+        db_path,
+        # письма уходят в SMTPSink фоновыми потоками, как в продакшене
+        MAIL_WORKERS=os.environ.get('MAIL_WORKERS', '2'),
+        MAIL_SERVER='127.0.0.1', MAIL_PORT=str(sink.port), MAIL_USE_TLS='0', MAIL_USERNAME='',
+        PAGE_CACHE_ENABLED='0' if args.no_page_cache else '1',
+        # все виртуальные пользователи приходят с одного адреса
+        RATELIMIT_ENABLED='0',
+    )
+    keyed_product_ids = prepare(db_path, env, args.products, args.reviews, args.users,
+                                args.keyed_products, args.keys)
+    os.environ.update(env)
+
+    import sqlite3
+    con = sqlite3.connect(db_path)
+    product_ids = [row[0] for row in con.execute('SELECT id FROM products')]
+    con.close()
+
+    elapsed, routes = run(args, product_ids, keyed_product_ids)
+    result = {
+        'meta': {
+            'concurrency': args.concurrency, 'duration': args.duration,
+            'products': len(product_ids), 'reviews': args.reviews, 'users': args.users,
+            'page_cache': not args.no_page_cache, 'python': platform.python_version(),
+        },
+        'rps': round(sum(row['requests'] for row in routes.values()) / elapsed, 2),
+        'mail_received': sink.received,
+        'routes': routes,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_table(result, baseline)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+    if baseline:
+        regressions = compare(baseline, result, args.threshold, args.min_delta)
+        for regression in regressions:
+            print('РЕГРЕССИЯ', regression)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+# Подготовка копии instance/users.db заданного размера
+import os
+import random
+import sqlite3
+import sys
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import copy_database, set_admin_password  # noqa: E402
+
+WORDS = ['Windows', 'Office', 'Project', 'Visio', 'Visual', 'Studio', 'Server', 'Home', 'Pro',
+         'Enterprise', 'Professional', 'Plus', 'Standard', 'Ultimate', 'Корпоративная',
+         'Профессиональная', 'Домашняя', 'ключ', 'активации', 'лицензия', 'бессрочная']
+
+
+def prepare(db_path, env, products, reviews, users, keyed_products, keys):
+    # Копирует базу, применяет миграции и досыпает синтетические данные.
+    # Возвращает id товаров, у которых есть ключи для оформления заказов.
+    copy_database(db_path, env)
+    set_admin_password(db_path)
+    rnd = random.Random(42)
+    con = sqlite3.connect(db_path)
+    images = con.execute('SELECT img_1, img_2, img_3 FROM products ORDER BY id LIMIT 1').fetchone()
+    con.executemany(
+        'INSERT INTO products (name, price, stock, description, img_1, img_2, img_3) '
+        'VALUES (?, ?, 0, ?, ?, ?, ?)',
+        ((' '.join(rnd.sample(WORDS, 3)) + f' {2000 + i % 25}', 500 + i % 5000,
+          '<p>' + ' '.join(rnd.choices(WORDS, k=40)) + '</p>', *images)
+         for i in range(products))
+    )
+    con.executemany(
+        'INSERT INTO user (name, email, password_hash) VALUES (?, ?, ?)',
+        ((f'user{i}', f'user{i}@loadtest.local', 'x') for i in range(users))
+    )
+    today = date.today()
+    con.executemany(
+        'INSERT INTO reviews (username, review, date_added) VALUES (?, ?, ?)',
+        ((f'user{i}', ' '.join(rnd.choices(WORDS, k=20)), (today - timedelta(days=i % 1000)).isoformat())
+         for i in range(reviews))
+    )
+    con.execute("UPDATE row_count SET count = (SELECT count(*) FROM reviews) WHERE name = 'reviews'")
+    product_ids = [row[0] for row in con.execute('SELECT id FROM products ORDER BY id LIMIT ?',
+                                                 (keyed_products,))]
+    for product_id in product_ids:
+        con.executemany('INSERT INTO activation_keys (product_id, key) VALUES (?, ?)',
+                        ((product_id, f'LOAD-{product_id}-{i:08d}') for i in range(keys)))
+    con.commit()
+    con.close()
+    return product_ids
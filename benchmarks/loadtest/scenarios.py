@@ -0,0 +1,58 @@
+# Сценарии нагрузки: каждый выполняет один или несколько запросов через
+# user.request(маршрут, метод, путь, ...), замеры пишутся по имени маршрута
+SEARCH_QUERIES = ['windows', 'office plus', 'проф', 'visual studio', 'домашняя', 'ultim']
+
+
+def index(user):
+    user.request('/', 'GET', '/')
+
+
+def catalog(user):
+    user.request('/catalog', 'GET', '/catalog')
+
+
+def product(user):
+    user.request('/product/<id>', 'GET', f'/product/{user.rnd.choice(user.product_ids)}')
+
+
+def search(user):
+    user.request('/search', 'POST', '/search', data={'searched': user.rnd.choice(SEARCH_QUERIES)})
+
+
+def reviews(user):
+    user.request('/reviews', 'GET', '/reviews')
+
+
+def checkout(user):
+    product_id = user.rnd.choice(user.keyed_product_ids)
+    user.request('/add-cart', 'POST', '/add-cart', data={'product_id': product_id, 'quantity': 1},
+                 headers={'Referer': '/catalog'})
+    user.request('/cart', 'GET', '/cart')
+    user.request('/pay', 'POST', '/pay', data={'email': 'loadtest@example.com', 'card_number': 4242})
+
+
+def api_products(user):
+    user.request('/api/v1/products', 'GET', '/api/v1/products?limit=50', headers=user.auth)
+
+
+def api_product(user):
+    user.request('/api/v1/product/<id>', 'GET', f'/api/v1/product/{user.rnd.choice(user.product_ids)}',
+                 headers=user.auth)
+
+
+def api_users(user):
+    user.request('/api/v1/users', 'GET', '/api/v1/users?limit=50', headers=user.auth)
+
+
+# сценарий: вес в смеси нагрузки
+SCENARIOS = {
+    'index': (index, 10),
+    'catalog': (catalog, 10),
+    'product': (product, 20),
+    'search': (search, 10),
+    'reviews': (reviews, 5),
+    'checkout': (checkout, 5),
+    'api_products': (api_products, 5),
+    'api_product': (api_product, 5),
+    'api_users': (api_users, 2),
+}
@@ -0,0 +1,118 @@
+"""Бюджеты SQL запросов для всех маршрутов приложения.
+
+Проходит по каждому endpoint из app.url_map на копии instance/users.db и
+падает, если маршрут выполнил больше запросов, чем указано в BUDGETS, если
+в запросе найден N+1 (QUERY_NPLUSONE=raise) или если у endpoint нет бюджета.
+
+    python benchmarks/query_budgets.py
+    python benchmarks/query_budgets.py --measure   # только показать числа
+"""
+import argparse
+import shutil
+import sys
+
+from common import ADMIN_EMAIL, ADMIN_PASSWORD, copy_uploads, import_server, set_admin_password, temp_database
+
+# (endpoint, метод, путь, параметры запроса, бюджет); выполняются по порядку
+# одним клиентом, поэтому корзина, вход и выход идут в нужной последовательности.
+# Запросы к /api/v1/ после входа выполняются с JWT токеном админа.
+BUDGETS = [
+    ('static', 'GET', '/static/css/style.css', {}, 0),
+    ('ckeditor.static', 'GET', '/ckeditor/static/basic/ckeditor.js', {}, 0),
+    ('metrics', 'GET', '/metrics', {}, 0),
+    ('storefront.index', 'GET', '/', {}, 2),
+    ('storefront.catalog', 'GET', '/catalog', {}, 1),
+    ('storefront.product', 'GET', '/product/2', {}, 1),
+    ('storefront.search', 'POST', '/search', {'data': {'searched': 'windows'}}, 2),
+    ('storefront.guarantees', 'GET', '/guarantees', {}, 0),
+    ('storefront.reviews', 'GET', '/reviews', {}, 2),
+    ('storefront.reviews_more', 'GET', '/reviews/page?after=2023-04-20.3', {}, 1),
+    ('storefront.reviews', 'POST', '/reviews', {'data': {'username': 'budget', 'review': 'ok'}}, 2),
+    ('cart.add_cart', 'POST', '/add-cart', {'data': {'product_id': 2, 'quantity': 1},
+                                       'headers': {'Referer': '/catalog'}}, 4),
+    ('cart.add_cart', 'POST', '/add-cart', {'data': {'product_id': 3, 'quantity': 1},
+                                       'headers': {'Referer': '/catalog'}}, 4),
+    # первый /cart загружает товары, второй берёт их из кэша по версии каталога
+    ('cart.get_cart', 'GET', '/cart', {}, 3),
+    ('cart.get_cart', 'GET', '/cart', {}, 2),
+    ('cart.update_cart', 'POST', '/update-cart/2', {'data': {'quantity': 2}}, 3),
+    ('cart.delete_item', 'GET', '/delete-item/3', {}, 3),
+    ('cart.pay', 'GET', '/pay', {}, 1),
+    ('cart.pay', 'POST', '/pay', {'data': {'email': 'budget@example.com', 'card_number': 4242}}, 11),
+    ('cart.add_cart', 'POST', '/add-cart', {'data': {'product_id': 2, 'quantity': 1},
+                                       'headers': {'Referer': '/catalog'}}, 4),
+    ('cart.clear_cart', 'GET', '/clear-cart', {}, 2),
+    ('storefront.register', 'GET', '/register', {}, 0),
+    ('storefront.register', 'POST', '/register', {'data': {'name': 'budget', 'email': 'budget@example.com',
+                                                'password_hash': 'budget1', 'password_hash2': 'budget1'}}, 4),
+    ('storefront.login', 'GET', '/login', {}, 0),
+    ('storefront.login', 'POST', '/login', {'data': {'email': ADMIN_EMAIL, 'password_hash': ADMIN_PASSWORD}}, 1),
+    ('admin.admin', 'GET', '/admin', {}, 2),
+    ('admin.add_product', 'GET', '/add-product', {}, 0),
+    ('admin.edit_product', 'GET', '/edit-product/2', {}, 1),
+    ('admin.cache_stats', 'GET', '/admin/cache-stats', {}, 0),
+    ('admin.slow_requests', 'GET', '/admin/slow-requests', {}, 0),
+    ('admin.delete_review', 'GET', '/reviews/delete/1', {}, 3),
+    ('admin.delete_product', 'POST', '/delete-product/3', {}, 9),
+    ('storefront.logout', 'GET', '/logout', {}, 0),
+    ('api.jwtloginresource', 'POST', '/api/v1/jwt_login',
+     {'headers': {'email': ADMIN_EMAIL, 'password': ADMIN_PASSWORD}}, 1),
+    ('api.productlistresource', 'GET', '/api/v1/products?limit=50', {}, 2),
+    ('api.productresource', 'GET', '/api/v1/product/2', {}, 1),
+    ('api.userlistresource', 'GET', '/api/v1/users?limit=50', {}, 2),
+    ('api.productlistresource', 'GET', '/api/v1/products', {'headers': {'Accept': 'application/x-ndjson'}}, 2),
+    ('api.userlistresource', 'GET', '/api/v1/users', {'headers': {'Accept': 'application/x-ndjson'}}, 2),
+    ('api.userresource', 'GET', '/api/v1/users/2', {}, 1),
+    ('api.productlistresource', 'GET', '/api/v1/products?ids=2,3,999', {}, 2),
+    ('api.productbatchresource', 'POST', '/api/v1/products:batch',
+     {'json': [{'id': 2, 'price': 1200}, {'name': 'Budget', 'price': 1, 'description': 'b',
+                                          'img_1': 'a.png', 'img_2': 'a.png', 'img_3': 'a.png'}]}, 7),
+    ('api.productbatchresource', 'DELETE', '/api/v1/products:batch', {'json': {'ids': [5, 6, 999]}}, 5),
+    ('api.userresource', 'DELETE', '/api/v1/users/4', {}, 3),
+    ('api.productresource', 'DELETE', '/api/v1/product/4', {}, 6),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--measure', action='store_true', help='не проверять бюджеты, только показать')
+    args = parser.parse_args()
+
+    tmp, db_path, env = temp_database(QUERY_NPLUSONE='raise', PAGE_CACHE_ENABLED='0')
+    set_admin_password(db_path)
+    server = import_server(env)
+    from querybudget import NPlusOneDetected, QueryBudgetExceeded
+
+    app = server.create_app({'WTF_CSRF_ENABLED': False, 'UPLOAD_FOLDER': copy_uploads(tmp, server)})
+    client = app.test_client()
+    failures = []
+    token = None
+    for endpoint, method, path, kwargs, budget in BUDGETS:
+        kwargs = dict(kwargs)
+        if token and path.startswith('/api/v1/'):
+            kwargs['headers'] = dict(kwargs.get('headers', {}), Authorization=f'Bearer {token}')
+        budget_check = server.query_tracker.budget(budget)
+        try:
+            with budget_check:
+                response = client.open(path, method=method, **kwargs)
+                # потоковые ответы выполняют запросы при чтении тела
+                response.get_data()
+        except (QueryBudgetExceeded, NPlusOneDetected) as e:
+            if not args.measure or isinstance(e, NPlusOneDetected):
+                failures.append(f'{method} {path}: {e}')
+            response = None
+        if endpoint == 'api.jwtloginresource' and response is not None:
+            token = response.json['access_token']
+        status = response.status_code if response is not None else '-'
+        print(f'{method:<7}{path:<40}{status!s:>5}{budget_check.count:>5} / {budget}')
+    missing = {rule.endpoint for rule in app.url_map.iter_rules()} - {row[0] for row in BUDGETS}
+    for endpoint in sorted(missing):
+        failures.append(f'нет бюджета для endpoint {endpoint}')
+    shutil.rmtree(tmp)
+    if failures:
+        print('\n'.join(failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Планы SQL запросов всех маршрутов: ни одного полного SCAN большой таблицы.
+
+Проходит маршруты из query_budgets.BUDGETS на копии instance/users.db,
+записывает каждый выполненный SQL запрос с параметрами, затем для каждого
+различного запроса выполняет EXPLAIN QUERY PLAN и падает, если план читает
+таблицу целиком (SCAN без индекса). Таблицы из SMALL_TABLES ограничены по
+размеру, для них полный проход допустим; ALLOWED_SCANS - редкие маршруты
+админки, которым по смыслу нужна вся таблица.
+
+    python benchmarks/query_plans.py
+    python benchmarks/query_plans.py --verbose   # показать все планы
+"""
+import argparse
+import os
+import re
+import shutil
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import copy_uploads, import_server, set_admin_password, temp_database  # noqa: E402
+from query_budgets import BUDGETS  # noqa: E402
+
+# рейтинг продаж (TOP_SALES_SIZE строк), счётчики версий и строк
+SMALL_TABLES = {'top_sales', 'cache_version', 'row_count'}
+# endpoint -> таблицы, которые он может читать целиком
+ALLOWED_SCANS = {
+    # список всех товаров
+    'admin.admin': {'products'},
+    # проверка, что фото удаляемого товара не использует другой товар
+    'admin.delete_product': {'products'},
+}
+# SCAN <таблица> без USING INDEX / USING COVERING INDEX / VIRTUAL TABLE;
+# anon_N - материализованный подзапрос SQLAlchemy, его план проверяется
+# отдельной строкой MATERIALIZE
+FULL_SCAN_RE = re.compile(r'^SCAN (?!anon_)(\w+)(?: AS \w+)?$')
+
+
+def explain(con, statement, parameters):
+    return [detail for _, _, _, detail in con.execute('EXPLAIN QUERY PLAN ' + statement, parameters)]
+
+
+def full_scans(plan, endpoint):
+    tables = []
+    for detail in plan:
+        match = FULL_SCAN_RE.match(detail)
+        if match and match.group(1) not in SMALL_TABLES | ALLOWED_SCANS.get(endpoint, set()):
+            tables.append(match.group(1))
+    return tables
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--verbose', action='store_true', help='показать планы всех запросов')
+    args = parser.parse_args()
+
+    tmp, db_path, env = temp_database(PAGE_CACHE_ENABLED='0')
+    set_admin_password(db_path)
+    server = import_server(env)
+    from sqlalchemy import event
+
+    app = server.create_app({'WTF_CSRF_ENABLED': False, 'UPLOAD_FOLDER': copy_uploads(tmp, server)})
+    # (запрос, endpoint) -> (параметры первого вызова, маршрут)
+    statements = {}
+    route = [None, None]
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if executemany:
+            parameters = parameters[0] if parameters else ()
+        statements.setdefault((statement, route[0]), (parameters, route[1]))
+
+    with app.app_context():
+        for engine in server.db.engines.values():
+            event.listen(engine, 'before_cursor_execute', record)
+    client = app.test_client()
+    token = None
+    for endpoint, method, path, kwargs, _ in BUDGETS:
+        kwargs = dict(kwargs)
+        if token and path.startswith('/api/v1/'):
+            kwargs['headers'] = dict(kwargs.get('headers', {}), Authorization=f'Bearer {token}')
+        route[:] = [endpoint, f'{method} {path}']
+        response = client.open(path, method=method, **kwargs)
+        response.get_data()
+        if endpoint == 'api.jwtloginresource':
+            token = response.json['access_token']
+
+    con = sqlite3.connect(db_path)
+    failures = []
+    skipped = 0
+    for (statement, endpoint), (parameters, source) in statements.items():
+        try:
+            plan = explain(con, statement, parameters)
+        except sqlite3.OperationalError:
+            # временные таблицы (import_keys) и PRAGMA существуют только в соединении приложения
+            skipped += 1
+            continue
+        scans = full_scans(plan, endpoint)
+        if scans:
+            failures.append((source, statement, plan, scans))
+        if args.verbose or scans:
+            print(f'{"SCAN " + ", ".join(scans) if scans else "ok"}  {source}')
+            print('    ' + ' '.join(statement.split()))
+            print(''.join(f'      {detail}\n' for detail in plan), end='')
+    con.close()
+    shutil.rmtree(tmp)
+    print(f'запросов: {len(statements)}, без плана: {skipped}, с полным SCAN: {len(failures)}')
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Всплеск запросов одного клиента к /login против каталога остальных.
+
+    python benchmarks/ratelimit_benchmark.py --attackers 16 --seconds 10
+
+На копии instance/users.db --attackers потоков с одного адреса непрерывно
+отправляют POST /login (проверка хэша пароля), а один поток с другого адреса
+открывает /catalog. Печатает задержку каталога и число ответов 200/429 у
+атакующего без ограничений и с ними. Затем проверяет общее SQLite хранилище
+(RATELIMIT_STORAGE): --processes процессов с одного адреса вместе получают
+не больше burst входов, а не burst на каждый процесс. Ограничен только POST:
+форма входа (GET /login) открывается и у клиента, исчерпавшего лимит.
+"""
+import argparse
+import collections
+import multiprocessing
+import os
+import shutil
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import ADMIN_EMAIL, ADMIN_PASSWORD, import_server, set_admin_password, temp_database  # noqa: E402
+
+BURST = 10
+
+
+def make_app(config):
+    server = import_server()
+    # каталог без кэша страниц, чтобы он тоже нагружал процессор
+    return server.create_app(dict({'WTF_CSRF_ENABLED': False, 'CLI_COMMANDS': False,
+                                   'PAGE_CACHE_ENABLED': False, 'METRICS_SLOW_REQUEST': 60}, **config))
+
+
+def percentile(samples, share):
+    return sorted(samples)[min(len(samples) - 1, int(len(samples) * share))]
+
+
+def burst(app, attackers, seconds):
+    until = time.perf_counter() + seconds
+    statuses = collections.Counter()
+    latency = []
+
+    def attack():
+        client = app.test_client()
+        while time.perf_counter() < until:
+            response = client.post('/login', data={'email': ADMIN_EMAIL, 'password_hash': 'wrong'},
+                                   environ_base={'REMOTE_ADDR': '10.0.0.1'})
+            statuses[response.status_code] += 1
+
+    def browse():
+        client = app.test_client()
+        while time.perf_counter() < until:
+            start = time.perf_counter()
+            assert client.get('/catalog', environ_base={'REMOTE_ADDR': '10.0.0.2'}).status_code == 200
+            latency.append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=attack) for _ in range(attackers)] + [threading.Thread(target=browse)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return statuses, latency
+
+
+def shared_logins(storage, attempts, queue):
+    client = make_app({'RATELIMIT_STORAGE': storage}).test_client()
+    allowed = sum(client.post('/login', data={'email': ADMIN_EMAIL, 'password_hash': ADMIN_PASSWORD},
+                              environ_base={'REMOTE_ADDR': '10.0.0.1'}).status_code != 429
+                  for _ in range(attempts))
+    queue.put(allowed)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--attackers', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--processes', type=int, default=4)
+    args = parser.parse_args()
+
+    tmp, db_path, env = temp_database()
+    set_admin_password(db_path)
+    os.environ.update(env)
+
+    # общее хранилище проверяется до импорта server в этом процессе
+    storage = 'sqlite:///' + os.path.join(tmp, 'ratelimit.db')
+    queue = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=shared_logins, args=(storage, BURST, queue))
+             for _ in range(args.processes)]
+    for p in procs:
+        p.start()
+    allowed = sum(queue.get() for _ in procs)
+    for p in procs:
+        p.join()
+    print(f'{args.processes} процессов, общее хранилище: пропущено входов {allowed} '
+          f'из {args.processes * BURST} (burst {BURST})')
+    assert allowed < BURST + args.processes, 'процессы не делят вёдра'
+
+    for enabled in (False, True):
+        app = make_app({'RATELIMIT_ENABLED': enabled})
+        app.test_client().get('/catalog')
+        statuses, latency = burst(app, args.attackers, args.seconds)
+        print(f'{"с ограничениями" if enabled else "без ограничений":<17}'
+              f'/catalog: {len(latency)} запросов, медиана {statistics.median(latency):7.1f} мс, '
+              f'p95 {percentile(latency, 0.95):7.1f} мс; /login: 200 - {statuses[200]}, 429 - {statuses[429]}')
+        if enabled:
+            # отдельный адрес исчерпывает ведро сам, не завися от длины всплеска
+            client = app.test_client()
+            environ = {'REMOTE_ADDR': '10.0.0.3'}
+            posts = [client.post('/login', data={'email': ADMIN_EMAIL, 'password_hash': 'wrong'},
+                                 environ_base=environ).status_code for _ in range(BURST + 1)]
+            assert posts[-1] == 429, 'POST /login не ограничен'
+            form = [client.get('/login', environ_base=environ).status_code for _ in range(BURST * 2)]
+            print(f'GET /login после исчерпания лимита: {collections.Counter(form)}')
+            assert set(form) == {200}, 'GET /login ограничен'
+    shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Лента отзывов на большой таблице: постраничная выдача против всей ленты.
+
+    python benchmarks/reviews_feed_benchmark.py --reviews 1000000
+
+На копии instance/users.db создаёт --reviews отзывов (около тысячи в день)
+и замеряет GET /reviews, фрагменты /reviews/page?after=... в начале, середине
+и конце ленты - с индексом ix_reviews_date_added_id и без него. Для
+сравнения - прежний запрос ленты целиком и COUNT(*) на чистом sqlite3 (это
+нижняя граница старой страницы: без ORM и рендера миллиона отзывов).
+"""
+import argparse
+import datetime
+import shutil
+import sqlite3
+import statistics
+import time
+
+from common import import_server, temp_database
+
+PER_DAY = 1000
+ROUNDS = 50
+
+
+def add_reviews(db_path, count):
+    con = sqlite3.connect(db_path)
+    start = datetime.date.today() - datetime.timedelta(days=count // PER_DAY + 1)
+    first = con.execute('SELECT coalesce(max(id), 0) FROM reviews').fetchone()[0] + 1
+    con.executemany(
+        'INSERT INTO reviews (id, username, review, date_added) VALUES (?, ?, ?, ?)',
+        ((i, f'Покупатель {i}', f'Отзыв номер {i}: ключ пришёл сразу, всё активировалось. ' * 3,
+          (start + datetime.timedelta(days=(i - first) // PER_DAY)).isoformat())
+         for i in range(first, first + count)))
+    con.execute("UPDATE row_count SET count = (SELECT count(*) FROM reviews) WHERE name = 'reviews'")
+    con.commit()
+    con.close()
+
+
+def timed_ms(fn, rounds=ROUNDS):
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def cursor_at(con, offset):
+    day, id = con.execute('SELECT date_added, id FROM reviews ORDER BY date_added DESC, id DESC LIMIT 1 OFFSET ?',
+                          (offset,)).fetchone()
+    return f'{day}.{id}'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reviews', type=int, default=1000000)
+    args = parser.parse_args()
+
+    tmp, db_path, env = temp_database()
+    add_reviews(db_path, args.reviews)
+    server = import_server(env)
+    app = server.create_app({'CLI_COMMANDS': False, 'METRICS_SLOW_REQUEST': 60})
+    client = app.test_client()
+    con = sqlite3.connect(db_path)
+    total = con.execute('SELECT count(*) FROM reviews').fetchone()[0]
+    paths = [('GET /reviews', '/reviews')] + [
+        (f'фрагмент на {position}', f'/reviews/page?after={cursor_at(con, int(total * share))}')
+        for position, share in (('0%', 0.0), ('50%', 0.5), ('99%', 0.99))
+    ]
+    print(f'отзывов: {total}')
+    for label, path in paths:
+        assert client.get(path).status_code == 200
+        print(f'{label:<24}{timed_ms(lambda: client.get(path)):>10.2f} мс')
+
+    con.execute('DROP INDEX ix_reviews_date_added_id')
+    print('без индекса (date_added, id):')
+    for label, path in paths:
+        print(f'{label:<24}{timed_ms(lambda: client.get(path), rounds=3):>10.2f} мс')
+
+    print('прежняя страница, только SQL:')
+    for label, sql in (('вся лента', 'SELECT * FROM reviews ORDER BY date_added DESC'),
+                       ('COUNT(*)', 'SELECT count(*) FROM reviews')):
+        print(f'{label:<24}{timed_ms(lambda: con.execute(sql).fetchall(), rounds=3):>10.2f} мс')
+    con.close()
+    shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
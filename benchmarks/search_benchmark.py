@@ -0,0 +1,69 @@
+"""Сравнение поиска LIKE '%q%' и FTS5 на синтетическом каталоге.
+
+    python benchmarks/search_benchmark.py --products 100000
+"""
+import argparse
+import random
+import shutil
+import sqlite3
+import statistics
+import time
+
+from common import import_server, temp_database
+
+WORDS = ['Windows', 'Office', 'Project', 'Visio', 'Visual', 'Studio', 'Server', 'Home', 'Pro',
+         'Enterprise', 'Professional', 'Plus', 'Standard', 'Ultimate', 'Корпоративная',
+         'Профессиональная', 'Домашняя', 'ключ', 'активации', 'лицензия', 'бессрочная']
+QUERIES = ['windows', 'office plus', 'проф', 'Visual Studio', 'домашняя', 'ultim', 'enterprise 2019']
+
+
+def seed(db_path, count):
+    rnd = random.Random(42)
+    con = sqlite3.connect(db_path)
+    rows = []
+    for i in range(count):
+        name = ' '.join(rnd.sample(WORDS, 3)) + f' {2000 + i % 25}'
+        description = '<p>' + ' '.join(rnd.choices(WORDS, k=12)) + '</p>'
+        rows.append((name, 1000 + i % 500, 10, description, 'a.png', 'b.png', 'c.png'))
+    con.executemany('INSERT INTO products (name, price, stock, description, img_1, img_2, img_3) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+    con.commit()
+    con.close()
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    tmp, db_path, env = temp_database()
+    seed(db_path, args.products)
+    server = import_server(env)
+    app = server.create_app()
+
+    with app.app_context():
+        start = time.perf_counter()
+        server.rebuild_search_index()
+        print(f'индекс построен за {time.perf_counter() - start:.1f} с')
+        print(f'{"запрос":<20}{"LIKE, мс":>12}{"FTS5, мс":>12}{"найдено LIKE/FTS":>20}')
+        for query in QUERIES:
+            like = lambda: server.Products.query.filter(server.Products.name.like('%' + query + '%')).all()
+            fts = lambda: server.search_products(query)
+            like_ms = timed(like, args.repeat)
+            fts_ms = timed(fts, args.repeat)
+            print(f'{query:<20}{like_ms:>12.1f}{fts_ms:>12.1f}{len(like()):>12}/{len(fts())}')
+    shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
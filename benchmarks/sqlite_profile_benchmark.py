@@ -0,0 +1,103 @@
+"""Пропускная способность смешанной нагрузки (чтение каталога + /pay)
+при разных профилях SQLite.
+
+    python benchmarks/sqlite_profile_benchmark.py --threads 8 --duration 10
+
+Каждая конфигурация запускается в отдельном процессе на своей копии
+instance/users.db; кэш страниц отключён, чтобы чтения доходили до базы.
+"""
+import argparse
+import json
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+from common import ROOT, import_server, temp_database
+
+CONFIGS = [
+    ('default', {'DB_PROFILE': 'default', 'DB_READONLY_POOL': '0'}),
+    ('tuned', {'DB_PROFILE': 'tuned', 'DB_READONLY_POOL': '0'}),
+    ('tuned+readonly', {'DB_PROFILE': 'tuned', 'DB_READONLY_POOL': '1'}),
+]
+
+
+def add_keys(db_path):
+    con = sqlite3.connect(db_path)
+    product_ids = [row[0] for row in con.execute('SELECT id FROM products')]
+    for product_id in product_ids:
+        con.executemany('INSERT INTO activation_keys (product_id, key) VALUES (?, ?)',
+                        [(product_id, f'BENCH-{product_id}-{i}') for i in range(20000)])
+    con.commit()
+    con.close()
+    return product_ids
+
+
+def run(args):
+    server = import_server()
+    app = server.create_app({'WTF_CSRF_ENABLED': False})
+    server.send_notification = lambda email, txt: None
+    with app.app_context():
+        product_ids = [product.id for product in server.Products.query.all()]
+    stop = time.monotonic() + args.duration
+    results = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def worker(seed):
+        rnd = random.Random(seed)
+        client = app.test_client()
+        counts = {'reads': 0, 'writes': 0, 'errors': 0}
+        while time.monotonic() < stop:
+            try:
+                if rnd.random() < args.write_ratio:
+                    client.post('/add-cart', data={'product_id': rnd.choice(product_ids), 'quantity': 1},
+                                headers={'Referer': '/catalog'})
+                    response = client.post('/pay', data={'email': 'bench@example.com', 'card_number': 1})
+                    kind = 'writes'
+                else:
+                    path = rnd.choice(['/', '/catalog', f'/product/{rnd.choice(product_ids)}'])
+                    response = client.get(path)
+                    kind = 'reads'
+                counts[kind if response.status_code < 500 else 'errors'] += 1
+            except Exception:
+                counts['errors'] += 1
+        with lock:
+            for key, value in counts.items():
+                results[key] += value
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(json.dumps(results))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--write-ratio', type=float, default=0.2)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return run(args)
+
+    print(f'{"профиль":<16}{"чтений/с":>10}{"покупок/с":>11}{"ошибок":>8}')
+    for name, overrides in CONFIGS:
+        tmp, db_path, env = temp_database(PAGE_CACHE_ENABLED='0', **overrides)
+        add_keys(db_path)
+        output = subprocess.run([sys.executable, __file__, '--child', '--threads', str(args.threads),
+                                 '--duration', str(args.duration), '--write-ratio', str(args.write_ratio)],
+                                cwd=ROOT, env=env, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f'{name:<16}{result["reads"] / args.duration:>10.1f}'
+              f'{result["writes"] / args.duration:>11.1f}{result["errors"]:>8}')
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
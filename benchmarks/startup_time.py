@@ -0,0 +1,75 @@
+"""Время холодного старта: импорт server, create_app и первый запрос.
+
+    python benchmarks/startup_time.py --runs 5
+
+Каждый замер - отдельный процесс интерпретатора на копии instance/users.db.
+Режим cli - приложение как для команд flask (с Flask-Migrate), wsgi - как
+в воркере веб-сервера (wsgi.py, CLI_COMMANDS=False).
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+
+# common импортируется только в родительском процессе: в замеряемом процессе
+# его зависимости (werkzeug, sqlite3) заранее загрузили бы часть модулей server
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = {'cli': {}, 'wsgi': {'CLI_COMMANDS': False}}
+PATHS = ['/', '/catalog', '/product/2']
+
+
+def child(mode):
+    import time
+
+    start = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    import server
+    imported = time.perf_counter()
+    app = server.create_app(MODES[mode])
+    created = time.perf_counter()
+    client = app.test_client()
+    first = {}
+    for path in PATHS:
+        request_start = time.perf_counter()
+        client.get(path)
+        first[path] = (time.perf_counter() - request_start) * 1000
+    print(json.dumps({
+        'import': (imported - start) * 1000,
+        'create_app': (created - imported) * 1000,
+        'first_request': first,
+        'modules': len(sys.modules),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--child', choices=sorted(MODES), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args.child)
+
+    from common import temp_database
+
+    tmp, db_path, env = temp_database()
+
+    print(f'{"режим":<6}{"импорт, мс":>12}{"create_app":>12}' + ''.join(f'{path:>18}' for path in PATHS)
+          + f'{"модулей":>9}')
+    for mode in MODES:
+        runs = []
+        for _ in range(args.runs):
+            output = subprocess.run([sys.executable, __file__, '--child', mode], cwd=ROOT, env=env,
+                                    check=True, capture_output=True, text=True).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        print(f'{mode:<6}{statistics.median([run["import"] for run in runs]):>12.1f}'
+              f'{statistics.median([run["create_app"] for run in runs]):>12.1f}'
+              + ''.join(f'{statistics.median([run["first_request"][path] for run in runs]):>18.1f}' for path in PATHS)
+              + f'{runs[0]["modules"]:>9}')
+    shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
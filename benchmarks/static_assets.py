@@ -0,0 +1,76 @@
+"""Отдача собранной статики: тело, Content-Encoding, Vary и кэширование.
+
+    python benchmarks/static_assets.py
+
+Собирает копию static/ (build_assets, как flask assets-build) во временном
+каталоге и запрашивает файлы с хэшем в имени с Accept-Encoding: br, gzip и
+без него. Проверяет, что ответ после распаковки совпадает с исходным файлом,
+что Content-Encoding соответствует запросу (br - только если установлен
+brotli), что есть Vary: Accept-Encoding и Cache-Control: public, max-age на
+год, immutable, а исходный путь без хэша immutable не получает.
+"""
+import gzip
+import os
+import shutil
+import sys
+
+from common import ROOT, import_server, temp_database
+
+FILES = ('css/style.css', 'js/reviews.js')
+
+
+def main():
+    tmp, db_path, env = temp_database()
+    server = import_server(env)
+    import assets
+
+    static = os.path.join(tmp, 'static')
+    shutil.copytree(os.path.join(ROOT, 'static'), static,
+                    ignore=shutil.ignore_patterns(assets.DIST_DIR, 'products'))
+    app = server.create_app({'CLI_COMMANDS': False})
+    app.static_folder = static
+    manifest = assets.build_assets(static)
+    app.extensions['assets'] = assets.AssetManifest(static)
+    client = app.test_client()
+    failures = []
+
+    def check(condition, message):
+        print(f'{"ok  " if condition else "FAIL"} {message}')
+        if not condition:
+            failures.append(message)
+
+    decoders = {'br': assets.brotli and assets.brotli.decompress, 'gzip': gzip.decompress, None: bytes}
+    for path in FILES:
+        with open(os.path.join(static, path), 'rb') as f:
+            source = f.read()
+        with app.test_request_context():
+            url = server.url_for('static', filename=path)
+        check(url == f'/static/{assets.DIST_DIR}/{manifest[path]["path"]}', f'{path}: url_for -> {url}')
+        for accept in ('br', 'gzip', None):
+            expected = accept if accept in manifest[path]['encodings'] else None
+            response = client.get(url, headers={'Accept-Encoding': accept} if accept else {})
+            encoding = response.headers.get('Content-Encoding')
+            cache_control = response.cache_control
+            label = f'{path}, Accept-Encoding: {accept or "-"}'
+            check(response.status_code == 200 and encoding == expected,
+                  f'{label}: Content-Encoding {encoding or "-"}')
+            body = response.get_data()
+            check(decoders[encoding](body) == source and response.content_length == len(body),
+                  f'{label}: тело совпадает с файлом')
+            check('Accept-Encoding' in response.vary, f'{label}: Vary: Accept-Encoding')
+            check(cache_control.public and cache_control.immutable and cache_control.max_age == assets.MAX_AGE,
+                  f'{label}: Cache-Control {response.headers.get("Cache-Control")}')
+            response.close()
+        response = client.get(f'/static/{path}', headers={'Accept-Encoding': 'gzip'})
+        check(response.status_code == 200 and not response.cache_control.immutable
+              and 'Content-Encoding' not in response.headers and response.get_data() == source,
+              f'{path} без хэша: как есть, без immutable')
+        response.close()
+
+    shutil.rmtree(tmp)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
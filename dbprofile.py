@@ -0,0 +1,87 @@
+from flask import g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+import functools
+
+# PRAGMA, выполняемые на каждом новом соединении с SQLite.
+# default - настройки SQLite как есть (rollback journal, synchronous=FULL).
+SQLITE_PROFILES = {
+    'default': {},
+    'tuned': {
+        # читатели не блокируют писателя и наоборот
+        'journal_mode': 'WAL',
+        # в режиме WAL fsync только на checkpoint, commit не теряет целостность
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'mmap_size': 256 * 1024 * 1024,
+        # отрицательное значение - размер в KiB
+        'cache_size': -64 * 1024,
+        'temp_store': 'MEMORY',
+    },
+}
+# режим журнала хранится в файле базы, read-only соединение его не меняет
+READONLY_SKIP = {'journal_mode', 'synchronous'}
+READONLY_BIND = 'readonly'
+
+
+def readonly_uri(uri):
+    url = make_url(uri)
+    return url.set(database='file:' + url.database) \
+        .update_query_dict({'mode': 'ro', 'uri': 'true'}) \
+        .render_as_string(hide_password=False)
+
+
+def configure_database(app):
+    # Пул соединений и, по желанию, отдельный пул read-only соединений;
+    # вызывается до создания SQLAlchemy(app)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {}).update({
+        'pool_size': app.config['DB_POOL_SIZE'],
+        'max_overflow': app.config['DB_POOL_OVERFLOW'],
+        'pool_timeout': 30,
+    })
+    if app.config['DB_READONLY_POOL']:
+        app.config.setdefault('SQLALCHEMY_BINDS', {})[READONLY_BIND] = \
+            readonly_uri(app.config['SQLALCHEMY_DATABASE_URI'])
+
+
+def apply_sqlite_profile(app, db):
+    pragmas = SQLITE_PROFILES[app.config['DB_PROFILE']]
+    if not pragmas:
+        return
+    with app.app_context():
+        for bind_key, engine in db.engines.items():
+            if engine.dialect.name != 'sqlite':
+                continue
+            if bind_key == READONLY_BIND:
+                engine_pragmas = {name: value for name, value in pragmas.items() if name not in READONLY_SKIP}
+            else:
+                engine_pragmas = pragmas
+            event.listen(engine, 'connect', functools.partial(set_pragmas, pragmas=engine_pragmas))
+
+
+def set_pragmas(dbapi_connection, connection_record, pragmas):
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+    cursor.close()
+
+
+class RoutingSession(Session):
+    # В запросах, помеченных read_only_db, чтение идёт через read-only пул;
+    # flush (запись через ORM) всегда уходит в основную базу
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_request_context() and g.get('db_readonly') \
+                and READONLY_BIND in self._db.engines:
+            return self._db.engines[READONLY_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_only_db(view):
+    # Помечает view, которые только читают базу
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_readonly = True
+        return view(*args, **kwargs)
+    return wrapper
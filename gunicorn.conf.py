@@ -0,0 +1,16 @@
+# gunicorn -c gunicorn.conf.py wsgi:app
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('WEB_THREADS', 4))
+# приложение импортируется один раз в мастере, воркеры делят его память (copy-on-write)
+preload_app = True
+# перезапуск воркеров ограничивает рост памяти
+max_requests = 10000
+max_requests_jitter = 1000
+timeout = 30
+# GET /api/v1/products?ids=... : около 1300 id в строке запроса (максимум gunicorn),
+# для больших пакетов клиенты делят список на части
+limit_request_line = 8190
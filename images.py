@@ -0,0 +1,87 @@
+import hashlib
+import io
+import os
+
+# ширины вариантов фото товара: миниатюра в корзине/админке, карточка каталога, страница товара
+VARIANTS = {'thumb': 160, 'card': 400, 'detail': 900}
+ALLOWED_FORMATS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp', 'GIF': '.gif'}
+MAX_PIXELS = 40_000_000
+VARIANTS_DIR = 'variants'
+
+
+class InvalidImage(Exception):
+    pass
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def validate_image(data):
+    # Быстрая проверка загруженного файла до сохранения: формат и размеры.
+    # Возвращает расширение, с которым нужно сохранить оригинал.
+    # Pillow импортируется при первой загрузке фото, а не при старте приложения
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            fmt = img.format
+            width, height = img.size
+            img.verify()
+    except (UnidentifiedImageError, OSError, SyntaxError) as e:
+        raise InvalidImage(str(e))
+    if fmt not in ALLOWED_FORMATS:
+        raise InvalidImage(f'формат {fmt} не поддерживается')
+    if width * height > MAX_PIXELS:
+        raise InvalidImage(f'слишком большое изображение {width}x{height}')
+    return ALLOWED_FORMATS[fmt]
+
+
+def variant_name(digest, width, ext):
+    return f'{VARIANTS_DIR}/{digest}_{width}{ext}'
+
+
+def variant_files(meta):
+    return [variant_name(meta['hash'], width, ext)
+            for width in meta['widths'].values() for ext in ('.webp', meta['fallback'])]
+
+
+def process_image(path, upload_folder):
+    # Строит варианты фото в WebP и запасном формате (JPEG, или PNG для
+    # картинок с прозрачностью). Файлы называются по хэшу содержимого, поэтому
+    # одинаковые фото обрабатываются и хранятся один раз. Выполняется в пуле процессов.
+    from PIL import Image, ImageOps
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    digest = content_hash(data)
+    os.makedirs(os.path.join(upload_folder, VARIANTS_DIR), exist_ok=True)
+    with Image.open(io.BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img)
+        has_alpha = img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+        img = img.convert('RGBA' if has_alpha else 'RGB')
+        fallback = '.png' if has_alpha else '.jpg'
+        widths = {}
+        for variant, width in VARIANTS.items():
+            width = min(width, img.width)
+            widths[variant] = width
+            webp_path = os.path.join(upload_folder, variant_name(digest, width, '.webp'))
+            fallback_path = os.path.join(upload_folder, variant_name(digest, width, fallback))
+            if os.path.exists(webp_path) and os.path.exists(fallback_path):
+                continue
+            resized = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS) \
+                if width < img.width else img
+            _save_atomic(resized, webp_path, 'WEBP', quality=82, method=4)
+            if fallback == '.png':
+                _save_atomic(resized, fallback_path, 'PNG', optimize=True)
+            else:
+                _save_atomic(resized, fallback_path, 'JPEG', quality=85, optimize=True, progressive=True)
+    return {'hash': digest, 'fallback': fallback, 'widths': widths}
+
+
+def _save_atomic(img, path, fmt, **params):
+    # параллельные воркеры могут обрабатывать одно и то же фото
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    img.save(tmp_path, fmt, **params)
+    os.replace(tmp_path, path)
+
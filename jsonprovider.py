@@ -0,0 +1,93 @@
+from flask import current_app
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+import dataclasses
+import decimal
+import json
+import uuid
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JSONProvider(DefaultJSONProvider):
+    # Стандартный json. dumps_bytes - компактная строка для потоковых ответов
+    # (NDJSON); кодировщик создаётся один раз, а не на каждый объект
+    def __init__(self, app):
+        super().__init__(app)
+        self.encoder = json.JSONEncoder(default=self.default, ensure_ascii=self.ensure_ascii,
+                                        sort_keys=self.sort_keys, separators=(',', ':'))
+
+    def dumps_bytes(self, obj):
+        return self.encoder.encode(obj).encode()
+
+
+def orjson_default(o):
+    # то, что orjson не сериализует сам, - так же, как DefaultJSONProvider
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    if hasattr(o, 'isoformat'):
+        return http_date(o)
+    if dataclasses.is_dataclass(o):
+        return dataclasses.asdict(o)
+    if hasattr(o, '__html__'):
+        return str(o.__html__())
+    raise TypeError(f'Object of type {type(o).__name__} is not JSON serializable')
+
+
+class OrjsonProvider(JSONProvider):
+    # jsonify и ответы api через orjson: ключи сортируются, даты в формате
+    # HTTP, как у стандартного провайдера; вызовы с параметрами json.dumps
+    # (indent и т.п.) уходят в стандартный json
+    def __init__(self, app):
+        super().__init__(app)
+        self.options = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS \
+            | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self.dumps_bytes(obj).decode()
+
+    def dumps_bytes(self, obj):
+        return orjson.dumps(obj, default=orjson_default, option=self.options)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj) + b'\n', mimetype=self.mimetype)
+
+
+JSON_PROVIDERS = {'json': JSONProvider}
+if orjson is not None:
+    JSON_PROVIDERS['orjson'] = OrjsonProvider
+
+# провайдеры, о замене которых уже написано в лог этого процесса
+reported_fallbacks = set()
+
+
+def configure_json(app):
+    # JSON_PROVIDER: orjson или json; без установленного orjson - стандартный
+    # json, о чём один раз пишется в лог
+    name = app.config['JSON_PROVIDER']
+    if name not in JSON_PROVIDERS and name not in reported_fallbacks:
+        reported_fallbacks.add(name)
+        app.logger.warning('JSON_PROVIDER=%s недоступен (не установлен orjson?), используется стандартный json',
+                           name)
+    app.json = JSON_PROVIDERS.get(name, JSONProvider)(app)
+
+
+def output_json(data, code, headers=None):
+    # представление application/json для flask_restful: ответы ресурсов,
+    # abort() и 429 сериализуются тем же app.json, что и jsonify
+    response = current_app.json.response(data)
+    response.status_code = code
+    response.headers.extend(headers or {})
+    return response
@@ -0,0 +1,233 @@
+from flask import current_app, g, has_app_context, has_request_context, request, Response
+from sqlalchemy import event
+
+import bisect
+import functools
+import heapq
+import itertools
+import threading
+import time
+
+# границы корзин гистограмм, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+# сколько SQL запросов одного HTTP запроса держать для журнала медленных запросов
+MAX_STATEMENTS = 200
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        for labels, value in sorted(values.items()):
+            yield f'{self.name}{format_labels(self.labels, labels)} {value}'
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        # labels -> [счётчики по корзинам (+Inf последней), сумма]
+        self.values = {}
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total = self.values.get(labels) or ([0] * (len(self.buckets) + 1), 0)
+            counts[index] += 1
+            self.values[labels] = counts, total + value
+
+    def samples(self):
+        with self.lock:
+            values = {labels: (list(counts), total) for labels, (counts, total) in self.values.items()}
+        for labels, (counts, total) in sorted(values.items()):
+            cumulative = list(itertools.accumulate(counts))
+            for bound, count in zip(self.buckets + ('+Inf',), cumulative):
+                yield f'{self.name}_bucket{format_labels(self.labels, labels, [("le", bound)])} {count}'
+            yield f'{self.name}_sum{format_labels(self.labels, labels)} {total}'
+            yield f'{self.name}_count{format_labels(self.labels, labels)} {cumulative[-1]}'
+
+
+class MetricsRegistry:
+    # Счётчики и журнал медленных запросов одного приложения
+    # (app.extensions['metrics'])
+
+    def __init__(self, app):
+        self.app = app
+        self.requests = Counter('http_requests_total', 'HTTP запросы', ('endpoint', 'method', 'status'))
+        self.latency = Histogram('http_request_duration_seconds', 'Время ответа', ('endpoint', 'method'))
+        self.queries = Histogram('db_queries_per_request', 'SQL запросов на HTTP запрос', ('endpoint',),
+                                 COUNT_BUCKETS)
+        self.db_time = Histogram('db_time_per_request_seconds', 'Время SQL на HTTP запрос', ('endpoint',))
+        self.query_latency = Histogram('db_query_duration_seconds', 'Время одного SQL запроса', (),
+                                       QUERY_BUCKETS)
+        self.sections = Histogram('section_duration_seconds', 'Время участков кода', ('section',))
+        self.slow = Counter('http_slow_requests_total', 'Медленные HTTP запросы', ('endpoint',))
+        self.collectors = [self.requests, self.latency, self.queries, self.db_time,
+                           self.query_latency, self.sections, self.slow]
+        self.slow_lock = threading.Lock()
+        self.slowest = []
+        self.slow_seq = itertools.count()
+
+    def before_request(self):
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_db_time = 0.0
+        g.metrics_statements = []
+        g.metrics_sections = {}
+
+    def after_request(self, response):
+        if 'metrics_start' not in g:
+            return response
+        elapsed = time.perf_counter() - g.metrics_start
+        endpoint = request.endpoint or 'unmatched'
+        if endpoint == 'metrics':
+            return response
+        self.requests.inc(endpoint, request.method, response.status_code)
+        self.latency.observe(elapsed, endpoint, request.method)
+        self.queries.observe(g.metrics_queries, endpoint)
+        self.db_time.observe(g.metrics_db_time, endpoint)
+        if self.app.config['METRICS_DEBUG_HEADERS']:
+            response.headers['X-Query-Count'] = str(g.metrics_queries)
+            response.headers['X-DB-Time'] = f'{g.metrics_db_time * 1000:.2f}ms'
+        if elapsed >= self.app.config['METRICS_SLOW_REQUEST']:
+            self.record_slow(endpoint, elapsed)
+        return response
+
+    def record_slow(self, endpoint, elapsed):
+        self.slow.inc(endpoint)
+        entry = {
+            'endpoint': endpoint,
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'time': round(elapsed, 4),
+            'queries': g.metrics_queries,
+            'db_time': round(g.metrics_db_time, 4),
+            'sections': {name: round(value, 4) for name, value in g.metrics_sections.items()},
+            'statements': [{'sql': sql, 'time': round(duration, 5)} for sql, duration in g.metrics_statements],
+        }
+        self.app.logger.warning(
+            'медленный запрос %s %s: %.3f с, SQL: %d запросов за %.3f с\n%s',
+            entry['method'], entry['path'], elapsed, entry['queries'], entry['db_time'],
+            '\n'.join(f'  {s["time"] * 1000:8.2f} мс  {s["sql"]}' for s in entry['statements']))
+        with self.slow_lock:
+            item = (elapsed, next(self.slow_seq), entry)
+            if len(self.slowest) < self.app.config['METRICS_SLOW_KEEP']:
+                heapq.heappush(self.slowest, item)
+            else:
+                heapq.heappushpop(self.slowest, item)
+
+    def slow_requests(self):
+        with self.slow_lock:
+            return [entry for _, _, entry in sorted(self.slowest, reverse=True)]
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info['metrics_query_start'].pop()
+        self.query_latency.observe(duration)
+        if has_request_context() and 'metrics_start' in g:
+            g.metrics_queries += 1
+            g.metrics_db_time += duration
+            if len(g.metrics_statements) < MAX_STATEMENTS:
+                g.metrics_statements.append((statement, duration))
+
+    def handle_error(self, context):
+        # после ошибки after_cursor_execute не вызывается
+        if context.connection is not None and context.connection.info.get('metrics_query_start'):
+            context.connection.info['metrics_query_start'].pop()
+
+    def render(self):
+        lines = []
+        for collector in self.collectors:
+            lines.append(f'# HELP {collector.name} {collector.documentation}')
+            lines.append(f'# TYPE {collector.name} {collector.kind}')
+            lines.extend(collector.samples())
+        return '\n'.join(lines) + '\n'
+
+    def metrics_view(self):
+        return Response(self.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+class Metrics:
+    # Метрики процесса в текстовом формате Prometheus на /metrics: время
+    # ответа по endpoint, число и время SQL запросов на запрос, время
+    # отдельных участков (шаблоны, почта, фото). При нескольких процессах
+    # каждый отдаёт свои значения, Prometheus складывает их сам.
+    #
+    # METRICS_DEBUG_HEADERS добавляет к ответу X-Query-Count и X-DB-Time,
+    # запросы дольше METRICS_SLOW_REQUEST секунд пишутся в лог вместе с их
+    # SQL, а METRICS_SLOW_KEEP самых медленных хранятся для slow_requests().
+    # Значения у каждого приложения свои, см. MetricsRegistry.
+
+    def __init__(self, app=None, db=None):
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('METRICS_DEBUG_HEADERS', False)
+        app.config.setdefault('METRICS_SLOW_REQUEST', 1.0)
+        app.config.setdefault('METRICS_SLOW_KEEP', 20)
+        registry = MetricsRegistry(app)
+        app.before_request(registry.before_request)
+        app.after_request(registry.after_request)
+        app.add_url_rule('/metrics', 'metrics', registry.metrics_view)
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, 'before_cursor_execute', registry.before_cursor_execute)
+                event.listen(engine, 'after_cursor_execute', registry.after_cursor_execute)
+                event.listen(engine, 'handle_error', registry.handle_error)
+        app.extensions['metrics'] = registry
+
+    def timed(self, section):
+        # Декоратор: время вызова попадает в section_duration_seconds{section=...}
+        # текущего приложения и в разбивку текущего запроса для журнала
+        # медленных запросов
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    elapsed = time.perf_counter() - start
+                    if has_app_context() and 'metrics' in current_app.extensions:
+                        current_app.extensions['metrics'].sections.observe(elapsed, section)
+                    if has_request_context() and 'metrics_sections' in g:
+                        g.metrics_sections[section] = g.metrics_sections.get(section, 0) + elapsed
+            return wrapper
+        return decorator
+
+    def slow_requests(self):
+        return current_app.extensions['metrics'].slow_requests()
@@ -0,0 +1,39 @@
+"""add products_fts
+
+Revision ID: 9c2e41d7a8f3
+Revises: 3f1d2c9a7b40
+Create Date: 2026-10-18 13:02:17.204551
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+import html
+import re
+
+
+# revision identifiers, used by Alembic.
+revision = '9c2e41d7a8f3'
+down_revision = '3f1d2c9a7b40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        "CREATE VIRTUAL TABLE products_fts USING fts5("
+        "name, description, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+    conn = op.get_bind()
+    rows = conn.execute(sa.text('SELECT id, name, description FROM products')).all()
+    if rows:
+        conn.execute(
+            sa.text('INSERT INTO products_fts (rowid, name, description) VALUES (:id, :name, :description)'),
+            [{'id': id, 'name': name,
+              'description': html.unescape(re.sub(r'<[^>]+>', ' ', description or ''))}
+             for id, name, description in rows]
+        )
+
+
+def downgrade():
+    op.execute('DROP TABLE products_fts')
@@ -0,0 +1,122 @@
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+import collections
+import contextlib
+import os
+import re
+import threading
+import traceback
+
+# IN (?, ?, ?) с разным числом параметров - один и тот же запрос
+IN_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+SPACES_RE = re.compile(r'\s+')
+# кадры этих библиотек пропускаются при поиске места вызова
+LIBRARY_DIRS = tuple(os.path.dirname(__import__(name).__file__) + os.sep
+                     for name in ('sqlalchemy', 'flask', 'flask_sqlalchemy', 'werkzeug', 'jinja2'))
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class NPlusOneDetected(AssertionError):
+    pass
+
+
+def statement_shape(statement):
+    return IN_LIST_RE.sub('(?)', SPACES_RE.sub(' ', statement).strip())
+
+
+def call_site():
+    # Первый кадр стека вне SQLAlchemy/Flask - код приложения или шаблон
+    for frame in reversed(traceback.extract_stack()[:-2]):
+        if not frame.filename.startswith(LIBRARY_DIRS) and frame.filename != __file__:
+            return f'{frame.filename}:{frame.lineno} in {frame.name}'
+    return '?'
+
+
+class QueryBudget(contextlib.ContextDecorator):
+    # Контекстный менеджер и декоратор: падает с QueryBudgetExceeded, если
+    # внутри выполнено больше max_queries SQL запросов в текущем потоке.
+    #
+    #     with tracker.budget(3):
+    #         client.get('/catalog')
+
+    def __init__(self, tracker, max_queries):
+        self.tracker = tracker
+        self.max_queries = max_queries
+        self.statements = []
+
+    def __enter__(self):
+        self.statements = []
+        self.tracker.recorders().append(self.statements)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracker.recorders().remove(self.statements)
+        if exc_type is None and len(self.statements) > self.max_queries:
+            raise QueryBudgetExceeded(
+                f'{len(self.statements)} SQL запросов при бюджете {self.max_queries}:\n'
+                + '\n'.join(f'  {statement}' for statement in self.statements))
+        return False
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+class QueryTracker:
+    # Считает SQL запросы потока для бюджетов и в режиме разработки ищет N+1:
+    # одинаковые по форме запросы, повторённые в одном HTTP запросе не меньше
+    # QUERY_NPLUSONE_THRESHOLD раз. QUERY_NPLUSONE: 'off', 'log' или 'raise'
+    # (по умолчанию 'log' при app.debug).
+
+    def __init__(self, app=None, db=None):
+        self.local = threading.local()
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('QUERY_NPLUSONE', 'log' if app.debug else 'off')
+        app.config.setdefault('QUERY_NPLUSONE_THRESHOLD', 5)
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+        if app.config['QUERY_NPLUSONE'] != 'off':
+            app.before_request(self.before_request)
+            app.after_request(self.after_request)
+        app.extensions['query_tracker'] = self
+
+    def recorders(self):
+        if not hasattr(self.local, 'recorders'):
+            self.local.recorders = []
+        return self.local.recorders
+
+    def budget(self, max_queries):
+        return QueryBudget(self, max_queries)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        for recorder in self.recorders():
+            recorder.append(statement)
+        if has_request_context() and 'query_shapes' in g:
+            shape = statement_shape(statement)
+            g.query_shapes[shape] += 1
+            if g.query_shapes[shape] == 2:
+                g.query_sites[shape] = call_site()
+
+    def before_request(self):
+        g.query_shapes = collections.Counter()
+        g.query_sites = {}
+
+    def after_request(self, response):
+        threshold = current_app.config['QUERY_NPLUSONE_THRESHOLD']
+        repeated = [(shape, count) for shape, count in g.get('query_shapes', {}).items() if count >= threshold]
+        if not repeated:
+            return response
+        report = '\n'.join(f'  {count} раз из {g.query_sites[shape]}: {shape}' for shape, count in repeated)
+        message = f'N+1 в {request.method} {request.path}:\n{report}'
+        if current_app.config['QUERY_NPLUSONE'] == 'raise':
+            raise NPlusOneDetected(message)
+        current_app.logger.warning(message)
+        return response
@@ -0,0 +1,202 @@
+from flask import current_app, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt import PyJWTError
+from werkzeug.exceptions import TooManyRequests
+
+import functools
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from cache import LRUCache
+
+RATE_RE = re.compile(r'^\s*(\d+)\s*/\s*(second|minute|hour)\s*$')
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600}
+
+
+def parse_rate(rate):
+    # '10/minute' -> токенов в секунду
+    match = RATE_RE.match(rate)
+    if not match:
+        raise ValueError(f'неверный лимит {rate!r}, ожидается вида "10/minute"')
+    return int(match.group(1)) / PERIODS[match.group(2)]
+
+
+def client_ip():
+    return request.remote_addr or '-'
+
+
+def jwt_identity_or_ip():
+    # пользователь API по токену, без токена (или с негодным) - адрес клиента
+    try:
+        verify_jwt_in_request(optional=True)
+        identity = get_jwt_identity()
+    except (JWTExtendedException, PyJWTError):
+        identity = None
+    return f'user:{identity}' if identity is not None else client_ip()
+
+
+def limited_method(methods):
+    return methods is None or request.method in methods
+
+
+def refill(tokens, updated, now, rate, burst):
+    # Ведро пополняется на rate токенов в секунду, но не больше burst.
+    # Возвращает (токенов после запроса, секунд до следующего токена или 0).
+    tokens = min(burst, tokens + (now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0
+    return tokens, (1 - tokens) / rate
+
+
+class MemoryBuckets:
+    # Вёдра процесса; давно не использованные вытесняются, что равносильно
+    # полному ведру
+    def __init__(self, max_entries=100000):
+        self.buckets = LRUCache(max_entries)
+        self.lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (burst, now))
+            tokens, wait = refill(tokens, updated, now, rate, burst)
+            self.buckets.set(key, (tokens, now))
+        return wait
+
+
+class SQLiteBuckets:
+    # Вёдра в отдельном файле SQLite, общем для всех процессов на машине
+    # (например, /dev/shm/ratelimit.db). Чтение и запись ведра - одна
+    # транзакция BEGIN IMMEDIATE, поэтому процессы не теряют списания друг друга.
+    cleanup_every = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.calls = 0
+        with self.connect() as con:
+            con.execute('CREATE TABLE IF NOT EXISTS buckets '
+                        '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL) WITHOUT ROWID')
+
+    def connect(self):
+        con = sqlite3.connect(self.path, timeout=1, isolation_level=None, check_same_thread=False)
+        con.execute('PRAGMA journal_mode = WAL')
+        con.execute('PRAGMA synchronous = OFF')
+        return con
+
+    def connection(self):
+        # соединение на поток; после fork соединения родителя не используются
+        if getattr(self.local, 'pid', None) != os.getpid():
+            self.local.connection = self.connect()
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    def take(self, key, rate, burst):
+        # время стены, а не monotonic: часы должны совпадать у всех процессов
+        now = time.time()
+        con = self.connection()
+        con.execute('BEGIN IMMEDIATE')
+        try:
+            row = con.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens, wait = refill(*(row or (burst, now)), now, rate, burst)
+            con.execute('INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) '
+                        'ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated',
+                        (key, tokens, now))
+            self.calls += 1
+            if self.calls % self.cleanup_every == 0:
+                # вёдра, которые за час точно наполнились
+                con.execute('DELETE FROM buckets WHERE updated < ?', (now - 3600,))
+            con.execute('COMMIT')
+        except BaseException:
+            con.execute('ROLLBACK')
+            raise
+        return wait
+
+
+def make_buckets(storage):
+    # RATELIMIT_STORAGE: 'memory' или 'sqlite:///путь/к/файлу'
+    if storage == 'memory':
+        return MemoryBuckets()
+    if storage.startswith('sqlite:///'):
+        return SQLiteBuckets(storage[len('sqlite:///'):])
+    raise ValueError(f'неизвестное хранилище лимитов {storage!r}')
+
+
+class LimiterState:
+    # Вёдра и семафоры одного приложения (app.extensions['ratelimit'])
+
+    def __init__(self, storage):
+        self.buckets = make_buckets(storage)
+        self.semaphores = {}
+        self.lock = threading.Lock()
+
+    def semaphore(self, name, limit):
+        with self.lock:
+            if name not in self.semaphores:
+                self.semaphores[name] = threading.BoundedSemaphore(limit)
+            return self.semaphores[name]
+
+
+class RateLimiter:
+    # Ограничения дорогих endpoint, объявляемые декораторами:
+    #
+    #     @limiter.limit('10/minute', burst=5, key=client_ip)
+    #     @limiter.concurrency('auth', 4)
+    #     def login(): ...
+    #
+    # limit - token bucket на ключ (адрес клиента, пользователь JWT), вёдра
+    # в памяти процесса или в общем SQLite файле (RATELIMIT_STORAGE).
+    # concurrency - не больше limit одновременных запросов класса в процессе.
+    # Лишние запросы получают 429 с Retry-After до того, как view начнёт работу.
+    # methods ограничивает действие декоратора методами HTTP (например, только
+    # POST формы входа, а не показ самой формы).
+    # RATELIMIT_ENABLED=False отключает оба ограничения.
+    # Состояние у каждого приложения своё, декораторы берут его из current_app.
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RATELIMIT_ENABLED', True)
+        app.config.setdefault('RATELIMIT_STORAGE', 'memory')
+        app.extensions['ratelimit'] = LimiterState(app.config['RATELIMIT_STORAGE'])
+
+    def limit(self, rate, burst=None, key=client_ip, scope=None, methods=None):
+        per_second = parse_rate(rate)
+        burst = burst or max(1, round(per_second * 60))
+
+        def decorator(fn):
+            name = scope or fn.__qualname__
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if current_app.config['RATELIMIT_ENABLED'] and limited_method(methods):
+                    buckets = current_app.extensions['ratelimit'].buckets
+                    wait = buckets.take(f'{name}:{key()}', per_second, burst)
+                    if wait:
+                        raise TooManyRequests(retry_after=math.ceil(wait))
+                return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def concurrency(self, name, limit, retry_after=1, methods=None):
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not current_app.config['RATELIMIT_ENABLED'] or not limited_method(methods):
+                    return fn(*args, **kwargs)
+                semaphore = current_app.extensions['ratelimit'].semaphore(name, limit)
+                if not semaphore.acquire(blocking=False):
+                    raise TooManyRequests(retry_after=retry_after)
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    semaphore.release()
+            return wrapper
+        return decorator
@@ -1,46 +1,102 @@
-from flask import Flask, request, render_template, url_for, flash, redirect, current_app, session, jsonify
+from flask import Blueprint, Flask, current_app, request, render_template, url_for, flash, redirect, session, jsonify, \
+    make_response, stream_with_context
+from flask.cli import with_appcontext
+from markupsafe import Markup, escape
 from flask_login import UserMixin, login_user, LoginManager, login_required, logout_user, current_user
-from werkzeug.utils import secure_filename
+from werkzeug.http import is_resource_modified
+from werkzeug.local import LocalProxy
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
+from assets import Assets, build_assets
+from cache import LRUCache
+from dbprofile import RoutingSession, apply_sqlite_profile, configure_database, read_only_db
+from metrics import Metrics
+from querybudget import QueryTracker
+from ratelimit import RateLimiter, client_ip, jwt_identity_or_ip
+from jsonprovider import configure_json, output_json
+from images import InvalidImage, process_image, validate_image, variant_files, content_hash
 from webforms import ReviewForm, PaymentForm, SearchForm, LoginForm, RegisterForm, AddProductForm
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from flask_ckeditor import CKEditor
 from flask_restful import Api, abort, Resource
-from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt_identity
-
+from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt_identity, get_current_user
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt import PyJWTError
+from sqlalchemy import bindparam, delete, event, func, literal, literal_column, or_, select, text, tuple_, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+import atexit
+import click
+import codecs
+import collections
+import concurrent.futures
+import functools
+import hashlib
+import html
+import json
 import os
+import re
+import secrets
 import smtplib
-import uuid
+import threading
+import time
 
+from abc import ABC, abstractmethod
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
-app = Flask(__name__)
-ckeditor = CKEditor(app)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///users.db'
-app.config['SECRET_KEY'] = 'dsjahfjshdfjasf54564'
-api = Api(app)
-jwt = JWTManager(app)
+# расширения создаются без приложения и подключаются в create_app
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+ckeditor = CKEditor()
+jwt = JWTManager()
+assets = Assets()
+metrics = Metrics()
+query_tracker = QueryTracker()
+limiter = RateLimiter()
+login_manager = LoginManager()
+login_manager.login_view = 'storefront.login'
+login_manager.login_message = 'Сначала нужно войти в аккаунт'
+
+storefront_bp = Blueprint('storefront', __name__)
+cart_bp = Blueprint('cart', __name__)
+admin_bp = Blueprint('admin', __name__)
+api_bp = Blueprint('api', __name__)
+
+
+class StoreApi(Api):
+    # Ошибки JWT (нет токена, истёкший токен, удалённый пользователь) уходят
+    # обработчикам flask_jwt_extended и дают 401/422; остальные ошибки
+    # flask_restful отдаёт как обычно
+    def handle_error(self, e):
+        if isinstance(e, (JWTExtendedException, PyJWTError)):
+            raise e
+        return super().handle_error(e)
+
+
+api = StoreApi(api_bp)
+api.representation('application/json')(output_json)
+
+# время рендеринга шаблонов попадает в section_duration_seconds{section="render_template"}
+render_template = metrics.timed('render_template')(render_template)
 
 UPLOAD_FOLDER = 'static/img/products'
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
 
-login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
-login_manager.login_message = 'Сначала нужно войти в аккаунт'
+def include_object(object, name, type_, reflected, compare_to):
+    # служебные таблицы полнотекстового индекса не описаны моделями
+    return not (type_ == 'table' and name.startswith('products_fts'))
 
 
 class Reviews(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(70), nullable=False)
     review = db.Column(db.Text, nullable=False)
-    date_added = db.Column(db.Date, default=date.today())
+    date_added = db.Column(db.Date, default=date.today)
+
+    # лента отзывов идёт по (date_added, id) от новых к старым; id - rowid,
+    # поэтому поиск страницы по курсору и подсчёт не читают саму таблицу
+    __table_args__ = (db.Index('ix_reviews_date_added_id', 'date_added', 'id'),)
 
 
 class User(db.Model, UserMixin):
@@ -62,104 +118,633 @@ class Products(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(70), nullable=False)
     price = db.Column(db.Integer, nullable=False)
-    stock = db.Column(db.Integer, nullable=False)
+    # число ключей товара в activation_keys; поддерживается триггерами,
+    # приложение его не записывает
+    stock = db.Column(db.Integer, nullable=False, default=0)
     description = db.Column(db.Text, nullable=False)
 
     img_1 = db.Column(db.String(150), nullable=False)
     img_2 = db.Column(db.String(150), nullable=False)
     img_3 = db.Column(db.String(150), nullable=False)
+    # варианты фото разной ширины: {'img_1': {'hash': ..., 'fallback': '.jpg', 'widths': {...}}, ...}
+    img_variants = db.Column(db.JSON)
+
+    # сколько ключей продано за всё время, увеличивается в pay()
+    sold = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    # версия и время изменения строки для ETag/Last-Modified страницы товара и API;
+    # увеличиваются любым UPDATE products (ORM и update(Products)), SQL в обход
+    # ORM и триггеры ключей меняют их сами
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1', onupdate=text('version + 1'))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     keys = db.relationship("ActivationKeys", back_populates='product')
 
+    # частичные индексы по товарам в наличии: каталог по id, добор главной по продажам
+    __table_args__ = (
+        db.Index('ix_products_in_stock', 'id', sqlite_where=text('stock > 0')),
+        db.Index('ix_products_in_stock_sold', sold.desc(), 'id', sqlite_where=text('stock > 0')),
+    )
+
+
+# условие частичных индексов выше: SQLite применяет их, только если в запросе
+# тот же литерал, поэтому 0 не передаётся параметром
+IN_STOCK = Products.stock > literal_column('0')
+
+
+class SalesDaily(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Integer, nullable=False, default=0)
+
+
+class TopSales(db.Model):
+    # Небольшой рейтинг самых продаваемых товаров (TOP_SALES_SIZE строк),
+    # обновляется в транзакции каждой покупки
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), primary_key=True)
+    sold = db.Column(db.Integer, nullable=False)
+
+
+class Cart(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+
+class CartItem(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    cart_id = db.Column(db.String(32), db.ForeignKey('cart.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (db.UniqueConstraint('cart_id', 'product_id', name='uq_cart_item_cart_id_product_id'),)
+
+
+class CacheVersion(db.Model):
+    # Счётчики версий для сброса кэшей во всех процессах: любая запись,
+    # меняющая данные, увеличивает версию в той же транзакции
+    name = db.Column(db.String(30), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class RowCount(db.Model):
+    # Число строк больших таблиц, чтобы не выполнять COUNT(*) на каждой
+    # странице; меняется в той же транзакции, что и вставка или удаление
+    name = db.Column(db.String(30), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class MailQueue(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    # pending -> sending -> sent | failed
+    status = db.Column(db.String(10), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    __table_args__ = (db.Index('ix_mail_queue_status_next_attempt_at', 'status', 'next_attempt_at'),)
+
 
 class ActivationKeys(db.Model):
+    # Вставка, удаление и перенос ключа меняют products.stock триггерами
+    # activation_keys_stock_* (см. миграцию), сверка - flask stock-reconcile
     id = db.Column(db.Integer, primary_key=True)
     key = db.Column(db.String(70), nullable=False)
     product_id = db.Column(db.Integer,
-                           db.ForeignKey("products.id"))
+                           db.ForeignKey("products.id"), index=True)
     product = db.relationship('Products')
+    # аренда ключа пулом процесса (см. KeyPool): до leased_until ключ
+    # продаёт только lease_owner
+    lease_owner = db.Column(db.String(40))
+    leased_until = db.Column(db.DateTime)
+
+    @classmethod
+    def available(cls, now):
+        # ключ не арендован или аренда истекла
+        return or_(cls.leased_until.is_(None), cls.leased_until < now)
+
+
+class CachedUser(UserMixin):
+    # Снимок пользователя для current_user без password_hash
+    def __init__(self, id, name, email):
+        self.id = id
+        self.name = name
+        self.email = email
+
+
+# кэши и хранилище корзин свои у каждого приложения, создаются в create_app
+identity_cache = LocalProxy(lambda: current_app.extensions['identity_cache'])
+
+
+def get_cached_user(user_id):
+    user = identity_cache.get(user_id)
+    if user is None:
+        row = db.session.execute(select(User.id, User.name, User.email).where(User.id == user_id)).first()
+        if row is None:
+            return None
+        user = CachedUser(*row)
+        identity_cache.set(user_id, user)
+    return user
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def invalidate_cached_user(mapper, connection, user):
+    identity_cache.delete(user.id)
+
+
+@jwt.user_identity_loader
+def user_identity(user_id):
+    return str(user_id)
+
+
+@jwt.user_lookup_loader
+def jwt_user_lookup(jwt_header, jwt_data):
+    return get_cached_user(int(jwt_data['sub']))
+
+
+# полнотекстовый поиск по товарам: виртуальная таблица FTS5 products_fts,
+# rowid которой совпадает с id товара
+SEARCH_LIMIT = 50
+HTML_TAG_RE = re.compile(r'<[^>]+>')
+SEARCH_TERM_RE = re.compile(r'\w+')
+
+
+def strip_html(value):
+    return html.unescape(HTML_TAG_RE.sub(' ', value or ''))
+
+
+def index_product(connection, product):
+    connection.execute(text('DELETE FROM products_fts WHERE rowid = :id'), {'id': product.id})
+    connection.execute(
+        text('INSERT INTO products_fts (rowid, name, description) VALUES (:id, :name, :description)'),
+        {'id': product.id, 'name': product.name, 'description': strip_html(product.description)}
+    )
+
+
+@event.listens_for(Products, 'after_insert')
+def add_to_search_index(mapper, connection, product):
+    index_product(connection, product)
+
+
+@event.listens_for(Products, 'after_update')
+def update_search_index(mapper, connection, product):
+    state = db.inspect(product)
+    if state.attrs.name.history.has_changes() or state.attrs.description.history.has_changes():
+        index_product(connection, product)
+
+
+@event.listens_for(Products, 'after_delete')
+def remove_from_search_index(mapper, connection, product):
+    connection.execute(text('DELETE FROM products_fts WHERE rowid = :id'), {'id': product.id})
+
+
+def reindex_products(ids):
+    unindex_products(ids)
+    rows = db.session.execute(
+        select(Products.id, Products.name, Products.description).where(Products.id.in_(ids))
+    ).all()
+    if rows:
+        db.session.connection().execute(
+            text('INSERT INTO products_fts (rowid, name, description) VALUES (:id, :name, :description)'),
+            [{'id': id, 'name': name, 'description': strip_html(description)} for id, name, description in rows]
+        )
+
+
+def unindex_products(ids):
+    db.session.connection().execute(
+        text('DELETE FROM products_fts WHERE rowid IN :ids').bindparams(bindparam('ids', expanding=True)),
+        {'ids': list(ids)}
+    )
+
+
+def highlight_markup(value):
+    # FTS5 размечает совпадения управляющими символами, чтобы экранировать
+    # текст до того, как в нём появятся теги <mark>
+    return Markup(str(escape(value)).replace('\x02', '<mark>').replace('\x03', '</mark>'))
+
+
+def search_products(query, limit=SEARCH_LIMIT):
+    # Возвращает [(товар, название с подсветкой, фрагмент описания)] по убыванию релевантности (BM25)
+    terms = SEARCH_TERM_RE.findall(query)
+    if not terms:
+        return []
+    rows = db.session.execute(
+        text('SELECT rowid, '
+             "highlight(products_fts, 0, char(2), char(3)), "
+             "snippet(products_fts, 1, char(2), char(3), '…', 16) "
+             'FROM products_fts WHERE products_fts MATCH :match '
+             'ORDER BY bm25(products_fts, 10.0, 1.0) LIMIT :limit'),
+        {'match': ' '.join(f'"{term}"*' for term in terms), 'limit': limit}
+    ).all()
+    products = {product.id: product for product in
+                Products.query.filter(Products.id.in_([row[0] for row in rows]))}
+    return [(products[id], highlight_markup(name), highlight_markup(snippet))
+            for id, name, snippet in rows if id in products]
+
+
+def rebuild_search_index(batch_size=1000):
+    connection = db.session.connection()
+    connection.execute(text('DELETE FROM products_fts'))
+    last_id = 0
+    while True:
+        batch = db.session.execute(
+            select(Products.id, Products.name, Products.description)
+            .where(Products.id > last_id)
+            .order_by(Products.id)
+            .limit(batch_size)
+        ).all()
+        if not batch:
+            break
+        connection.execute(
+            text('INSERT INTO products_fts (rowid, name, description) VALUES (:id, :name, :description)'),
+            [{'id': id, 'name': name, 'description': strip_html(description)} for id, name, description in batch]
+        )
+        last_id = batch[-1][0]
+    connection.execute(text("INSERT INTO products_fts (products_fts) VALUES ('optimize')"))
+    db.session.commit()
+
+
+@click.command('search-reindex')
+@with_appcontext
+def search_reindex_command():
+    """Перестроить полнотекстовый индекс товаров."""
+    rebuild_search_index()
+    click.echo(f'Проиндексировано товаров: {Products.query.count()}')
+
+
+# кэш страниц каталога: кэшируются только блоки title и content шаблона,
+# а base.html (навбар, корзина, CSRF токен формы поиска, flash сообщения)
+# рендерится на каждый запрос
+page_cache = LocalProxy(lambda: current_app.extensions['page_cache'])
+
+
+def page_blocks_size(blocks):
+    return sum(len(block.encode()) for block in blocks.values())
+
+
+def cache_version(name):
+    return db.session.execute(
+        select(CacheVersion.version).where(CacheVersion.name == name)
+    ).scalar() or 0
+
+
+def bump_cache_version(name):
+    # вызывается до commit той транзакции, которая меняет данные
+    updated = db.session.execute(
+        update(CacheVersion).where(CacheVersion.name == name).values(version=CacheVersion.version + 1)
+    ).rowcount
+    if not updated:
+        db.session.add(CacheVersion(name=name, version=1))
+
+
+def row_count(name):
+    return db.session.execute(select(RowCount.count).where(RowCount.name == name)).scalar() or 0
+
+
+def add_row_count(name, delta):
+    # вызывается до commit той транзакции, которая вставляет или удаляет строки
+    updated = db.session.execute(
+        update(RowCount).where(RowCount.name == name).values(count=RowCount.count + delta)
+    ).rowcount
+    if not updated:
+        db.session.add(RowCount(name=name, count=max(delta, 0)))
+
+
+def render_cached_page(template_name, key, build_context):
+    if not current_app.config['PAGE_CACHE_ENABLED']:
+        return render_template(template_name, **build_context())
+    key = key + (cache_version('catalog'),)
+    blocks = page_cache.get(key)
+    if blocks is None:
+        template = current_app.jinja_env.get_template(template_name)
+        context = template.new_context(build_context())
+        blocks = {name: Markup(''.join(template.blocks[name](context)))
+                  for name in ('title', 'content') if name in template.blocks}
+        page_cache.set(key, blocks)
+    return render_template('cached_page.html', blocks=blocks)
+
+
+def conditional_response(etag, last_modified, build_response, weak=False):
+    # Проверка If-None-Match/If-Modified-Since до построения ответа: при
+    # совпадении 304 отдаётся без рендера шаблона и сериализации.
+    # last_modified=None - проверка только по ETag, без Last-Modified
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = make_response('', 304)
+    else:
+        response = make_response(build_response())
+    response.set_etag(etag, weak=weak)
+    if last_modified is not None:
+        # werkzeug превращает None в текущее время
+        response.last_modified = last_modified
+    return response
 
 
 # api ресурсы
-def abort_if_not_found(id, model):
-    response = model.query.get_or_404(id)
-    if not response:
+def get_or_abort(model, id):
+    obj = db.session.get(model, id)
+    if obj is None:
         abort(404, message=f'Id {id} not found')
+    return obj
+
+
+API_PAGE_LIMIT = 100
+API_MAX_PAGE_LIMIT = 1000
+API_MAX_BATCH = 10000
+NDJSON_MIMETYPE = 'application/x-ndjson'
+# строк на одну выборку из курсора и на один кусок потокового ответа
+API_STREAM_BATCH = 1000
+
+
+def wants_ndjson():
+    return request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def versioned_response(version_name, build_response):
+    # Сильный ETag из версии данных и параметров запроса: если клиент прислал
+    # тот же If-None-Match, отвечаем 304, не выполняя запрос к базе
+    query = '&'.join(f'{key}={value}' for key, value in sorted(request.args.items(multi=True)))
+    representation = 'ndjson' if wants_ndjson() else 'json'
+    etag = hashlib.sha1(
+        f'{request.path}?{query}:{representation}:{version_name}:{cache_version(version_name)}'.encode()
+    ).hexdigest()
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+    else:
+        response = build_response()
+    response.set_etag(etag)
+    response.vary.add('Accept')
+    return response
+
+
+def keyset_page(model, allowed_fields):
+    # Страница списка с курсором по id: ?cursor=<последний id>&limit=N&fields=a,b.
+    # С Accept: application/x-ndjson - все строки после cursor (или первые
+    # limit) потоком, по объекту на строку, без сборки списка в памяти
+    stream = wants_ndjson()
+    try:
+        cursor = int(request.args.get('cursor', 0))
+        limit = int(request.args['limit']) if 'limit' in request.args else None
+    except ValueError:
+        abort(400, message='cursor и limit должны быть числами')
+    if limit is None and not stream:
+        limit = API_PAGE_LIMIT
+    if limit is not None and (limit < 1 or not stream and limit > API_MAX_PAGE_LIMIT):
+        abort(400, message=f'limit должен быть от 1 до {API_MAX_PAGE_LIMIT}')
+    fields = request.args.get('fields')
+    fields = fields.split(',') if fields else list(allowed_fields)
+    unknown = [field for field in fields if field not in allowed_fields]
+    if unknown:
+        abort(400, message=f'Неизвестные поля: {", ".join(unknown)}')
+    columns = [getattr(model, field) for field in fields]
+    query = select(model.id, *columns).where(model.id > cursor).order_by(model.id)
+    if stream:
+        if limit is not None:
+            query = query.limit(limit)
+        return current_app.response_class(stream_with_context(stream_rows(query, fields)), mimetype=NDJSON_MIMETYPE)
+    rows = db.session.execute(query.limit(limit + 1)).all()
+    next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+    return jsonify({
+        'response': [dict(zip(fields, row[1:])) for row in rows[:limit]],
+        'next_cursor': next_cursor,
+    })
+
+
+def stream_rows(query, fields):
+    # yield_per: SQLite отдаёт строки из курсора по мере чтения, в памяти
+    # одновременно не больше API_STREAM_BATCH строк
+    dumps = current_app.json.dumps_bytes
+    result = db.session.execute(query.execution_options(yield_per=API_STREAM_BATCH))
+    try:
+        for rows in result.partitions():
+            yield b''.join(dumps(dict(zip(fields, row[1:]))) + b'\n' for row in rows)
+    finally:
+        result.close()
+
+
+PRODUCT_API_FIELDS = ('id', 'name', 'price', 'stock')
+# поля, которые можно передать в POST /api/v1/products:batch, и обязательные при создании
+PRODUCT_BATCH_FIELDS = {'name': str, 'price': int, 'description': str,
+                        'img_1': str, 'img_2': str, 'img_3': str}
+PRODUCT_REQUIRED_FIELDS = ('name', 'price', 'description', 'img_1', 'img_2', 'img_3')
+
+
+def product_json(product):
+    return {field: getattr(product, field) for field in PRODUCT_API_FIELDS}
+
+
+def parse_ids():
+    try:
+        ids = [int(id) for id in request.args['ids'].split(',') if id]
+    except ValueError:
+        abort(400, message='ids - список чисел через запятую')
+    if len(ids) > API_MAX_BATCH:
+        abort(400, message=f'не больше {API_MAX_BATCH} id за запрос')
+    return ids
+
+
+def get_products_batch(ids):
+    # Все товары одним запросом IN (...), порядок и дубли - как в запросе
+    rows = {row.id: row for row in db.session.execute(
+        select(*[getattr(Products, field) for field in PRODUCT_API_FIELDS]).where(Products.id.in_(set(ids)))
+    )}
+    return [{'id': id, 'status': 200, 'product': dict(rows[id]._mapping)} if id in rows
+            else {'id': id, 'status': 404} for id in ids]
+
+
+def parse_batch_items():
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        try:
+            items = [current_app.json.loads(line) for line in request.get_data(as_text=True).splitlines()
+                     if line.strip()]
+        except ValueError as e:
+            abort(400, message=f'некорректный NDJSON: {e}')
+    else:
+        items = request.get_json(silent=True)
+        if isinstance(items, dict):
+            items = items.get('items')
+    if not isinstance(items, list):
+        abort(400, message='тело запроса - массив товаров, {"items": [...]} или NDJSON')
+    if len(items) > API_MAX_BATCH:
+        abort(400, message=f'не больше {API_MAX_BATCH} товаров за запрос')
+    return items
+
+
+def validate_batch_item(item):
+    # Возвращает (id или None, значения полей) или бросает ValueError с описанием ошибки
+    if not isinstance(item, dict):
+        raise ValueError('элемент должен быть объектом')
+    unknown = set(item) - set(PRODUCT_BATCH_FIELDS) - {'id'}
+    if unknown:
+        raise ValueError(f'неизвестные поля: {", ".join(sorted(unknown))}')
+    id = item.get('id')
+    if id is not None and (not isinstance(id, int) or isinstance(id, bool)):
+        raise ValueError('id должен быть числом')
+    values = {}
+    for field, kind in PRODUCT_BATCH_FIELDS.items():
+        if field in item:
+            if not isinstance(item[field], kind) or isinstance(item[field], bool):
+                raise ValueError(f'поле {field} должно быть {"числом" if kind is int else "строкой"}')
+            values[field] = item[field]
+    if id is None:
+        missing = [field for field in PRODUCT_REQUIRED_FIELDS if field not in values]
+        if missing:
+            raise ValueError(f'для нового товара нужны поля: {", ".join(missing)}')
+    elif not values:
+        raise ValueError('нет полей для обновления')
+    return id, values
+
+
+def upsert_products(items):
+    # Элементы с id обновляются, без id - создаются. Некорректные элементы
+    # и несуществующие id получают свой статус и не мешают остальным.
+    results = [None] * len(items)
+    inserts, updates = [], []
+    for index, item in enumerate(items):
+        try:
+            id, values = validate_batch_item(item)
+        except ValueError as e:
+            results[index] = {'index': index, 'status': 400, 'message': str(e)}
+            continue
+        if id is None:
+            inserts.append((index, values))
+        else:
+            updates.append((index, id, values))
+
+    existing = set(db.session.execute(
+        select(Products.id).where(Products.id.in_({id for _, id, _ in updates}))
+    ).scalars()) if updates else set()
+    changed = []
+    # bulk UPDATE по первичному ключу группируется по набору полей
+    groups = {}
+    for index, id, values in updates:
+        if id not in existing:
+            results[index] = {'index': index, 'id': id, 'status': 404}
+            continue
+        groups.setdefault(tuple(sorted(values)), []).append(dict(values, id=id))
+        results[index] = {'index': index, 'id': id, 'status': 200}
+        changed.append(id)
+    for rows in groups.values():
+        db.session.execute(update(Products), rows)
+    if inserts:
+        ids = db.session.execute(
+            sqlite_insert(Products).returning(Products.id, sort_by_parameter_order=True),
+            [values for _, values in inserts]
+        ).scalars().all()
+        for (index, _), id in zip(inserts, ids):
+            results[index] = {'index': index, 'id': id, 'status': 201}
+        changed += ids
+    if changed:
+        # массовые INSERT/UPDATE не вызывают события ORM, индекс поиска обновляем сами
+        reindex_products(changed)
+        bump_cache_version('catalog')
+    db.session.commit()
+    return results
+
+
+def delete_products(ids):
+    existing = set(db.session.execute(select(Products.id).where(Products.id.in_(set(ids)))).scalars())
+    if existing:
+        # как и при удалении через ORM, ключи остаются без товара
+        db.session.execute(update(ActivationKeys).where(ActivationKeys.product_id.in_(existing))
+                           .values(product_id=None), execution_options={'synchronize_session': False})
+        db.session.execute(delete(Products).where(Products.id.in_(existing)),
+                           execution_options={'synchronize_session': False})
+        unindex_products(existing)
+        bump_cache_version('catalog')
+        db.session.commit()
+    return [{'id': id, 'status': 200 if id in existing else 404} for id in ids]
 
 
 class JWTLoginResource(Resource):
+    @limiter.limit('10/minute', burst=10, key=client_ip, scope='login')
+    @limiter.concurrency('auth', 4)
     def post(self):
         email = request.headers.get('email')
         password = request.headers.get('password')
         user = User.query.filter_by(email=email).first()
+        if user is None:
+            abort(401, message='Пользователь не найден')
         if user.id not in [1, 3]:
             return jsonify({'message': 'доступ запрещен'})
-        password = password
-        if user:
-            if check_password_hash(user.password_hash, password):
-                access_token = user.get_token()
-                return jsonify({'access_token': access_token})
-            else:
-                return jsonify({
-                    'message': "Неверный пароль",
-                })
+        if check_password_hash(user.password_hash, password):
+            access_token = user.get_token()
+            return jsonify({'access_token': access_token})
         else:
             return jsonify({
-                'message': "Пользователь не найден",
+                'message': "Неверный пароль",
             })
 
 
 class ProductResource(Resource):
     @jwt_required()
+    @read_only_db
     def get(self, id):
-        abort_if_not_found(id, Products)
-        product = Products.query.get_or_404(id)
-        print(type(product.id))
-        print()
-        print()
-        print()
-        return jsonify(
-            {'response':
-                {
-                    'id': product.id,
-                    'name': product.name,
-                    'price': product.price,
-                    'stock': product.stock,
-                }
-            })
+        product = get_or_abort(Products, id)
+        return conditional_response(f'{product.id}-{product.version}', product.updated_at,
+                                    lambda: jsonify({'response': product_json(product)}))
 
     @jwt_required()
     def delete(self, id):
-        if current_user.id != 1:
+        if get_current_user().id != 1:
             return jsonify({'message': '403 forbidden'})
-        abort_if_not_found(id, Products)
-        product = db.session.query(Products).get_or_404(id)
+        product = get_or_abort(Products, id)
         db.session.delete(product)
+        bump_cache_version('catalog')
         db.session.commit()
         return jsonify({'success': 'OK'})
 
 
 class ProductListResource(Resource):
     @jwt_required()
+    @read_only_db
     def get(self):
-        products = Products.query.all()
-        return jsonify(
-            {
-                'response': [{
-                    'id': el.id,
-                    'name': el.name,
-                    'price': el.price,
-                    'stock': el.stock,
-                } for el in products],
-            }
-        )
+        if 'ids' in request.args:
+            return versioned_response('catalog', lambda: jsonify({'response': get_products_batch(parse_ids())}))
+        return versioned_response('catalog', lambda: keyset_page(Products, PRODUCT_API_FIELDS))
+
+
+class ProductBatchResource(Resource):
+    # Массовые операции над товарами для синхронизации каталога партнёров.
+    # POST - создание/обновление (JSON массив, {"items": [...]} или NDJSON),
+    # DELETE - удаление ({"ids": [...]} или ?ids=1,2,3). Каждая операция -
+    # одна транзакция, по каждому элементу возвращается свой статус.
+
+    @jwt_required()
+    @limiter.limit('30/minute', burst=10, key=jwt_identity_or_ip, scope='products_batch')
+    def post(self):
+        if get_current_user().id != 1:
+            return jsonify({'message': '403 forbidden'})
+        results = upsert_products(parse_batch_items())
+        return jsonify({'response': results})
+
+    @jwt_required()
+    @limiter.limit('30/minute', burst=10, key=jwt_identity_or_ip, scope='products_batch')
+    def delete(self):
+        if get_current_user().id != 1:
+            return jsonify({'message': '403 forbidden'})
+        if 'ids' in request.args:
+            ids = parse_ids()
+        else:
+            body = request.get_json(silent=True)
+            ids = body.get('ids') if isinstance(body, dict) else None
+            if not isinstance(ids, list) or not all(isinstance(id, int) and not isinstance(id, bool) for id in ids):
+                abort(400, message='нужен список id: {"ids": [1, 2, 3]}')
+            if len(ids) > API_MAX_BATCH:
+                abort(400, message=f'не больше {API_MAX_BATCH} id за запрос')
+        return jsonify({'response': delete_products(ids)})
 
 
 class UserResource(Resource):
     @jwt_required()
+    @read_only_db
     def get(self, id):
-        abort_if_not_found(id, User)
-        user = User.query.get_or_404(id)
+        user = get_or_abort(User, id)
         return jsonify(
             {
                 'response': {
@@ -172,31 +757,24 @@ class UserResource(Resource):
 
     @jwt_required()
     def delete(self, id):
-        abort_if_not_found(id, User)
-        user = db.session.query(User).get_or_404(id)
+        user = get_or_abort(User, id)
         db.session.delete(user)
+        bump_cache_version('users')
         db.session.commit()
         return jsonify({'success': 'OK'})
 
 
 class UserListResource(Resource):
     @jwt_required()
+    @read_only_db
     def get(self):
-        users = User.query.all()
-        return jsonify(
-            {
-                'response': [{
-                    'id': el.id,
-                    'name': el.name,
-                    'email': el.email,
-                } for el in users]
-            }
-        )
+        return versioned_response('users', lambda: keyset_page(User, ('id', 'name', 'email')))
 
 
 # определение url адресов для запросов к api
 api.add_resource(ProductResource, '/api/v1/product/<int:id>')
 api.add_resource(ProductListResource, '/api/v1/products')
+api.add_resource(ProductBatchResource, '/api/v1/products:batch')
 api.add_resource(UserResource, '/api/v1/users/<int:id>')
 api.add_resource(UserListResource, '/api/v1/users')
 
@@ -206,30 +784,68 @@ api.add_resource(JWTLoginResource, '/api/v1/jwt_login')
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return get_cached_user(int(user_id))
 
 
-@app.context_processor
+@storefront_bp.app_context_processor
 def base():
     form = SearchForm()
     return dict(form=form)
 
 
-@app.route('/reviews', methods=['GET', 'POST'])
+REVIEWS_PAGE_SIZE = 20
+
+
+def parse_reviews_cursor():
+    # ?after=<дата>.<id> - последний показанный отзыв
+    after = request.args.get('after')
+    if not after:
+        return None
+    try:
+        day, id = after.split('.')
+        return date.fromisoformat(day), int(id)
+    except ValueError:
+        abort(400)
+
+
+def reviews_page(after):
+    # Страница ленты после курсора по индексу (date_added, id): сколько бы
+    # отзывов ни было, читается только REVIEWS_PAGE_SIZE + 1 строк
+    query = Reviews.query.order_by(Reviews.date_added.desc(), Reviews.id.desc())
+    if after is not None:
+        query = query.filter(tuple_(Reviews.date_added, Reviews.id) < tuple_(*after))
+    reviews = query.limit(REVIEWS_PAGE_SIZE + 1).all()
+    next_cursor = None
+    if len(reviews) > REVIEWS_PAGE_SIZE:
+        last = reviews[REVIEWS_PAGE_SIZE - 1]
+        next_cursor = f'{last.date_added.isoformat()}.{last.id}'
+    return reviews[:REVIEWS_PAGE_SIZE], next_cursor
+
+
+@storefront_bp.route('/reviews', methods=['GET', 'POST'])
 def reviews():
     form = ReviewForm()
-    reviews = Reviews.query.order_by(Reviews.date_added.desc())
     if form.validate_on_submit() and request.method == 'POST':
         review = Reviews(username=form.username.data, review=form.review.data)
         db.session.add(review)
+        add_row_count('reviews', 1)
         db.session.commit()
         form.username.data = ''
         form.review.data = ''
-        return redirect(url_for('reviews'))
-    return render_template('reviews.html', form=form, reviews=reviews)
+        return redirect(url_for('storefront.reviews'))
+    reviews, next_cursor = reviews_page(parse_reviews_cursor())
+    return render_template('reviews.html', form=form, reviews=reviews, next_cursor=next_cursor,
+                           total=row_count('reviews'))
+
 
+@storefront_bp.route('/reviews/page')
+def reviews_more():
+    # фрагмент для кнопки "Показать ещё": только следующая страница отзывов
+    reviews, next_cursor = reviews_page(parse_reviews_cursor())
+    return render_template('reviews_page.html', reviews=reviews, next_cursor=next_cursor)
 
-@app.route('/reviews/delete/<int:id>')
+
+@admin_bp.route('/reviews/delete/<int:id>')
 @login_required
 def delete_review(id):
     review_to_delete = Reviews.query.get_or_404(id)
@@ -237,18 +853,19 @@ def delete_review(id):
     if id == 1:
         try:
             db.session.delete(review_to_delete)
+            add_row_count('reviews', -1)
             db.session.commit()
             flash('Отзыв успешно удалён!')
-            return redirect(url_for('reviews'))
+            return redirect(url_for('storefront.reviews'))
         except:
             flash('Произошла ошибка при удалении отзыва!')
-            return redirect(url_for('reviews'))
+            return redirect(url_for('storefront.reviews'))
     else:
         flash('У тебя нет прав для удаления этого отзыва!')
-        return redirect(url_for('reviews'))
+        return redirect(url_for('storefront.reviews'))
 
 
-@app.route('/register', methods=['GET', 'POST'])
+@storefront_bp.route('/register', methods=['GET', 'POST'])
 def register():
     form = RegisterForm()
     if form.validate_on_submit():
@@ -257,15 +874,18 @@ def register():
             hashed_pw = generate_password_hash(form.password_hash.data, 'sha256')
             user = User(name=form.name.data, email=form.email.data, password_hash=hashed_pw)
             db.session.add(user)
+            bump_cache_version('users')
             db.session.commit()
             flash('Вы успешно зарегистрировались')
-            return redirect(url_for('login'))
+            return redirect(url_for('storefront.login'))
         else:
             flash('Пользователь с такой почтой уже существует')
     return render_template('register.html', form=form)
 
 
-@app.route('/login', methods=['GET', 'POST'])
+@storefront_bp.route('/login', methods=['GET', 'POST'])
+@limiter.limit('10/minute', burst=10, key=client_ip, scope='login', methods=('POST',))
+@limiter.concurrency('auth', 4, methods=('POST',))
 def login():
     form = LoginForm()
     if form.validate_on_submit():
@@ -274,7 +894,7 @@ def login():
             if check_password_hash(user.password_hash, form.password_hash.data):
                 login_user(user)
                 flash('Вы успешно вошли!')
-                return redirect(url_for('index'))
+                return redirect(url_for('storefront.index'))
             else:
                 flash('Неправильный пароль')
         else:
@@ -282,23 +902,252 @@ def login():
     return render_template('login.html', form=form)
 
 
-@app.route('/logout')
+@storefront_bp.route('/logout')
 @login_required
 def logout():
     logout_user()
     flash('Вы успешно вышли из аккаунта')
-    return redirect(url_for('login'))
+    return redirect(url_for('storefront.login'))
+
+
+PRODUCT_PHOTO_FIELDS = ('img_1', 'img_2', 'img_3')
+
 
+def upload_path(*names):
+    return os.path.join(current_app.root_path, current_app.config['UPLOAD_FOLDER'], *names)
 
+
+@metrics.timed('create_product_photo')
 def create_product_photo(file):
-    img = file
-    pic_name = str(uuid.uuid1()) + '_' + secure_filename(img.filename) + '.png'
-    saver = file
-    saver.save(os.path.join(app.config['UPLOAD_FOLDER'], pic_name))
+    # Сохраняет оригинал под именем по хэшу содержимого (одинаковые файлы
+    # хранятся один раз); варианты строит schedule_photo_variants
+    data = file.read()
+    pic_name = content_hash(data) + validate_image(data)
+    if not os.path.exists(upload_path(pic_name)):
+        with open(upload_path(pic_name), 'wb') as f:
+            f.write(data)
     return pic_name
 
 
-@app.route('/add-product', methods=['GET', 'POST'])
+def remove_product_photos(product, fields):
+    # Удаляет файлы фото, если они не нужны ни оставшимся полям товара, ни другим товарам
+    variants = product.img_variants or {}
+    kept = [field for field in PRODUCT_PHOTO_FIELDS if field not in fields]
+    others = Products.query.filter(Products.id != product.id)
+    for field in fields:
+        filename = getattr(product, field)
+        if filename not in [getattr(product, name) for name in kept] and \
+                not others.filter(or_(*[getattr(Products, name) == filename for name in PRODUCT_PHOTO_FIELDS])).count():
+            unlink_upload(filename)
+        meta = variants.get(field)
+        if meta and meta['hash'] not in [variants[name]['hash'] for name in kept if name in variants] and \
+                not others.filter(func.instr(Products.img_variants, literal(meta['hash'])) > 0).count():
+            for name in variant_files(meta):
+                unlink_upload(name)
+
+
+def unlink_upload(name):
+    try:
+        os.unlink(upload_path(name))
+    except OSError:
+        pass
+
+
+class ImagePool:
+    # Пул процессов для обработки фото; создаётся при первой загрузке
+    # и заново после fork
+    def __init__(self, app):
+        self.app = app
+        self.lock = threading.Lock()
+        self.executor = None
+        self.pid = None
+
+    def submit(self, fn, *args):
+        with self.lock:
+            if self.pid != os.getpid():
+                self.executor = concurrent.futures.ProcessPoolExecutor(self.app.config['IMAGE_WORKERS'])
+                self.pid = os.getpid()
+        return self.executor.submit(fn, *args)
+
+
+image_pool = LocalProxy(lambda: current_app.extensions['image_pool'])
+
+
+def save_photo_variants(product_id, field, filename, meta):
+    # json_set обновляет только своё поле, поэтому три фото товара могут
+    # сохраняться одновременно; если фото уже заменили, ничего не меняется
+    updated = db.session.execute(
+        text(f'UPDATE products SET img_variants = json_set(coalesce(img_variants, \'{{}}\'), '
+             f'\'$.{field}\', json(:meta)), version = version + 1, updated_at = :now '
+             f'WHERE id = :id AND {field} = :filename'),
+        {'meta': json.dumps(meta), 'id': product_id, 'filename': filename, 'now': datetime.utcnow()}
+    ).rowcount
+    if updated:
+        bump_cache_version('catalog')
+    db.session.commit()
+
+
+def schedule_photo_variants(product, fields=PRODUCT_PHOTO_FIELDS):
+    # колбэк выполняется в потоке пула, вне контекста приложения
+    app = current_app._get_current_object()
+    for field in fields:
+        filename = getattr(product, field)
+        future = image_pool.submit(process_image, upload_path(filename), upload_path())
+
+        def done(future, product_id=product.id, field=field, filename=filename):
+            try:
+                meta = future.result()
+                with app.app_context():
+                    save_photo_variants(product_id, field, filename, meta)
+            except Exception:
+                app.logger.exception('image pipeline: %s', filename)
+
+        future.add_done_callback(done)
+
+
+@click.command('images-backfill')
+@with_appcontext
+@click.option('--force', is_flag=True, help='Пересоздать варианты для всех фото')
+def images_backfill_command(force):
+    """Построить варианты фото для уже загруженных товаров."""
+    jobs = {}
+    for product in Products.query.all():
+        for field in PRODUCT_PHOTO_FIELDS:
+            if force or field not in (product.img_variants or {}):
+                filename = getattr(product, field)
+                jobs[image_pool.submit(process_image, upload_path(filename), upload_path())] = \
+                    (product.id, field, filename)
+    done = 0
+    for future in concurrent.futures.as_completed(jobs):
+        product_id, field, filename = jobs[future]
+        try:
+            save_photo_variants(product_id, field, filename, future.result())
+            done += 1
+        except Exception as e:
+            click.echo(f'{filename}: {e}')
+    click.echo(f'Обработано фото: {done} из {len(jobs)}')
+
+
+KEYS_IMPORT_CHUNK = 64 * 1024
+KEYS_IMPORT_BATCH = 5000
+
+
+def iter_activation_keys(stream, chunk_size=KEYS_IMPORT_CHUNK):
+    # Читает файл с ключами кусками, не загружая его в память целиком
+    decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+    tail = ''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        lines = (tail + decoder.decode(chunk)).split('\n')
+        tail = lines.pop()
+        for line in lines:
+            key = line.strip()
+            if key:
+                yield key
+    key = (tail + decoder.decode(b'', final=True)).strip()
+    if key:
+        yield key
+
+
+def import_activation_keys(product_id, stream, batch_size=KEYS_IMPORT_BATCH):
+    # Ключи пачками складываются во временную таблицу (она же убирает дубли
+    # внутри файла), затем одним INSERT ... SELECT переносятся в activation_keys
+    # без тех, что уже есть в базе. Работает в транзакции вызывающего кода,
+    # commit делает он - вместе с остальными изменениями товара.
+    # Возвращает (добавлено, пропущено).
+    conn = db.session.connection()
+    conn.exec_driver_sql('CREATE TEMP TABLE IF NOT EXISTS import_keys (key TEXT PRIMARY KEY)')
+    conn.exec_driver_sql('DELETE FROM import_keys')
+    total = 0
+    batch = []
+    for key in iter_activation_keys(stream):
+        batch.append((key,))
+        if len(batch) >= batch_size:
+            conn.exec_driver_sql('INSERT OR IGNORE INTO import_keys (key) VALUES (?)', batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        conn.exec_driver_sql('INSERT OR IGNORE INTO import_keys (key) VALUES (?)', batch)
+        total += len(batch)
+    inserted = conn.exec_driver_sql(
+        'INSERT INTO activation_keys (product_id, key) '
+        'SELECT ?, key FROM import_keys '
+        'WHERE key NOT IN (SELECT key FROM activation_keys) '
+        'ORDER BY rowid',
+        (product_id,)
+    ).rowcount
+    conn.exec_driver_sql('DROP TABLE import_keys')
+    if inserted:
+        # stock товара уже увеличен триггером, а от него зависит каталог
+        bump_cache_version('catalog')
+    return inserted, total - inserted
+
+
+@click.command('assets-build')
+@with_appcontext
+@click.option('--clean', is_flag=True, help='Удалить прошлые сборки')
+def assets_build_command(clean):
+    """Собрать статику с хэшами в именах и сжатыми версиями в static/dist."""
+    manifest = build_assets(current_app.static_folder, clean)
+    assets.load()
+    compressed = sum(1 for entry in manifest.values() if entry['encodings'])
+    click.echo(f'Файлов: {len(manifest)}, из них сжато: {compressed}')
+
+
+@click.command('import-keys')
+@with_appcontext
+@click.argument('product_id', type=int)
+@click.argument('file', type=click.File('rb'))
+def import_keys_command(product_id, file):
+    """Импорт ключей активации из файла (по одному ключу в строке)."""
+    if db.session.get(Products, product_id) is None:
+        raise click.BadParameter(f'товар {product_id} не найден', param_hint='PRODUCT_ID')
+    start = time.perf_counter()
+    inserted, skipped = import_activation_keys(product_id, file)
+    db.session.commit()
+    elapsed = time.perf_counter() - start
+    rate = (inserted + skipped) / elapsed if elapsed else 0
+    click.echo(f'Добавлено ключей: {inserted}, пропущено дублей: {skipped}, '
+               f'{elapsed:.2f} с ({rate:.0f} строк/с)')
+
+
+def stock_mismatches():
+    # Один проход: число ключей по товарам (GROUP BY по индексу
+    # activation_keys.product_id) против products.stock
+    keys = select(ActivationKeys.product_id, func.count().label('count')) \
+        .where(ActivationKeys.product_id.isnot(None)) \
+        .group_by(ActivationKeys.product_id) \
+        .subquery()
+    actual = func.coalesce(keys.c.count, 0)
+    return db.session.execute(
+        select(Products.id, Products.stock, actual)
+        .outerjoin(keys, keys.c.product_id == Products.id)
+        .where(Products.stock != actual)
+        .order_by(Products.id)
+    ).all()
+
+
+@click.command('stock-reconcile')
+@with_appcontext
+@click.option('--fix', is_flag=True, help='Исправить расхождения')
+def stock_reconcile_command(fix):
+    """Сверить products.stock с числом ключей в activation_keys."""
+    mismatches = stock_mismatches()
+    for product_id, stock, actual in mismatches:
+        click.echo(f'товар {product_id}: stock {stock}, ключей {actual}')
+    if fix and mismatches:
+        db.session.execute(update(Products), [{'id': product_id, 'stock': actual}
+                                              for product_id, _, actual in mismatches])
+        bump_cache_version('catalog')
+        db.session.commit()
+    click.echo(f'Расхождений: {len(mismatches)}{", исправлено" if fix and mismatches else ""}')
+    if mismatches and not fix:
+        raise click.exceptions.Exit(1)
+
+
+@admin_bp.route('/add-product', methods=['GET', 'POST'])
 @login_required
 def add_product():
     if current_user.id == 1:
@@ -306,281 +1155,964 @@ def add_product():
         if request.method == 'POST':
             name = form.name.data
             price = form.price.data
-            stock = form.stock.data
             desc = form.description.data
 
-            img_1 = create_product_photo(request.files['img_1'])
-            img_2 = create_product_photo(request.files['img_2'])
-            img_3 = create_product_photo(request.files['img_3'])
-
-            product = Products(name=name, price=price, stock=stock, description=desc, img_1=img_1, img_2=img_2,
-                               img_3=img_3)
+            try:
+                img_1 = create_product_photo(request.files['img_1'])
+                img_2 = create_product_photo(request.files['img_2'])
+                img_3 = create_product_photo(request.files['img_3'])
+            except InvalidImage:
+                flash('Фото должно быть изображением JPEG, PNG, WebP или GIF')
+                return render_template('add-product.html', form=form)
+
+            product = Products(name=name, price=price, description=desc, img_1=img_1, img_2=img_2, img_3=img_3)
             db.session.add(product)
+            bump_cache_version('catalog')
             db.session.commit()
+            schedule_photo_variants(product)
 
-            keys = request.files['keys']
-            filename = secure_filename(keys.filename)
-            keys.save(os.path.join("static", filename))
-            with open(f"static/{filename}") as f:
-                file_content = f.read().split('\n')
-                for key in file_content:
-                    activate_key = ActivationKeys(key=key)
-                    product.keys.append(activate_key)
-                    db.session.commit()
-            if os.path.isfile(f"static/{filename}"):
-                os.remove(f"static/{filename}")
+            keys = request.files.get('keys')
+            if keys:
+                import_activation_keys(product.id, keys.stream)
+                db.session.commit()
 
             flash('Товар был успешно добавлен')
-            return redirect(url_for('add_product'))
+            return redirect(url_for('admin.add_product'))
 
         return render_template('add-product.html', form=form)
     else:
         flash('У вас нет прав доступа')
-        return redirect(url_for('index'))
+        return redirect(url_for('storefront.index'))
 
 
-@app.route('/edit-product/<int:id>', methods=['GET', 'POST'])
+@admin_bp.route('/edit-product/<int:id>', methods=['GET', 'POST'])
 def edit_product(id):
     if current_user.id == 1:
         form = AddProductForm()
         form.submit.label.text = 'Редактировать'
         product = Products.query.get_or_404(id)
         if request.method == 'POST':
+            # фото проверяются до любых изменений, как в add_product: при ошибке
+            # товар и его ключи остаются прежними
+            try:
+                photos = {field: create_product_photo(request.files[field])
+                          for field in PRODUCT_PHOTO_FIELDS if request.files.get(field)}
+            except InvalidImage:
+                flash('Фото должно быть изображением JPEG, PNG, WebP или GIF')
+                return redirect(url_for('admin.edit_product', id=id))
+
             product.name = form.name.data
             product.price = form.price.data
-            product.stock = form.stock.data
             product.description = form.description.data
 
-            keys = request.files['keys']
-            filename = secure_filename(keys.filename)
-            keys.save(os.path.join("static", filename))
-            with open(f"static/{filename}") as f:
-                file_content = f.read().split('\n')
-                for key in file_content:
-                    if key:
-                        activate_key = ActivationKeys(key=key)
-                        product.keys.append(activate_key)
-                        db.session.commit()
-            if os.path.isfile(f"static/{filename}"):
-                os.remove(f"static/{filename}")
-
-            if request.files.get('img_1'):
-                try:
-                    os.unlink(os.path.join(current_app.root_path, 'static/img/products/' + product.img_1))
-                    product.img_1 = create_product_photo(request.files['img_1'])
-                except:
-                    product.img_1 = create_product_photo(request.files['img_1'])
-            if request.files.get('img_2'):
-                try:
-                    os.unlink(os.path.join(current_app.root_path, 'static/img/products/' + product.img_2))
-                    product.img_2 = create_product_photo(request.files['img_2'])
-                except:
-                    product.img_2 = create_product_photo(request.files['img_2'])
-            if request.files.get('img_3'):
-                try:
-                    os.unlink(os.path.join(current_app.root_path, 'static/img/products/' + product.img_3))
-                    product.img_3 = create_product_photo(request.files['img_3'])
-                except:
-                    product.img_3 = create_product_photo(request.files['img_3'])
+            keys = request.files.get('keys')
+            if keys:
+                import_activation_keys(product.id, keys.stream)
+
+            changed = []
+            for field, filename in photos.items():
+                if filename != getattr(product, field):
+                    remove_product_photos(product, [field])
+                    setattr(product, field, filename)
+                    if product.img_variants:
+                        product.img_variants = {name: meta for name, meta in product.img_variants.items()
+                                                if name != field}
+                    changed.append(field)
+            bump_cache_version('catalog')
             db.session.commit()
+            schedule_photo_variants(product, changed)
             flash('Товар успешо изменён')
-            return redirect(url_for('admin'))
+            return redirect(url_for('admin.admin'))
         else:
             form.name.data = product.name
             form.price.data = product.price
-            form.stock.data = product.stock
             form.description.data = product.description
-            return render_template('edit_product.html', form=form)
+            return render_template('edit_product.html', form=form, stock=product.stock)
     else:
         flash('У вас нет прав доступа')
-        return redirect(url_for('index'))
+        return redirect(url_for('storefront.index'))
 
 
-@app.route('/delete-product/<int:id>', methods=['POST'])
+@admin_bp.route('/delete-product/<int:id>', methods=['POST'])
 def delete_product(id):
     if current_user.id == 1:
         product = Products.query.get_or_404(id)
         if request.method == 'POST':
-            try:
-                os.unlink(os.path.join(current_app.root_path, 'static/img/products/' + product.img_1))
-                os.unlink(os.path.join(current_app.root_path, 'static/img/products/' + product.img_2))
-                os.unlink(os.path.join(current_app.root_path, 'static/img/products/' + product.img_3))
-            except:
-                print('ERROR')
+            remove_product_photos(product, PRODUCT_PHOTO_FIELDS)
             db.session.delete(product)
+            bump_cache_version('catalog')
             db.session.commit()
             flash('Товар успешно удалён')
-        return redirect(url_for('admin'))
+        return redirect(url_for('admin.admin'))
     else:
         flash('У вас нет прав доступа')
-        return redirect(url_for('index'))
+        return redirect(url_for('storefront.index'))
+
+
+# токен CSRF в форме поиска действителен WTF_CSRF_TIME_LIMIT (час), поэтому
+# закэшированная браузером страница должна обновляться чаще
+PRODUCT_ETAG_PERIOD = 1800
 
 
-@app.route('/product/<int:id>')
+@storefront_bp.route('/product/<int:id>')
+@read_only_db
 def product(id):
     product = Products.query.get_or_404(id)
-    return render_template('product.html', product=product)
+    build_response = functools.partial(render_cached_page, 'product.html', ('product', id),
+                                       lambda: dict(product=product))
+    if '_flashes' in session:
+        # сообщения показываются один раз, такую страницу нужно отрендерить
+        return build_response()
+    # кроме самого товара страница зависит от пользователя и корзины в шапке,
+    # поэтому проверяется только ETag: products.updated_at их не учитывает, и
+    # по If-Modified-Since клиент получил бы 304 со старой шапкой
+    etag = hashlib.sha1(
+        f'{id}:{product.version}:{current_user.get_id()}:{session.get("cart_size", 0)}:'
+        f'{session.get("csrf_token")}:{int(time.time()) // PRODUCT_ETAG_PERIOD}'.encode()
+    ).hexdigest()
+    response = conditional_response(etag, None, build_response, weak=True)
+    response.cache_control.no_cache = True
+    response.cache_control.private = True
+    return response
+
+
+class CartStore(ABC):
+    # Интерфейс хранилища корзин. Корзина - это {id товара: количество}
+    # в порядке добавления; названия, цены и фото берутся из Products.
+    # Методы не делают commit, чтобы корзину можно было менять в одной
+    # транзакции с заказом.
+    # server_side=False - корзина хранится в самой сессии и id ей не нужен.
+    # Хранилище без какого-либо из методов не создастся (TypeError в create_app).
+    server_side = True
+
+    @abstractmethod
+    def items(self, cart_id):
+        ...
+
+    @abstractmethod
+    def add(self, cart_id, product_id, quantity, limit):
+        # увеличивает количество, но не больше limit
+        ...
+
+    @abstractmethod
+    def update(self, cart_id, product_id, quantity):
+        ...
+
+    @abstractmethod
+    def remove(self, cart_id, product_id):
+        ...
+
+    @abstractmethod
+    def clear(self, cart_id):
+        ...
+
+    @abstractmethod
+    def sweep(self, expire_before):
+        # удаляет корзины, не менявшиеся с expire_before, возвращает их число
+        ...
+
+
+class SQLCartStore(CartStore):
+    def items(self, cart_id):
+        return dict(db.session.execute(
+            select(CartItem.product_id, CartItem.quantity)
+            .where(CartItem.cart_id == cart_id)
+            .order_by(CartItem.id)
+        ).all())
+
+    def touch(self, cart_id):
+        stmt = sqlite_insert(Cart).values(id=cart_id, updated_at=datetime.utcnow())
+        db.session.execute(stmt.on_conflict_do_update(index_elements=[Cart.id],
+                                                      set_={'updated_at': stmt.excluded.updated_at}))
+
+    def add(self, cart_id, product_id, quantity, limit):
+        self.touch(cart_id)
+        stmt = sqlite_insert(CartItem).values(cart_id=cart_id, product_id=product_id,
+                                              quantity=min(quantity, limit))
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=[CartItem.cart_id, CartItem.product_id],
+            set_={'quantity': func.min(CartItem.quantity + stmt.excluded.quantity, limit)}
+        ))
+
+    def update(self, cart_id, product_id, quantity):
+        self.touch(cart_id)
+        db.session.execute(
+            update(CartItem)
+            .where(CartItem.cart_id == cart_id, CartItem.product_id == product_id)
+            .values(quantity=quantity),
+            execution_options={'synchronize_session': False}
+        )
+
+    def remove(self, cart_id, product_id):
+        self.touch(cart_id)
+        db.session.execute(
+            delete(CartItem).where(CartItem.cart_id == cart_id, CartItem.product_id == product_id),
+            execution_options={'synchronize_session': False}
+        )
 
+    def clear(self, cart_id):
+        db.session.execute(delete(CartItem).where(CartItem.cart_id == cart_id),
+                           execution_options={'synchronize_session': False})
+        db.session.execute(delete(Cart).where(Cart.id == cart_id),
+                           execution_options={'synchronize_session': False})
+
+    def sweep(self, expire_before):
+        expired = select(Cart.id).where(Cart.updated_at < expire_before)
+        db.session.execute(delete(CartItem).where(CartItem.cart_id.in_(expired)),
+                           execution_options={'synchronize_session': False})
+        return db.session.execute(delete(Cart).where(Cart.updated_at < expire_before),
+                                  execution_options={'synchronize_session': False}).rowcount
+
+
+def encode_cart(items):
+    # {id товара: количество} -> пары беззнаковых varint (LEB128) в порядке
+    # добавления: id до 16383 и количество до 127 занимают 3 байта
+    data = bytearray()
+    for product_id, quantity in items.items():
+        for value in (product_id, quantity):
+            while value >= 0x80:
+                data.append(value & 0x7f | 0x80)
+                value >>= 7
+            data.append(value)
+    return bytes(data)
+
+
+def decode_cart(data):
+    values = []
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            values.append(value)
+            value = shift = 0
+    return dict(zip(values[::2], values[1::2]))
+
+
+class CookieCartStore(CartStore):
+    # Корзина в cookie сессии: только id и количества (encode_cart), без
+    # названий и цен. Сериализатор сессии Flask сам переводит bytes в base64,
+    # сжимает cookie zlib, когда это выгодно, и подписывает её; запись в базу
+    # и очистка брошенных корзин не нужны.
+    server_side = False
+
+    def items(self, cart_id):
+        return decode_cart(session.get('cart', b''))
+
+    def save(self, items):
+        if items:
+            session['cart'] = encode_cart(items)
+        else:
+            session.pop('cart', None)
 
-def MagerDicts(dict1, dict2):
-    if isinstance(dict1, list) and isinstance(dict2, list):
-        return dict1 + dict2
-    elif isinstance(dict1, dict) and isinstance(dict2, dict):
-        return dict(list(dict1.items()) + list(dict2.items()))
-    return False
+    def add(self, cart_id, product_id, quantity, limit):
+        items = self.items(cart_id)
+        items[product_id] = min(items.get(product_id, 0) + quantity, limit)
+        self.save(items)
 
+    def update(self, cart_id, product_id, quantity):
+        items = self.items(cart_id)
+        if product_id in items:
+            items[product_id] = quantity
+            self.save(items)
 
-@app.route('/add-cart', methods=['POST'])
+    def remove(self, cart_id, product_id):
+        items = self.items(cart_id)
+        items.pop(product_id, None)
+        self.save(items)
+
+    def clear(self, cart_id):
+        session.pop('cart', None)
+
+    def sweep(self, expire_before):
+        # cookie истекает вместе с сессией
+        return 0
+
+
+CART_STORES = {'sql': SQLCartStore, 'cookie': CookieCartStore}
+cart_store = LocalProxy(lambda: current_app.extensions['cart_store'])
+
+
+class CartSweeper:
+    # Фоновый поток, периодически удаляющий брошенные корзины
+    def __init__(self, app):
+        self.app = app
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def start(self):
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            threading.Thread(target=self.run, name='cart-sweeper', daemon=True).start()
+
+    def run(self):
+        while True:
+            time.sleep(self.app.config['CART_SWEEP_INTERVAL'])
+            try:
+                with self.app.app_context():
+                    sweep_carts()
+            except Exception:
+                self.app.logger.exception('cart sweeper')
+
+
+cart_sweeper = LocalProxy(lambda: current_app.extensions['cart_sweeper'])
+
+
+def sweep_carts():
+    removed = cart_store.sweep(datetime.utcnow() - current_app.config['CART_TTL'])
+    db.session.commit()
+    return removed
+
+
+@click.command('sweep-carts')
+@with_appcontext
+def sweep_carts_command():
+    """Удалить корзины, которые давно не менялись."""
+    click.echo(f'Удалено корзин: {sweep_carts()}')
+
+
+def current_cart_id(create=False):
+    if not cart_store.server_side:
+        return 'session' if create or 'cart' in session else None
+    cart_id = session.get('cart_id')
+    if cart_id is None and create:
+        cart_id = session['cart_id'] = secrets.token_hex(16)
+    if cart_id is not None:
+        cart_sweeper.start()
+    return cart_id
+
+
+class CartProduct:
+    # Снимок товара для строк корзины: название, цена, остаток и фото
+    def __init__(self, id, name, price, stock, img_1, img_variants):
+        self.id = id
+        self.name = name
+        self.price = price
+        self.stock = stock
+        self.img_1 = img_1
+        self.img_variants = img_variants
+
+
+cart_products = LocalProxy(lambda: current_app.extensions['cart_products'])
+
+
+def cart_lines(items):
+    # Строки корзины. Товары кэшируются по (id, версия каталога): продажа,
+    # правка товара и импорт ключей меняют версию, так что цена и остаток
+    # в кэше не устаревают; недостающие загружаются одним запросом IN (...)
+    version = cache_version('catalog')
+    products = {}
+    for product_id in items:
+        product = cart_products.get((product_id, version))
+        if product is not None:
+            products[product_id] = product
+    missing = [product_id for product_id in items if product_id not in products]
+    if missing:
+        rows = db.session.execute(
+            select(Products.id, Products.name, Products.price, Products.stock, Products.img_1, Products.img_variants)
+            .where(Products.id.in_(missing))
+        )
+        for row in rows:
+            products[row.id] = CartProduct(*row)
+            cart_products.set((row.id, version), products[row.id])
+    return [(products[product_id], quantity) for product_id, quantity in items.items()
+            if product_id in products]
+
+
+def save_cart_size(cart_id):
+    # размер корзины для навбара хранится в сессии, чтобы не считать его на каждой странице
+    session['cart_size'] = len(cart_store.items(cart_id))
+
+
+@cart_bp.before_app_request
+def migrate_legacy_cart():
+    # Корзина старого формата целиком в cookie: session['Shoppingcart'] =
+    # {'id': {'name', 'price', 'quantity', 'image'}}. Переносится в текущее
+    # хранилище при первом запросе; название и цену берём из Products.
+    if 'Shoppingcart' not in session:
+        return
+    legacy = session.pop('Shoppingcart')
+    items = {}
+    for key, item in (legacy.items() if isinstance(legacy, dict) else ()):
+        try:
+            items[int(key)] = int(item['quantity'])
+        except (TypeError, ValueError, KeyError):
+            continue
+    lines = [(product, quantity) for product, quantity in cart_lines(items) if quantity > 0 and product.stock > 0]
+    if lines:
+        cart_id = current_cart_id(create=True)
+        for product, quantity in lines:
+            cart_store.add(cart_id, product.id, quantity, product.stock)
+        db.session.commit()
+        save_cart_size(cart_id)
+
+
+@cart_bp.route('/add-cart', methods=['POST'])
 def add_cart():
     try:
         product_id = request.form.get('product_id')
         quantity = request.form.get('quantity')
         product = Products.query.filter_by(id=product_id).first()
-        if product_id and quantity and request.method == 'POST':
-            dictItems = {product_id: {'name': product.name, 'price': product.price, 'quantity': quantity,
-                                      'image': product.img_1}}
-            if 'Shoppingcart' in session:
-                if product_id in session['Shoppingcart']:
-                    session.modified = True
-                    for key, item in session['Shoppingcart'].items():
-                        if int(product.stock) >= int(item['quantity']) + int(quantity):
-                            if int(key) == int(product_id):
-                                item['quantity'] = int(item['quantity']) + int(quantity)
-                        else:
-                            item['quantity'] = int(product.stock)
-                else:
-                    session['Shoppingcart'] = MagerDicts(session['Shoppingcart'], dictItems)
-                    return redirect(request.referrer)
-            else:
-                session['Shoppingcart'] = dictItems
-                return redirect(request.referrer)
-    except:
+        if product and quantity and int(quantity) > 0 and product.stock > 0:
+            cart_id = current_cart_id(create=True)
+            cart_store.add(cart_id, product.id, int(quantity), int(product.stock))
+            db.session.commit()
+            save_cart_size(cart_id)
+    except ValueError:
         pass
-    finally:
-        return redirect(request.referrer)
+    return redirect(request.referrer or url_for('storefront.catalog'))
 
 
-@app.route('/cart')
+@cart_bp.route('/cart')
 def get_cart():
-    if 'Shoppingcart' not in session or len(session['Shoppingcart']) <= 0:
-        return redirect(url_for('catalog'))
-    grandtotal = 0
-    product_id = {}
-    for key, product in session['Shoppingcart'].items():
-        prod = Products.query.get_or_404(key)
-        grandtotal += int(product['price']) * int(product['quantity'])
-        product_id[key] = int(prod.stock)
-    return render_template('cart.html', grandtotal=grandtotal, product_id=product_id)
-
-
-@app.route('/update-cart/<int:id>', methods=['POST'])
-def update_cart(id):
-    if 'Shoppingcart' not in session or len(session['Shoppingcart']) <= 0:
-        return redirect(url_for('index'))
-    if request.method == 'POST':
-        quantity = request.form.get('quantity')
-        try:
-            session.modified = True
-            for key, item in session['Shoppingcart'].items():
-                if int(key) == id:
-                    item['quantity'] = quantity
-                    flash('Товар обновлён')
-                    return redirect(url_for('get_cart'))
+    cart_id = current_cart_id()
+    items = cart_store.items(cart_id) if cart_id else {}
+    if not items:
+        return redirect(url_for('storefront.catalog'))
+    lines = cart_lines(items)
+    grandtotal = sum(product.price * quantity for product, quantity in lines)
+    return render_template('cart.html', grandtotal=grandtotal, lines=lines)
 
-        except Exception as e:
-            print(e)
-            return redirect(url_for('get_cart'))
+
+@cart_bp.route('/update-cart/<int:id>', methods=['POST'])
+def update_cart(id):
+    cart_id = current_cart_id()
+    if cart_id is None:
+        return redirect(url_for('storefront.index'))
+    try:
+        quantity = int(request.form.get('quantity'))
+    except (TypeError, ValueError):
+        return redirect(url_for('cart.get_cart'))
+    product = Products.query.get_or_404(id)
+    cart_store.update(cart_id, id, max(1, min(quantity, int(product.stock))))
+    db.session.commit()
+    flash('Товар обновлён')
+    return redirect(url_for('cart.get_cart'))
 
 
-@app.route('/delete-item/<int:id>')
+@cart_bp.route('/delete-item/<int:id>')
 def delete_item(id):
-    if 'Shoppingcart' not in session or len(session['Shoppingcart']) <= 0:
-        return redirect(url_for('index'))
-    try:
-        session.modified = True
-        for key, item in session['Shoppingcart'].items():
-            if int(key) == id:
-                session['Shoppingcart'].pop(key, None)
-                return redirect(url_for('get_cart'))
-    except Exception as e:
-        print(e)
-        return redirect(url_for('get_cart'))
+    cart_id = current_cart_id()
+    if cart_id is None:
+        return redirect(url_for('storefront.index'))
+    cart_store.remove(cart_id, id)
+    db.session.commit()
+    save_cart_size(cart_id)
+    return redirect(url_for('cart.get_cart'))
 
 
-@app.route('/clear-cart')
+@cart_bp.route('/clear-cart')
 def clear_cart():
+    cart_id = current_cart_id()
+    session.pop('cart_id', None)
+    session.pop('cart_size', None)
+    if cart_id is not None:
+        cart_store.clear(cart_id)
+        db.session.commit()
+    return redirect(url_for('storefront.index'))
+
+
+@metrics.timed('send_notification')
+def send_notification(email, txt, subject='ProgramStore ключ'):
+    # Письмо только ставится в очередь в текущей транзакции и уходит
+    # фоновыми воркерами после commit
+    db.session.add(MailQueue(recipient=email, subject=subject, body=txt))
+    db.session.info['mail_enqueued'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def wake_mail_workers(session):
+    if session.info.pop('mail_enqueued', False):
+        mail_workers.notify()
+
+
+def open_smtp():
+    config = current_app.config
+    mailserver = smtplib.SMTP(config['MAIL_SERVER'], config['MAIL_PORT'], timeout=config['MAIL_TIMEOUT'])
     try:
-        session.pop('Shoppingcart', None)
-        return redirect(url_for('index'))
-    except Exception as e:
-        print(e)
-
-
-def send_notification(email, txt):
-    msg = MIMEMultipart()
-    msg['From'] = 'makeev12358@yandex.ru'
-    msg['To'] = email
-    msg['Subject'] = 'ProgramStore ключ'
-    message = txt
-    msg.attach(MIMEText(message))
+        if config['MAIL_USE_TLS']:
+            mailserver.starttls()
+        if config['MAIL_USERNAME']:
+            mailserver.login(config['MAIL_USERNAME'], config['MAIL_PASSWORD'])
+    except (smtplib.SMTPException, OSError):
+        mailserver.close()
+        raise
+    return mailserver
+
+
+def close_smtp(mailserver):
     try:
-        mailserver = smtplib.SMTP('smtp.yandex.ru', 587)
-        mailserver.set_debuglevel(True)
-        mailserver.ehlo()
-        mailserver.starttls()
-        mailserver.ehlo()
-        mailserver.login('makeev12358@yandex.ru', 'dhepsvxameykejpq')
-        mailserver.sendmail('makeev12358@yandex.ru', email, msg.as_string())
         mailserver.quit()
-        print("Письмо успешно отправлено")
-    except smtplib.SMTPException:
-        print("Ошибка: Невозможно отправить сообщение")
+    except (smtplib.SMTPException, OSError):
+        mailserver.close()
+
+
+def claim_mail_batch(size):
+    # Забирает пачку писем, которым пора уходить. Письма, зависшие в sending
+    # дольше MAIL_LEASE (упавший воркер), забираются повторно.
+    now = datetime.utcnow()
+    claimed = select(MailQueue.id) \
+        .where(MailQueue.status.in_(('pending', 'sending')), MailQueue.next_attempt_at <= now) \
+        .order_by(MailQueue.id) \
+        .limit(size) \
+        .scalar_subquery()
+    ids = db.session.execute(
+        update(MailQueue)
+        .where(MailQueue.id.in_(claimed))
+        .values(status='sending', next_attempt_at=now + timedelta(seconds=current_app.config['MAIL_LEASE']))
+        .returning(MailQueue.id),
+        execution_options={'synchronize_session': False}
+    ).scalars().all()
+    db.session.commit()
+    if not ids:
+        return []
+    return db.session.execute(select(MailQueue).where(MailQueue.id.in_(ids)).order_by(MailQueue.id)).scalars().all()
+
+
+@metrics.timed('smtp')
+def deliver_mail_batch(mailserver, messages):
+    # Отправляет пачку писем через одно SMTP соединение и возвращает его
+    # для следующей пачки (None, если соединение пришлось закрыть)
+    config = current_app.config
+    for mail in messages:
+        msg = MIMEMultipart()
+        msg['From'] = config['MAIL_SENDER']
+        msg['To'] = mail.recipient
+        msg['Subject'] = mail.subject
+        msg.attach(MIMEText(mail.body))
+        mail.attempts += 1
+        try:
+            if mailserver is None:
+                mailserver = open_smtp()
+            mailserver.sendmail(config['MAIL_SENDER'], mail.recipient, msg.as_string())
+        except (smtplib.SMTPException, OSError) as e:
+            # отказ сервера по конкретному письму не ломает соединение
+            if not isinstance(e, (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException)) \
+                    or getattr(e, 'smtp_code', None) == 421:
+                if mailserver is not None:
+                    mailserver.close()
+                mailserver = None
+            mail.last_error = str(e)
+            if mail.attempts >= config['MAIL_MAX_ATTEMPTS']:
+                mail.status = 'failed'
+            else:
+                mail.status = 'pending'
+                delay = min(config['MAIL_RETRY_BASE'] * 2 ** (mail.attempts - 1), 3600)
+                mail.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+        else:
+            mail.status = 'sent'
+            mail.sent_at = datetime.utcnow()
+            mail.last_error = None
+    db.session.commit()
+    return mailserver
+
+
+def drain_mail_queue():
+    mailserver = None
+    sent = 0
+    try:
+        while True:
+            messages = claim_mail_batch(current_app.config['MAIL_BATCH_SIZE'])
+            if not messages:
+                return sent
+            mailserver = deliver_mail_batch(mailserver, messages)
+            sent += len(messages)
+    finally:
+        if mailserver is not None:
+            close_smtp(mailserver)
+
+
+class MailWorkerPool:
+    # Пул фоновых потоков, разбирающих очередь писем. Каждый поток держит
+    # своё SMTP соединение и переиспользует его между пачками.
+    poll_interval = 5
+
+    def __init__(self, app):
+        self.app = app
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+        self.threads = []
+        self.pid = None
+
+    def start(self):
+        with self.lock:
+            # после fork потоки родителя в дочернем процессе не существуют
+            if self.pid == os.getpid() or not self.app.config['MAIL_WORKERS']:
+                return
+            self.pid = os.getpid()
+            self.threads = [threading.Thread(target=self.run, name=f'mail-worker-{i}', daemon=True)
+                            for i in range(self.app.config['MAIL_WORKERS'])]
+            for thread in self.threads:
+                thread.start()
+
+    def notify(self):
+        self.start()
+        self.wakeup.set()
+
+    def run(self):
+        mailserver = None
+        last_used = 0
+        while True:
+            messages = []
+            try:
+                with self.app.app_context():
+                    messages = claim_mail_batch(self.app.config['MAIL_BATCH_SIZE'])
+                    if messages:
+                        mailserver = deliver_mail_batch(mailserver, messages)
+                        last_used = time.monotonic()
+            except Exception:
+                self.app.logger.exception('mail worker')
+            if messages:
+                continue
+            if mailserver is not None and time.monotonic() - last_used > self.app.config['MAIL_IDLE_TIMEOUT']:
+                close_smtp(mailserver)
+                mailserver = None
+            self.wakeup.wait(self.poll_interval)
+            self.wakeup.clear()
+
+
+mail_workers = LocalProxy(lambda: current_app.extensions['mail_workers'])
+
+
+@click.command('send-mail')
+@with_appcontext
+def send_mail_command():
+    """Отправить все письма из очереди, которым подошло время."""
+    click.echo(f'Обработано писем: {drain_mail_queue()}')
+
+
+TOP_SALES_SIZE = 20
+
+
+def record_sale(product_id, count):
+    # Учитывает продажу: счётчик товара, дневная сводка и рейтинг продаж
+    # обновляются в текущей транзакции (остаток уменьшил триггер при выдаче ключей)
+    price, sold = db.session.execute(
+        update(Products)
+        .where(Products.id == product_id)
+        .values(sold=Products.sold + count)
+        .returning(Products.price, Products.sold),
+        execution_options={'synchronize_session': False}
+    ).one()
+    daily = sqlite_insert(SalesDaily).values(day=date.today(), product_id=product_id,
+                                             quantity=count, revenue=price * count)
+    db.session.execute(daily.on_conflict_do_update(
+        index_elements=[SalesDaily.day, SalesDaily.product_id],
+        set_={'quantity': SalesDaily.quantity + daily.excluded.quantity,
+              'revenue': SalesDaily.revenue + daily.excluded.revenue}
+    ))
+    # продажи только растут, поэтому в рейтинг может попасть лишь товар,
+    # который сейчас продан: добавляем его и отрезаем хвост
+    top = sqlite_insert(TopSales).values(product_id=product_id, sold=sold)
+    db.session.execute(top.on_conflict_do_update(index_elements=[TopSales.product_id],
+                                                 set_={'sold': top.excluded.sold}))
+    trim_top_sales()
+
+
+def trim_top_sales():
+    kept = select(TopSales.product_id) \
+        .order_by(TopSales.sold.desc(), TopSales.product_id) \
+        .limit(TOP_SALES_SIZE)
+    db.session.execute(delete(TopSales).where(TopSales.product_id.notin_(kept)),
+                       execution_options={'synchronize_session': False})
+
+
+def rebuild_top_sales():
+    db.session.execute(delete(TopSales))
+    db.session.execute(sqlite_insert(TopSales).from_select(
+        ['product_id', 'sold'],
+        select(Products.id, Products.sold)
+        .where(Products.sold > 0)
+        .order_by(Products.sold.desc(), Products.id)
+        .limit(TOP_SALES_SIZE)
+    ))
+    bump_cache_version('catalog')
+    db.session.commit()
+
+
+def top_selling_products(limit):
+    # подзапрос с LIMIT SQLite не разворачивает: сначала читается рейтинг
+    # (TOP_SALES_SIZE строк), затем товары по первичному ключу, а не все
+    # товары в наличии
+    top = select(TopSales.product_id, TopSales.sold) \
+        .order_by(TopSales.sold.desc()) \
+        .limit(TOP_SALES_SIZE) \
+        .subquery()
+    products = Products.query \
+        .join(top, top.c.product_id == Products.id) \
+        .filter(IN_STOCK) \
+        .order_by(top.c.sold.desc(), Products.id) \
+        .limit(limit) \
+        .all()
+    if len(products) < limit:
+        # продаж ещё мало: добиваем список остальными товарами в наличии
+        products += Products.query \
+            .filter(IN_STOCK, Products.id.notin_([product.id for product in products])) \
+            .order_by(Products.sold.desc(), Products.id) \
+            .limit(limit - len(products)) \
+            .all()
+    return products
+
+
+@click.command('rebuild-top-sales')
+@with_appcontext
+def rebuild_top_sales_command():
+    """Пересчитать рейтинг продаж по счётчикам товаров."""
+    rebuild_top_sales()
+    click.echo(f'Товаров в рейтинге: {TopSales.query.count()}')
+
+
+class KeysOutOfStock(Exception):
+    pass
+
+
+def claim_activation_keys(product_id, count):
+    # Резервирует и удаляет count ключей товара одним DELETE ... RETURNING.
+    # Запрос выполняется внутри текущей транзакции сессии: SQLite держит
+    # блокировку записи до commit, поэтому параллельные оформления заказа
+    # в разных процессах не могут получить один и тот же ключ.
+    keys = key_pool.claim(product_id, count) if key_pool.enabled else []
+    if len(keys) < count:
+        # сначала свободные ключи, и только если их не хватает - арендованные
+        # другими процессами: владелец такого ключа не найдёт его при продаже
+        # и возьмёт другой, а последние ключи не застрянут в чужих пулах
+        keys += delete_activation_keys(product_id, count - len(keys), ActivationKeys.available(datetime.utcnow()))
+    if len(keys) < count:
+        keys += delete_activation_keys(product_id, count - len(keys))
+    if len(keys) < count:
+        raise KeysOutOfStock(product_id)
+    return keys
+
+
+def delete_activation_keys(product_id, count, *criteria):
+    claimed = select(ActivationKeys.id) \
+        .where(ActivationKeys.product_id == product_id, *criteria) \
+        .order_by(ActivationKeys.id) \
+        .limit(count) \
+        .scalar_subquery()
+    return db.session.execute(
+        delete(ActivationKeys)
+        .where(ActivationKeys.id.in_(claimed))
+        .returning(ActivationKeys.key),
+        execution_options={'synchronize_session': False}
+    ).scalars().all()
+
+
+def lease_activation_keys(product_id, count, owner, until):
+    # Арендует до count свободных ключей товара и возвращает [(id, key)]
+    now = datetime.utcnow()
+    free = select(ActivationKeys.id) \
+        .where(ActivationKeys.product_id == product_id, ActivationKeys.available(now)) \
+        .order_by(ActivationKeys.id) \
+        .limit(count) \
+        .scalar_subquery()
+    leased = db.session.execute(
+        update(ActivationKeys)
+        .where(ActivationKeys.id.in_(free))
+        .values(lease_owner=owner, leased_until=until)
+        .returning(ActivationKeys.id, ActivationKeys.key),
+        execution_options={'synchronize_session': False}
+    ).all()
+    db.session.commit()
+    return sorted(leased)
+
+
+def extend_key_leases(ids, owner, until):
+    # Продлевает (или при until=None снимает) аренду ключей, которые ещё
+    # принадлежат owner; возвращает id ключей, которые он потерял
+    kept = set()
+    for start in range(0, len(ids), 500):
+        kept.update(db.session.execute(
+            update(ActivationKeys)
+            .where(ActivationKeys.id.in_(ids[start:start + 500]), ActivationKeys.lease_owner == owner)
+            .values(lease_owner=owner if until else None, leased_until=until)
+            .returning(ActivationKeys.id),
+            execution_options={'synchronize_session': False}
+        ).scalars())
+    db.session.commit()
+    return set(ids) - kept
+
+
+class KeyPool:
+    # Ключи, заранее арендованные процессом: pay() берёт их из памяти и
+    # удаляет по первичному ключу, а фоновый поток доливает пулы пачками
+    # по KEY_POOL_BATCH и продлевает аренду. Аренда хранится в
+    # activation_keys (lease_owner, leased_until), поэтому ключи упавшего
+    # процесса через KEY_POOL_LEASE секунд снова достаются другим.
+    def __init__(self, app):
+        self.app = app
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.pools = {}
+        self.wanted = set()
+        self.owner = None
+        self.pid = None
+
+    @property
+    def enabled(self):
+        return self.app.config['KEY_POOL_ENABLED']
+
+    def start(self):
+        with self.lock:
+            # после fork пулы и аренда родителя дочернему процессу не принадлежат
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.owner = f'{self.pid}-{secrets.token_hex(8)}'
+            self.pools = {}
+            self.wanted = set()
+            threading.Thread(target=self.run, name='key-pool', daemon=True).start()
+            atexit.register(self.release, self.pid)
+
+    def take(self, product_id, count):
+        # Забирает из пула до count ключей [(id, key)] и при нехватке
+        # просит фоновый поток долить пул
+        self.start()
+        with self.lock:
+            pool = self.pools.setdefault(product_id, collections.deque())
+            taken = [pool.popleft() for _ in range(min(count, len(pool)))]
+            if len(pool) < self.app.config['KEY_POOL_LOW']:
+                self.wanted.add(product_id)
+                self.wakeup.set()
+        return taken
+
+    def put_back(self, product_id, keys):
+        with self.lock:
+            self.pools.setdefault(product_id, collections.deque()).extendleft(reversed(keys))
+
+    def claim(self, product_id, count):
+        # Продаёт ключи из пула в текущей транзакции. Ключ, аренду которого
+        # перехватил другой процесс, не удалится и будет заменён ключом из базы.
+        taken = self.take(product_id, count)
+        if not taken:
+            return []
+        sold = dict(db.session.execute(
+            delete(ActivationKeys)
+            .where(ActivationKeys.id.in_([id for id, _ in taken]), ActivationKeys.lease_owner == self.owner)
+            .returning(ActivationKeys.id, ActivationKeys.key),
+            execution_options={'synchronize_session': False}
+        ).all())
+        # при откате транзакции ключи вернутся в пул (см. return_pooled_keys)
+        db.session.info.setdefault('pooled_keys', []).append((product_id, sorted(sold.items())))
+        return [key for id, key in taken if id in sold]
+
+    def held(self):
+        with self.lock:
+            return [id for pool in self.pools.values() for id, _ in pool]
+
+    def run(self):
+        config = self.app.config
+        renew_at = time.monotonic() + config['KEY_POOL_LEASE'] / 3
+        while True:
+            self.wakeup.wait(max(renew_at - time.monotonic(), 0))
+            self.wakeup.clear()
+            try:
+                with self.app.app_context():
+                    with self.lock:
+                        wanted, self.wanted = self.wanted, set()
+                    for product_id in wanted:
+                        self.refill(product_id)
+                    if time.monotonic() >= renew_at:
+                        renew_at = time.monotonic() + config['KEY_POOL_LEASE'] / 3
+                        self.drop(extend_key_leases(self.held(), self.owner, self.lease_until()))
+            except Exception:
+                self.app.logger.exception('key pool')
+
+    def lease_until(self):
+        return datetime.utcnow() + timedelta(seconds=self.app.config['KEY_POOL_LEASE'])
+
+    def refill(self, product_id):
+        with self.lock:
+            missing = self.app.config['KEY_POOL_BATCH'] - len(self.pools.get(product_id, ()))
+        if missing > 0:
+            keys = lease_activation_keys(product_id, missing, self.owner, self.lease_until())
+            with self.lock:
+                self.pools.setdefault(product_id, collections.deque()).extend(keys)
+
+    def drop(self, ids):
+        # ключи, проданные другими процессами после истечения аренды
+        if ids:
+            with self.lock:
+                for product_id, pool in self.pools.items():
+                    self.pools[product_id] = collections.deque(key for key in pool if key[0] not in ids)
+
+    def release(self, pid):
+        # при штатной остановке процесса аренда снимается сразу, а не по таймауту
+        if pid != os.getpid():
+            return
+        try:
+            with self.app.app_context():
+                extend_key_leases(self.held(), self.owner, None)
+        except Exception:
+            self.app.logger.exception('key pool: release')
+
 
+key_pool = LocalProxy(lambda: current_app.extensions['key_pool'])
 
-@app.route('/pay', methods=['GET', 'POST'])
+
+@event.listens_for(Session, 'after_commit')
+def forget_pooled_keys(session):
+    session.info.pop('pooled_keys', None)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def return_pooled_keys(session, transaction):
+    # после отката удалённые ключи снова в базе и по-прежнему арендованы процессом
+    if transaction.parent is None:
+        for product_id, keys in session.info.pop('pooled_keys', ()):
+            key_pool.put_back(product_id, keys)
+
+
+@cart_bp.route('/pay', methods=['GET', 'POST'])
 def pay():
     form = PaymentForm()
-    if form.validate_on_submit() and 'Shoppingcart' in session:
+    cart_id = current_cart_id()
+    items = cart_store.items(cart_id) if cart_id else {}
+    if not items:
+        flash('Ваша корзина пуста!')
+        return redirect(url_for('storefront.catalog'))
+    if form.validate_on_submit():
         email = form.email.data
         card_num = form.card_number.data
         keys = []
-        for key, prod in session['Shoppingcart'].items():
-            count = int(prod['quantity'])
-            name = prod['name']
-            product = Products.query.get_or_404(key)
-            for i in range(count):
-                keys.append(product.keys[i].key + ' ' + name)
-            for j in range(count):
-                db.session.delete(product.keys[j])
-                db.session.commit()
-            product.stock = int(product.stock) - count
-            db.session.commit()
-        send_notification(email, '\n'.join(keys))
+        # весь заказ - одна транзакция: либо выданы все ключи, либо ни одного
         try:
-            session.pop('Shoppingcart', None)
-        except Exception as e:
-            print(e)
+            for product, count in cart_lines(items):
+                for activation_key in claim_activation_keys(product.id, count):
+                    keys.append(activation_key + ' ' + product.name)
+                record_sale(product.id, count)
+            send_notification(email, '\n'.join(keys))
+            bump_cache_version('catalog')
+            cart_store.clear(cart_id)
+            db.session.commit()
+        except KeysOutOfStock:
+            db.session.rollback()
+            flash('Недостаточно ключей для оформления заказа')
+            return redirect(url_for('cart.get_cart'))
+        session.pop('cart_id', None)
+        session.pop('cart_size', None)
         flash('Покупка прошла успешно!')
-        return redirect(url_for('index'))
-    elif 'Shoppingcart' not in session:
-        flash('Ваша корзина пуста!')
-        return redirect(url_for('catalog'))
+        return redirect(url_for('storefront.index'))
     return render_template('pay.html', form=form)
 
 
-@app.route('/search', methods=['POST'])
+@storefront_bp.route('/search', methods=['POST'])
+@limiter.limit('60/minute', burst=20, key=client_ip)
+@limiter.concurrency('search', 8)
+@read_only_db
 def search():
     form = SearchForm()
-    products = Products.query
-    product.searched = form.searched.data
-    if form.validate_on_submit() and product.searched:
-        products = products.filter(Products.name.like('%' + product.searched + '%')).all()
-        return render_template('search.html', form=form, searched=product.searched, products=products)
+    searched = form.searched.data
+    if form.validate_on_submit() and searched:
+        results = search_products(searched)
+        return render_template('search.html', form=form, searched=searched, results=results)
     else:
-        return redirect(url_for('index'))
+        return redirect(url_for('storefront.index'))
 
 
-@app.route('/admin')
+@admin_bp.route('/admin')
 @login_required
 def admin():
     if current_user.id == 1:
@@ -588,41 +2120,196 @@ def admin():
         return render_template('admin.html', products=products)
     else:
         flash('У вас нет прав доступа')
-        return redirect(url_for('index'))
+        return redirect(url_for('storefront.index'))
 
 
-@app.route('/')
+TOP_SALES_SHOWN = 4
+
+
+@storefront_bp.route('/')
+@read_only_db
 def index():
-    product = Products.query.order_by(Products.stock).filter(Products.stock > 0)
-    count = 4 if len(list(product)) > 4 else len(list(product))
-    return render_template('index.html', product=product, count=count)
+    return render_cached_page('index.html', ('index',),
+                              lambda: dict(products=top_selling_products(TOP_SALES_SHOWN)))
 
 
-@app.route('/catalog')
+@storefront_bp.route('/catalog')
+@read_only_db
 def catalog():
-    products = Products.query.filter(Products.stock > 0)
-    return render_template('catalog.html', products=products)
+    return render_cached_page('catalog.html', ('catalog',),
+                              lambda: dict(products=Products.query.filter(IN_STOCK).order_by(Products.id)))
+
 
+@admin_bp.route('/admin/cache-stats')
+@login_required
+def cache_stats():
+    if current_user.id == 1:
+        return jsonify({'pid': os.getpid(), 'page_cache': page_cache.stats(),
+                        'identity_cache': identity_cache.stats(), 'cart_products': cart_products.stats()})
+    else:
+        flash('У вас нет прав доступа')
+        return redirect(url_for('storefront.index'))
 
-@app.route('/guarantees')
+
+@admin_bp.route('/admin/slow-requests')
+@login_required
+def slow_requests():
+    if current_user.id == 1:
+        return jsonify({'pid': os.getpid(), 'threshold': current_app.config['METRICS_SLOW_REQUEST'],
+                        'requests': metrics.slow_requests()})
+    else:
+        flash('У вас нет прав доступа')
+        return redirect(url_for('storefront.index'))
+
+
+@storefront_bp.route('/guarantees')
 def guarantees():
     return render_template('guarantees.html')
 
 
-@app.errorhandler(404)
+@storefront_bp.app_errorhandler(404)
 def page_not_found(e):
     return render_template('404.html'), 404
 
 
-@app.errorhandler(405)
+@storefront_bp.app_errorhandler(405)
 def page_not_found(e):
     return render_template('404.html'), 404
 
 
-@app.errorhandler(500)
+@storefront_bp.app_errorhandler(429)
+def too_many_requests(e):
+    return render_template('429.html', retry_after=e.retry_after), 429, {'Retry-After': e.retry_after}
+
+
+@storefront_bp.app_errorhandler(500)
 def page_not_found(e):
     return render_template('500.html'), 500
 
 
+@admin_bp.record_once
+def init_admin(state):
+    # редактор описания товара нужен только страницам админки
+    ckeditor.init_app(state.app)
+
+
+CLI_COMMANDS = (search_reindex_command, images_backfill_command, assets_build_command, import_keys_command,
+                sweep_carts_command, send_mail_command, rebuild_top_sales_command, stock_reconcile_command)
+
+
+def create_app(config=None):
+    # config - словарь, переопределяющий настройки по умолчанию (в том числе из переменных окружения)
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///users.db')
+    # профиль PRAGMA для SQLite (см. dbprofile.SQLITE_PROFILES) и пулы соединений
+    app.config['DB_PROFILE'] = os.environ.get('DB_PROFILE', 'tuned')
+    app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 10))
+    app.config['DB_POOL_OVERFLOW'] = int(os.environ.get('DB_POOL_OVERFLOW', 20))
+    app.config['DB_READONLY_POOL'] = os.environ.get('DB_READONLY_POOL', '0') == '1'
+    app.config['SECRET_KEY'] = 'dsjahfjshdfjasf54564'
+
+    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    app.config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', 2))
+
+    # почта: для локальной проверки можно указать MAIL_SERVER=localhost, MAIL_USE_TLS=0, MAIL_USERNAME=
+    app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.yandex.ru')
+    app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 587))
+    app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', '1') == '1'
+    app.config['MAIL_USERNAME'] = os.environ.get('MAIL_USERNAME', 'makeev12358@yandex.ru')
+    app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD', 'dhepsvxameykejpq')
+    app.config['MAIL_SENDER'] = os.environ.get('MAIL_SENDER', 'makeev12358@yandex.ru')
+    app.config['MAIL_TIMEOUT'] = 30
+    app.config['MAIL_WORKERS'] = int(os.environ.get('MAIL_WORKERS', 2))
+    app.config['MAIL_BATCH_SIZE'] = 20
+    app.config['MAIL_MAX_ATTEMPTS'] = 6
+    app.config['MAIL_RETRY_BASE'] = 30
+    app.config['MAIL_LEASE'] = 300
+    app.config['MAIL_IDLE_TIMEOUT'] = 60
+
+    # кэш отрендеренных страниц каталога (в памяти каждого процесса)
+    app.config['PAGE_CACHE_ENABLED'] = os.environ.get('PAGE_CACHE_ENABLED', '1') == '1'
+    app.config['PAGE_CACHE_MAX_ENTRIES'] = 2048
+    app.config['PAGE_CACHE_MAX_BYTES'] = 32 * 1024 * 1024
+
+    # кэш пользователей для load_user и JWT: другие процессы видят изменения не позже чем через TTL
+    app.config['IDENTITY_CACHE_SIZE'] = 10000
+    app.config['IDENTITY_CACHE_TTL'] = 60
+
+    # кэш товаров для строк корзины, ключ - (id товара, версия каталога)
+    app.config['CART_PRODUCT_CACHE_SIZE'] = 4096
+
+    # sql - корзины на сервере, в cookie сессии только id корзины;
+    # cookie - id товаров и количества в самой cookie (см. CookieCartStore)
+    app.config['CART_STORE'] = os.environ.get('CART_STORE', 'sql')
+    app.config['CART_TTL'] = timedelta(days=30)
+    app.config['CART_SWEEP_INTERVAL'] = 3600
+
+    # пул заранее арендованных ключей в каждом процессе (см. KeyPool): пачка
+    # KEY_POOL_BATCH ключей на товар, долив при остатке меньше KEY_POOL_LOW,
+    # аренда на KEY_POOL_LEASE секунд продлевается, пока процесс жив
+    app.config['KEY_POOL_ENABLED'] = os.environ.get('KEY_POOL_ENABLED', '0') == '1'
+    app.config['KEY_POOL_BATCH'] = 50
+    app.config['KEY_POOL_LOW'] = 10
+    app.config['KEY_POOL_LEASE'] = 300
+
+    # ограничения дорогих endpoint (вход, поиск, пакетный API), см. ratelimit.RateLimiter;
+    # RATELIMIT_STORAGE=sqlite:////dev/shm/ratelimit.db - общие вёдра для всех воркеров машины
+    app.config['RATELIMIT_ENABLED'] = os.environ.get('RATELIMIT_ENABLED', '1') == '1'
+    app.config['RATELIMIT_STORAGE'] = os.environ.get('RATELIMIT_STORAGE', 'memory')
+
+    # метрики Prometheus на /metrics; X-Query-Count/X-DB-Time в ответах только для отладки
+    app.config['METRICS_DEBUG_HEADERS'] = os.environ.get('METRICS_DEBUG_HEADERS', '0') == '1'
+    app.config['METRICS_SLOW_REQUEST'] = float(os.environ.get('METRICS_SLOW_REQUEST', 1.0))
+    app.config['METRICS_SLOW_KEEP'] = 20
+
+    # сериализация JSON: orjson (если установлен) или стандартный json
+    app.config['JSON_PROVIDER'] = os.environ.get('JSON_PROVIDER', 'orjson')
+
+    # поиск N+1: off, log или raise; по умолчанию log в режиме отладки
+    app.config['QUERY_NPLUSONE'] = os.environ.get('QUERY_NPLUSONE', 'log' if app.debug else 'off')
+    app.config['QUERY_NPLUSONE_THRESHOLD'] = 5
+
+    # команды flask (и Flask-Migrate с alembic) не нужны воркерам веб-сервера, см. wsgi.py
+    app.config['CLI_COMMANDS'] = True
+
+    if config:
+        app.config.update(config)
+
+    configure_json(app)
+    configure_database(app)
+    db.init_app(app)
+    apply_sqlite_profile(app, db)
+    assets.init_app(app)
+    metrics.init_app(app, db)
+    query_tracker.init_app(app, db)
+    limiter.init_app(app)
+    jwt.init_app(app)
+    login_manager.init_app(app)
+
+    app.extensions['identity_cache'] = LRUCache(app.config['IDENTITY_CACHE_SIZE'],
+                                                ttl=app.config['IDENTITY_CACHE_TTL'])
+    app.extensions['page_cache'] = LRUCache(app.config['PAGE_CACHE_MAX_ENTRIES'], app.config['PAGE_CACHE_MAX_BYTES'],
+                                            sizeof=page_blocks_size)
+    app.extensions['cart_products'] = LRUCache(app.config['CART_PRODUCT_CACHE_SIZE'])
+    app.extensions['cart_store'] = CART_STORES[app.config['CART_STORE']]()
+    app.extensions['image_pool'] = ImagePool(app)
+    app.extensions['cart_sweeper'] = CartSweeper(app)
+    app.extensions['mail_workers'] = MailWorkerPool(app)
+    app.extensions['key_pool'] = KeyPool(app)
+
+    app.register_blueprint(storefront_bp)
+    app.register_blueprint(cart_bp)
+    app.register_blueprint(admin_bp)
+    app.register_blueprint(api_bp)
+
+    if app.config['CLI_COMMANDS']:
+        from flask_migrate import Migrate
+
+        Migrate(app, db, include_object=include_object)
+        for command in CLI_COMMANDS:
+            app.cli.add_command(command)
+    return app
+
+
 if __name__ == '__main__':
-    app.run()
+    create_app().run()
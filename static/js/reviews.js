@@ -0,0 +1,25 @@
+// "Показать ещё": следующая страница отзывов подгружается фрагментом
+// /reviews/page?after=... и добавляется в конец ленты; без JS ссылка
+// открывает ту же страницу целиком
+document.addEventListener('click', function (event) {
+    var link = event.target.closest('[data-load-more] a');
+    if (!link) {
+        return;
+    }
+    event.preventDefault();
+    var more = link.parentElement;
+    fetch(link.dataset.fragment)
+        .then(function (response) {
+            if (!response.ok) {
+                throw new Error(response.status);
+            }
+            return response.text();
+        })
+        .then(function (html) {
+            more.insertAdjacentHTML('afterend', html);
+            more.remove();
+        })
+        .catch(function () {
+            window.location = link.href;
+        });
+});
@@ -37,7 +37,6 @@ class PaymentForm(FlaskForm):
 class AddProductForm(FlaskForm):
     name = StringField("Название", validators=[DataRequired()])
     price = IntegerField("Цена", validators=[DataRequired()])
-    stock = IntegerField("Количество", validators=[DataRequired()])
     description = CKEditorField('Описание', validators=[DataRequired()])
     keys = FileField('Ключи Активации(.txt)', validators=[DataRequired()])
     img_1 = FileField('Главное фото', validators=[DataRequired()])
@@ -0,0 +1,21 @@
+# Точка входа для pre-fork сервера (gunicorn -c gunicorn.conf.py wsgi:app).
+# С preload_app приложение создаётся один раз в мастер-процессе, а воркеры
+# получают его через fork: соединения SQLite, открытые в мастере, нельзя
+# использовать в дочерних процессах, поэтому пулы движков сбрасываются
+# сразу после fork. Фоновые потоки (почта, корзины, пул фото) сами
+# запускаются заново в каждом воркере.
+from server import create_app, db
+
+import os
+
+app = create_app({'CLI_COMMANDS': False})
+
+
+def dispose_engines():
+    # close=False: не закрывать соединения родителя, а только забыть о них
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=dispose_engines)